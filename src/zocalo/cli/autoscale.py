@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+import workflows.transport
+import yaml
+
+import zocalo.configuration
+
+#
+# zocalo.autoscale
+#   Recommend numbers of service instances from queue backlogs and throughput
+#
+
+
+def _write_atomically(path: Path, data: dict[str, Any]) -> None:
+    tmp = path.with_name(f".{path.name}.tmp")
+    with tmp.open("w") as fh:
+        json.dump(data, fh, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    tmp.replace(path)
+
+
+def run() -> None:
+    zc = zocalo.configuration.from_file()
+    zc.activate()
+
+    parser = argparse.ArgumentParser(
+        usage="zocalo.autoscale [options] policies.yaml",
+        description="Recommend numbers of instances for zocalo services from"
+        " the backlog and throughput of the queues they consume. Each"
+        " recommendation is written as a JSON document.",
+    )
+    parser.add_argument("-?", action="help", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "policies",
+        type=Path,
+        help="YAML file mapping service names to scaling policies",
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        dest="interval",
+        type=float,
+        default=30,
+        help="Number of seconds between recommendations (default: 30)",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Exit after the first recommendation. Queues are still observed"
+        " twice, one interval apart, to measure message rates.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        type=Path,
+        default=None,
+        help="Also write the latest recommendation to this file",
+    )
+    parser.add_argument(
+        "--broadcast",
+        dest="broadcast",
+        default=None,
+        metavar="TOPIC",
+        help="Also broadcast recommendations on this topic",
+    )
+    parser.add_argument(
+        "--no-status",
+        dest="status",
+        action="store_false",
+        help="Do not listen to service status broadcasts, and count queue"
+        " consumers as service instances instead",
+    )
+    zc.add_command_line_options(parser)
+    workflows.transport.add_command_line_options(parser, transport_argument=True)
+    args = parser.parse_args()
+
+    from zocalo.util.autoscale import (
+        COLUMNS,
+        AutoscaleAdvisor,
+        ScalingPolicy,
+        ServiceStatusMonitor,
+    )
+    from zocalo.util.rabbitmq import RabbitMQAPI
+
+    try:
+        policies = {
+            service: ScalingPolicy(**policy)
+            for service, policy in (yaml.safe_load(args.policies.read_text()) or {})
+            .get("services", {})
+            .items()
+        }
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        sys.exit(f"Could not read scaling policies from {args.policies}: {e}")
+    if not policies:
+        sys.exit(f"No services defined in {args.policies}")
+
+    api = RabbitMQAPI.from_zocalo_configuration(zc)
+    advisor = AutoscaleAdvisor(policies)
+
+    transport = None
+    monitor = None
+    if args.status or args.broadcast:
+        transport = workflows.transport.lookup(args.transport)()
+        transport.connect()
+    if args.status:
+        assert transport is not None
+        monitor = ServiceStatusMonitor(transport)
+        monitor.start()
+
+    def observe() -> list[Any]:
+        return list(api.iter_queues(columns=COLUMNS))
+
+    try:
+        # The first observation only establishes the message counters, and
+        # allows status broadcasts of running services to arrive
+        advisor.recommend(observe())
+        next_poll = time.monotonic() + args.interval
+        while True:
+            time.sleep(max(next_poll - time.monotonic(), 0))
+            next_poll += args.interval
+            recommendations = advisor.recommend(
+                observe(), monitor.instances() if monitor else None
+            )
+            document = {
+                "timestamp": time.time(),
+                "services": [r._asdict() for r in recommendations],
+            }
+            print(json.dumps(document), flush=True)
+            if args.output:
+                _write_atomically(args.output, document)
+            if args.broadcast:
+                assert transport is not None
+                transport.broadcast(args.broadcast, document)
+            if args.once:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if transport is not None:
+            transport.disconnect()
+
+
+if __name__ == "__main__":
+    run()
@@ -2,12 +2,17 @@ from __future__ import annotations
 
 import argparse
 import configparser
+import enum
 import functools
+import hashlib
+import json
 import logging
+import os
 import sys
-from collections.abc import Sequence
+from collections.abc import Callable, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple
 
 import requests
 import yaml
@@ -16,11 +21,13 @@ from pydantic import BaseModel
 import zocalo.configuration
 from zocalo.util.rabbitmq import (
     BindingSpec,
+    Definitions,
     DestinationType,
     ExchangeSpec,
     ExchangeType,
     PermissionSpec,
     PolicySpec,
+    QueueInfo,
     QueueSpec,
     UserSpec,
     VHostSpec,
@@ -40,6 +47,12 @@ class RabbitMQAPI(_RabbitMQAPI):
     def delete_component(self, component: BaseModel) -> None:
         raise NotImplementedError(f"Component {component} not recognised")
 
+    def apply_change(self, change: Change) -> None:
+        if change.action is Action.DELETE:
+            self.delete_component(change.component)
+        else:
+            self.create_component(change.component)
+
     @create_component.register
     def _(self, binding: BindingSpec) -> None:
         self.binding_declare(binding)
@@ -77,11 +90,140 @@ class RabbitMQAPI(_RabbitMQAPI):
     def _(self, permissions: PermissionSpec) -> None:
         self.clear_permissions(vhost=permissions.vhost, user=permissions.user)
 
+    @create_component.register
+    def _(self, policy: PolicySpec) -> None:
+        self.set_policy(policy)
+
+    @delete_component.register
+    def _(self, policy: PolicySpec) -> None:
+        self.clear_policy(vhost=policy.vhost, name=policy.name)
+
+    @create_component.register
+    def _(self, queue: QueueSpec) -> None:
+        self.queue_declare(queue)
+
+    @delete_component.register
+    def _(self, queue: QueueSpec) -> None:
+        self.queue_delete(vhost=queue.vhost, name=queue.name)
+
+    @create_component.register
+    def _(self, user: UserSpec) -> None:
+        self.user_put(user)
+
+    @delete_component.register
+    def _(self, user: UserSpec) -> None:
+        self.user_delete(name=user.name)
+
+    def import_components(self, components: Sequence[BaseModel]) -> None:
+        """Create or update many components with a single definitions import."""
+        definitions = Definitions()
+        for component in components:
+            getattr(definitions, DEFINITIONS_FIELDS[type(component)]).append(component)
+        self.import_definitions(definitions)
+
+
+class Action(enum.Enum):
+    CREATE = "+"
+    UPDATE = "~"
+    DELETE = "-"
+
+
+class Change(NamedTuple):
+    action: Action
+    component: BaseModel
+    # The component currently on the server, for updates
+    current: BaseModel | None = None
+
+    def __str__(self) -> str:
+        kind = type(self.component).__name__.removesuffix("Spec").lower()
+        description = f"{self.action.value} {kind} {_describe(self.component)}"
+        if self.action is Action.UPDATE and self.current is not None:
+            differences = [
+                f"{key}: "
+                + (
+                    "changed"
+                    if key == "password_hash"
+                    else f"{getattr(self.current, key)!r} -> {value!r}"
+                )
+                for key, value in self.component
+                if getattr(self.current, key) != value
+            ]
+            description += f" ({', '.join(differences)})"
+        return description
+
+
+# The field of the definitions holding each type of component
+DEFINITIONS_FIELDS: dict[type[BaseModel], str] = {
+    UserSpec: "users",
+    VHostSpec: "vhosts",
+    PermissionSpec: "permissions",
+    PolicySpec: "policies",
+    ExchangeSpec: "exchanges",
+    QueueSpec: "queues",
+    BindingSpec: "bindings",
+}
+
+# Components are created and updated in this order, and deleted in the
+# reverse order, so that every component is created after, and deleted before,
+# the components it depends on
+COMPONENT_ORDER: tuple[type[BaseModel], ...] = (
+    UserSpec,
+    VHostSpec,
+    PermissionSpec,
+    PolicySpec,
+    ExchangeSpec,
+    QueueSpec,
+    BindingSpec,
+)
+
+
+@functools.singledispatch
+def _component_id(component: BaseModel) -> tuple[str, ...]:
+    """The identity of a component on the server. Components with the same
+    identity can not coexist."""
+    return (component.vhost, component.name)  # type: ignore[attr-defined]
+
+
+@_component_id.register
+def _(component: VHostSpec) -> tuple[str, ...]:
+    return (component.name,)
+
+
+@_component_id.register
+def _(component: UserSpec) -> tuple[str, ...]:
+    return (component.name,)
+
+
+@_component_id.register
+def _(component: PermissionSpec) -> tuple[str, ...]:
+    return (component.vhost, component.user)
+
+
+@_component_id.register
+def _(component: BindingSpec) -> tuple[str, ...]:
+    # Bindings are identified by all of their properties, so that any change
+    # to a binding replaces it
+    return (
+        component.vhost,
+        component.source,
+        component.destination_type.value,
+        component.destination,
+        component.routing_key,
+        json.dumps(component.arguments or {}, sort_keys=True),
+    )
+
 
 @functools.singledispatch
-def _info_to_spec(incoming: BaseModel, infos: Sequence[BaseModel]) -> list[BaseModel]:
-    cls = type(incoming)
-    return [cls(**i.model_dump()) for i in infos]
+def _describe(component: BaseModel) -> str:
+    return "/".join(_component_id(component))
+
+
+@_describe.register
+def _(component: BindingSpec) -> str:
+    return (
+        f"{component.vhost}/{component.source or 'default'}->{component.destination}"
+        f" ({component.routing_key})"
+    )
 
 
 @functools.singledispatch
@@ -103,28 +245,126 @@ def _(comp: BindingSpec) -> bool:
     return False
 
 
-def update_config(
-    api: RabbitMQAPI, incoming: Sequence[BaseModel], current: Sequence[BaseModel]
-) -> None:
-    cls = type(incoming[0])
-    current = _info_to_spec(incoming[0], current)
-    for cc in current:
-        if cc in incoming:
-            if hasattr(cc, "name"):
-                logger.debug(f"{cls.__name__} {cc.name} already exists")  # type: ignore
-            elif hasattr(cc, "source"):
-                logger.debug(
-                    f"{cls.__name__} {cc.source or 'default'}->{cc.destination} already exists"  # type: ignore
+@_skip.register
+def _(comp: QueueSpec) -> bool:
+    # Leave temporary queues alone
+    return (
+        comp.name == ""
+        or comp.name.startswith("amq.")
+        or bool(comp.auto_delete)
+        or (isinstance(comp, QueueInfo) and bool(comp.exclusive))
+    )
+
+
+def plan_changes(
+    cls: type[BaseModel],
+    incoming: Sequence[BaseModel],
+    current: Sequence[BaseModel],
+    *,
+    replace: bool = False,
+    unique: bool = False,
+) -> list[Change]:
+    """Work out the changes needed to turn the current state of one type of
+    component on the server into the configured state.
+
+    Both states are indexed by component identity, so that planning takes
+    linear time. Components on the server that are not configured are
+    deleted, unless they are reserved or temporary.
+
+    :param cls: The type of component
+    :param incoming: The configured components
+    :param current: The components currently on the server
+    :param replace: Delete and recreate components that differ from their
+                    configuration, rather than updating them in place
+    :param unique: Raise a ValueError if a component is configured twice
+    """
+    kind = cls.__name__.removesuffix("Spec").lower()
+    planned: dict[tuple[str, ...], BaseModel] = {}
+    for component in incoming:
+        component_id = _component_id(component)
+        if component_id in planned:
+            if unique:
+                raise ValueError(
+                    f"Configuration defines duplicate {kind} {component_id}"
                 )
+            continue
+        planned[component_id] = component
+    existing = {_component_id(component): component for component in current}
+
+    changes = []
+    for component_id, component in existing.items():
+        if component_id not in planned and not _skip(component):
+            changes.append(Change(Action.DELETE, cls(**component.model_dump())))
+    for component_id, component in planned.items():
+        if component_id not in existing:
+            changes.append(Change(Action.CREATE, component))
+            continue
+        current_component = cls(**existing[component_id].model_dump())
+        if current_component == component:
+            logger.debug(f"{kind} {_describe(component)} already exists")
+        elif replace:
+            if not _skip(existing[component_id]):
+                changes.append(Change(Action.DELETE, current_component))
+            changes.append(Change(Action.CREATE, component))
         else:
-            if _skip(cc):
+            changes.append(Change(Action.UPDATE, component, current_component))
+    return changes
+
+
+def apply_changes(
+    api: RabbitMQAPI,
+    changes: Sequence[Change],
+    jobs: int = 1,
+    dry_run: bool = False,
+    bulk: bool = False,
+) -> None:
+    """Apply changes to the server.
+
+    Deletions are applied first, in the reverse of COMPONENT_ORDER, followed
+    by creations and updates in COMPONENT_ORDER. Changes to components of the
+    same type do not depend on each other, and are applied concurrently.
+
+    Users are created and updated with a single request.
+
+    :param jobs: Number of changes applied concurrently
+    :param dry_run: Only show the changes, without applying them
+    :param bulk: Apply all creations and updates with a single definitions
+                 import, after all deletions. RabbitMQ imports definitions
+                 in dependency order.
+    """
+    stages: list[tuple[type[BaseModel], Callable[[Change], bool]]] = [
+        (cls, lambda change: change.action is Action.DELETE)
+        for cls in reversed(COMPONENT_ORDER)
+    ] + [
+        (cls, lambda change: change.action is not Action.DELETE)
+        for cls in COMPONENT_ORDER
+    ]
+    bulk_changes: list[Change] = []
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for cls, selected in stages:
+            stage = [
+                change
+                for change in changes
+                if isinstance(change.component, cls) and selected(change)
+            ]
+            for change in stage:
+                logger.info(str(change))
+            if dry_run or not stage:
                 continue
-            logger.info(f"deleting {cls.__name__} {cc}")
-            api.delete_component(cc)
-    for ic in incoming:
-        if ic not in current:
-            logger.info(f"creating {cls.__name__} {ic}")
-            api.create_component(ic)
+            if stage[0].action is not Action.DELETE and (
+                bulk or (cls is UserSpec and len(stage) > 1)
+            ):
+                bulk_changes.extend(stage)
+                if not bulk:
+                    # Create and update all users in a single request
+                    api.import_components([change.component for change in bulk_changes])
+                    bulk_changes.clear()
+                continue
+            futures = [executor.submit(api.apply_change, change) for change in stage]
+            for future in futures:
+                future.result()
+    if bulk_changes and not dry_run:
+        api.import_components([change.component for change in bulk_changes])
 
 
 def get_vhost_specs(vhosts: dict) -> list[VHostSpec]:
@@ -267,19 +507,9 @@ def get_exchange_specs_for_group(group: dict) -> list[ExchangeSpec]:
     ]
 
 
-def _configure_policies(api: RabbitMQAPI, policies: list[dict[str, Any]]) -> None:
-    existing_policies = {
-        (policy.vhost, policy.name): policy for policy in api.policies()
-    }
-    known_policies: set[tuple[str, str]] = set()
-
-    for policy in policies:
-        policy_id = (policy["vhost"], policy["name"])
-        if policy_id in known_policies:
-            raise ValueError(f"Configuration defines duplicate policy {policy_id}")
-        known_policies.add(policy_id)
-
-        policy_spec = PolicySpec(
+def get_policy_specs(policies: list[dict[str, Any]]) -> list[PolicySpec]:
+    return [
+        PolicySpec(
             vhost=policy.get("vhost", "/"),
             name=policy["name"],
             pattern=policy.get("pattern", "^amq."),
@@ -287,104 +517,281 @@ def _configure_policies(api: RabbitMQAPI, policies: list[dict[str, Any]]) -> Non
             priority=policy.get("priority", 0),
             apply_to=policy.get("apply-to", "queues"),  # type: ignore[reportCallIssue]
         )
+        for policy in policies
+    ]
 
-        if policy_id in existing_policies:
-            if existing_policies[policy_id] == policy_spec:
-                continue
-            logger.info(f"Updating policy: {policy_spec}")
-        else:
-            logger.info(f"Creating policy: {policy_spec}")
-        api.set_policy(policy_spec)
-
-    for policy_id in set(existing_policies) - known_policies:
-        logger.info(f"Removing undefined policy {policy_id}")
-        api.clear_policy(vhost=policy_id[0], name=policy_id[1])
 
+class _UserConfig(NamedTuple):
+    path: Path
+    digest: str
+    username: str
+    # None if the file was not parsed, as it is unchanged since the last run
+    password: str | None
+    tags: list[str]
 
-def _configure_queues(api: RabbitMQAPI, queues: list[QueueSpec]) -> None:
-    existing_queues = {(q.vhost, q.name): q for q in api.queues()}
-    known_queues: set[tuple[str, str]] = set()
 
-    for queue_spec in queues:
-        queue_id = (queue_spec.vhost, queue_spec.name)
-        if queue_id in known_queues:
-            raise ValueError(f"Configuration defines duplicate queue {queue_id}")
-        known_queues.add(queue_id)
+def _read_user_config(
+    config_file: Path, state: dict[str, dict[str, Any]] | None = None
+) -> _UserConfig:
+    try:
+        content = config_file.read_bytes()
+    except OSError:
+        raise ValueError(f"Could not read configuration file {config_file}")
+    digest = hashlib.sha256(content).hexdigest()
+    entry = (state or {}).get(str(config_file))
+    if entry and entry.get("sha256") == digest:
+        return _UserConfig(config_file, digest, entry["username"], None, entry["tags"])
+    try:
+        config = configparser.ConfigParser()
+        config.read_string(content.decode(), source=str(config_file))
+        username = config["rabbitmq"]["username"]
+        password = config["rabbitmq"]["password"]
+        assert username, "Configuration file does not contain a username"
+        assert password, "Configuration file does not specify a password"
+        tags = config["rabbitmq"].get("tags", "").split(",")
+    except Exception:
+        raise ValueError(f"Could not parse configuration file {config_file}")
+    return _UserConfig(config_file, digest, username, password, tags)
+
+
+def load_user_state(path: Path) -> dict[str, dict[str, Any]]:
+    """Read the state recorded for each user configuration file by a previous
+    run. Returns an empty state if the file does not exist or is unreadable."""
+    try:
+        with path.open() as fh:
+            state = json.load(fh)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning(f"Ignoring invalid user state file {path}")
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def save_user_state(path: Path, state: dict[str, dict[str, Any]]) -> None:
+    """Record the state of each user configuration file. The file is only
+    readable by its owner, as it describes the configured users."""
+    tmp = path.with_name(f".{path.name}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The temporary file may be left over from an earlier run
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as fh:
+        json.dump(state, fh, indent=1, sort_keys=True)
+    tmp.replace(path)
+
+
+def _plan_users(
+    existing_users: Sequence[UserSpec],
+    rabbitmq_user_config_area: Path,
+    jobs: int = 1,
+    state: dict[str, dict[str, Any]] | None = None,
+) -> list[Change]:
+    """Work out the changes needed to bring the users on the server in line
+    with the user configuration files.
+
+    Configuration files are read with up to jobs threads. If a state is given,
+    files whose content hash matches the state recorded by a previous run,
+    and whose user is unchanged on the server since then, are not compared
+    again. The state is updated in place to describe the server after the
+    changes have been applied.
+    """
+    existing = {user.name: user for user in existing_users}
+    previous_state = dict(state or {})
+    new_state: dict[str, dict[str, Any]] = {}
+
+    def unchanged(user_config: _UserConfig) -> bool:
+        entry = previous_state[str(user_config.path)]
+        user = existing.get(user_config.username)
+        return (
+            user is not None
+            and user.password_hash == entry["password_hash"]
+            and set(user.tags) == set(entry["tags"])
+        )
 
-        if queue_id in existing_queues:
-            equivalent_definition = all(
-                getattr(existing_queues[queue_id], key) == value
-                for key, value in queue_spec
+    config_files = sorted(rabbitmq_user_config_area.glob("**/*.ini"))
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        user_configs = list(
+            executor.map(
+                functools.partial(_read_user_config, state=previous_state),
+                config_files,
             )
-            if equivalent_definition:
-                continue
-            logger.info(f"Updating queue: {queue_spec}")
-        else:
-            logger.info(f"Creating queue: {queue_spec}")
-        api.queue_declare(queue_spec)
-
-    for queue_id in set(existing_queues) - known_queues:
-        if (
-            existing_queues[queue_id].name == ""
-            or existing_queues[queue_id].name.startswith("amq.")
-            or existing_queues[queue_id].auto_delete
-            or existing_queues[queue_id].exclusive
-        ):
-            # Leave temporary queues alone
-            continue
-        logger.info(f"Removing undefined queue {queue_id}")
-        api.queue_delete(vhost=queue_id[0], name=queue_id[1])
-
-
-def _configure_users(api: RabbitMQAPI, rabbitmq_user_config_area: Path) -> None:
-    existing_users = {user.name: user for user in api.users()}
+        )
 
     planned_users: dict[str, Path] = {}
-    for config_file in rabbitmq_user_config_area.glob("**/*.ini"):
-        try:
-            config = configparser.ConfigParser()
-            config.read(config_file)
-            username = config["rabbitmq"]["username"]
-            password = config["rabbitmq"]["password"]
-            assert username, "Configuration file does not contain a username"
-            assert password, "Configuration file does not specify a password"
-            tags = config["rabbitmq"].get("tags", "").split(",")
-        except Exception:
-            raise ValueError(f"Could not parse configuration file {config_file}")
+    changes = []
+    for user_config in user_configs:
+        username = user_config.username
         if username in planned_users:
             raise ValueError(
-                f"Configuration file {config_file} declares user {username}, who was previously declared in {planned_users[username]}"
+                f"Configuration file {user_config.path} declares user {username}, who was previously declared in {planned_users[username]}"
             )
-        planned_users[username] = config_file
+        planned_users[username] = user_config.path
 
-        if username in existing_users:
+        if user_config.password is None:
+            if unchanged(user_config):
+                new_state[str(user_config.path)] = previous_state[str(user_config.path)]
+                continue
+            # The user was changed on the server since the last run
+            user_config = _read_user_config(user_config.path)
+            assert user_config.password is not None
+        if username in existing:
             hashed_password = hash_password(
-                password, salt=existing_users[username].password_hash
+                user_config.password, salt=existing[username].password_hash
             )
-            if existing_users[username].password_hash == hashed_password and set(
-                existing_users[username].tags
-            ) == set(tags):
-                continue
-            logger.info(
-                f"Updating user {username} due to password/tag mismatch (tags={tags})"
+            unchanged_user = existing[
+                username
+            ].password_hash == hashed_password and set(existing[username].tags) == set(
+                user_config.tags
             )
         else:
-            hashed_password = hash_password(password)
-            logger.info(
-                f"Creating user {username} not defined on the server (tags={tags})"
-            )
-        api.user_put(
-            UserSpec(
-                name=username,
-                password_hash=hashed_password,
-                hashing_algorithm="rabbit_password_hashing_sha256",  # type: ignore[reportArgumentType]
-                tags=tags,
-            )
+            hashed_password = hash_password(user_config.password)
+            unchanged_user = False
+        new_state[str(user_config.path)] = {
+            "sha256": user_config.digest,
+            "username": username,
+            "password_hash": hashed_password,
+            "tags": user_config.tags,
+        }
+        if unchanged_user:
+            continue
+        user = UserSpec(
+            name=username,
+            password_hash=hashed_password,
+            hashing_algorithm="rabbit_password_hashing_sha256",  # type: ignore[reportArgumentType]
+            tags=user_config.tags,
         )
-
-    for user in set(existing_users) - set(planned_users):
-        logger.info(f"Removing user {user} not defined in the configuration")
-        api.user_delete(name=user)
+        if username in existing:
+            changes.append(Change(Action.UPDATE, user, existing[username]))
+        else:
+            changes.append(Change(Action.CREATE, user))
+
+    for username in set(existing) - set(planned_users):
+        changes.append(Change(Action.DELETE, existing[username]))
+
+    if state is not None:
+        state.clear()
+        state.update(new_state)
+    return changes
+
+
+def _permanent_bindings(
+    bindings: Sequence[BindingSpec], queues: Sequence[QueueSpec]
+) -> list[BindingSpec]:
+    """Select the bindings that are not bound to temporary queues. Exclusive
+    queues are not included in definitions exports, so bindings to them are
+    not selected either."""
+    queues_by_id = {(q.vhost, q.name): q for q in queues}
+    permanent_bindings = []
+    for b in bindings:
+        q = queues_by_id.get((b.vhost, b.destination))
+        if q is None:
+            logger.warning(f"No matching queue found binding {b}")
+        elif not (q.auto_delete or (isinstance(q, QueueInfo) and q.exclusive)):
+            permanent_bindings.append(b)
+    return permanent_bindings
+
+
+def plan_configuration(
+    api: RabbitMQAPI,
+    yaml_data: dict[str, Any],
+    user_config: Path | None = None,
+    jobs: int = 1,
+    user_state: dict[str, dict[str, Any]] | None = None,
+    bulk: bool = False,
+) -> list[Change]:
+    """Compare a RabbitMQ configuration with the current state of the server,
+    and return the changes needed to bring the server in line with it.
+
+    The current state of the server is read once, with up to jobs concurrent
+    requests, or with a single definitions export if bulk is set. See
+    _plan_users for a description of user_state."""
+    vhost_specs = get_vhost_specs(yaml_data.get("vhosts", []))
+    permission_specs = get_permission_specs(yaml_data.get("permissions", []))
+    policy_specs = get_policy_specs(yaml_data["policies"])
+    queue_specs = []
+    exchange_specs = get_exchange_specs(yaml_data["exchanges"])
+    binding_specs = get_binding_specs(yaml_data.get("bindings", []))
+    for group in yaml_data["groups"]:
+        if group.get("settings", {}).get("broadcast"):
+            exchange_specs.extend(get_exchange_specs_for_group(group))
+        else:
+            queue_specs.extend(get_queue_specs(group))
+            binding_specs.extend(get_binding_specs_for_group(group))
+
+    snapshot_requests: dict[type[BaseModel], Callable[[], Sequence[Any]]] = {
+        PolicySpec: api.policies,
+        ExchangeSpec: api.exchanges,
+        QueueSpec: api.queues,
+        BindingSpec: api.bindings,
+    }
+    # Virtual hosts and permissions are only managed if they are configured
+    if vhost_specs:
+        snapshot_requests[VHostSpec] = api.vhosts
+    if permission_specs:
+        snapshot_requests[PermissionSpec] = api.permissions
+    if user_config:
+        snapshot_requests[UserSpec] = api.users
+    if bulk:
+        definitions = api.definitions()
+        snapshot = {
+            cls: getattr(definitions, DEFINITIONS_FIELDS[cls])
+            for cls in snapshot_requests
+        }
+    else:
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            futures = {
+                cls: executor.submit(request)
+                for cls, request in snapshot_requests.items()
+            }
+            snapshot = {cls: future.result() for cls, future in futures.items()}
+
+    changes = []
+    if user_config:
+        changes.extend(
+            _plan_users(snapshot[UserSpec], user_config, jobs=jobs, state=user_state)
+        )
+    if vhost_specs:
+        current_vhosts_excluding_default = [
+            vhost for vhost in snapshot[VHostSpec] if vhost.name != "/"
+        ]
+        changes.extend(
+            plan_changes(VHostSpec, vhost_specs, current_vhosts_excluding_default)
+        )
+    if permission_specs:
+        changes.extend(
+            plan_changes(PermissionSpec, permission_specs, snapshot[PermissionSpec])
+        )
+    changes.extend(
+        plan_changes(PolicySpec, policy_specs, snapshot[PolicySpec], unique=True)
+    )
+    exchange_changes = plan_changes(
+        ExchangeSpec, exchange_specs, snapshot[ExchangeSpec], replace=True
+    )
+    changes.extend(exchange_changes)
+    changes.extend(
+        plan_changes(QueueSpec, queue_specs, snapshot[QueueSpec], unique=True)
+    )
+    # don't remove bindings to temporary queues
+    current_bindings = _permanent_bindings(snapshot[BindingSpec], snapshot[QueueSpec])
+    # RabbitMQ drops all bindings of an exchange when it is deleted, so those
+    # of replaced exchanges must be created again
+    deleted_exchanges = {
+        _component_id(change.component)
+        for change in exchange_changes
+        if change.action is Action.DELETE
+    }
+    if deleted_exchanges:
+        current_bindings = [
+            b
+            for b in current_bindings
+            if (b.vhost, b.source) not in deleted_exchanges
+            and not (
+                b.destination_type is DestinationType.EXCHANGE
+                and (b.vhost, b.destination) in deleted_exchanges
+            )
+        ]
+    changes.extend(plan_changes(BindingSpec, binding_specs, current_bindings))
+    return changes
 
 
 def run() -> None:
@@ -407,6 +814,37 @@ def run() -> None:
         "    password = letmein\n"
         "    tags = comma,separated,tags",
     )
+    parser.add_argument(
+        "--user-state",
+        action="store",
+        dest="user_state",
+        type=Path,
+        help="File recording the content hash of each user configuration\n"
+        "    file, so that unchanged files are skipped on the next run",
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        dest="dry_run",
+        help="Show the changes that would be made, without making them",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        dest="bulk",
+        help="Read the server state with a single definitions export, and\n"
+        "    apply all creations and updates with a single definitions import",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        dest="jobs",
+        type=int,
+        default=8,
+        help="Number of concurrent requests to the RabbitMQ API (default: 8)",
+    )
     zc.add_command_line_options(parser)
     args = parser.parse_args()
 
@@ -419,53 +857,30 @@ def run() -> None:
     with open(args.configuration) as in_file:
         yaml_data = yaml.safe_load(in_file)
 
-    try:
-        if args.user_config:
-            _configure_users(api, args.user_config)
+    user_state = None
+    if args.user_config and args.user_state:
+        user_state = load_user_state(args.user_state)
 
-        # configure vhosts
-        if vhost_specs := get_vhost_specs(yaml_data.get("vhosts", [])):
-            current_vhosts_excluding_default = [
-                vhost for vhost in api.vhosts() if vhost.name != "/"
-            ]
-            update_config(api, vhost_specs, current_vhosts_excluding_default)
-
-        # configure permissions
-        if permission_specs := get_permission_specs(yaml_data.get("permissions", [])):
-            update_config(api, permission_specs, api.permissions())
-
-        # configure policies
-        _configure_policies(api, yaml_data["policies"])
-
-        queue_specs = []
-        exchange_specs = get_exchange_specs(yaml_data["exchanges"])
-        binding_specs = get_binding_specs(yaml_data.get("bindings", []))
-        for group in yaml_data["groups"]:
-            if group.get("settings", {}).get("broadcast"):
-                exchange_specs.extend(get_exchange_specs_for_group(group))
-            else:
-                queue_specs.extend(get_queue_specs(group))
-                binding_specs.extend(get_binding_specs_for_group(group))
-
-        _configure_queues(api, queue_specs)
-        update_config(api, exchange_specs, api.exchanges())
-        permanent_bindings = []
-        # don't remove bindings to temporary queues
-        queues = api.queues()
-        for b in api.bindings():
-            try:
-                q = [
-                    qu
-                    for qu in queues
-                    if qu.vhost == b.vhost and qu.name == b.destination
-                ][0]
-            except IndexError:
-                logger.warning(f"No matching queue found binding {b}")
-            else:
-                if q.auto_delete or q.exclusive:
-                    continue
-                permanent_bindings.append(b)
-        update_config(api, binding_specs, permanent_bindings)
+    try:
+        changes = plan_configuration(
+            api,
+            yaml_data,
+            user_config=args.user_config,
+            jobs=args.jobs,
+            user_state=user_state,
+            bulk=args.bulk,
+        )
+        if changes:
+            apply_changes(
+                api, changes, jobs=args.jobs, dry_run=args.dry_run, bulk=args.bulk
+            )
+        else:
+            logger.info("RabbitMQ configuration is up to date")
+        if args.dry_run:
+            if changes:
+                logger.info(f"{len(changes)} changes not applied (dry run)")
+        elif user_state is not None:
+            save_user_state(args.user_state, user_state)
     except requests.exceptions.HTTPError as e:
         # Specially handle the VHost error, as we used to not setup vhosts
         try:
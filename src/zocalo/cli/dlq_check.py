@@ -6,7 +6,6 @@ import workflows.transport
 
 import zocalo.configuration
 from zocalo.util.jmxstats import JMXAPI
-from zocalo.util.rabbitmq import RabbitMQAPI
 
 #
 # zocalo.dlq_check
@@ -52,11 +51,16 @@ def check_dlq(
 def check_dlq_rabbitmq(
     zc: zocalo.configuration.Configuration, namespace: str | None = None
 ) -> dict:
+    from zocalo.util.rabbitmq import RabbitMQAPI
+
     rmq = RabbitMQAPI.from_zocalo_configuration(zc)
     return {
         q.name: q.messages
-        for q in rmq.queues()
-        if q.name.startswith("dlq.")
+        for q in rmq.iter_queues(
+            pattern=r"^dlq\.", use_regex=True, columns=["name", "vhost", "messages"]
+        )
+        if q.name
+        and q.name.startswith("dlq.")
         and (namespace is None or q.vhost == namespace)
         and q.messages
     }
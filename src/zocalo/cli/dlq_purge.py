@@ -20,9 +20,10 @@ from typing import Any, Literal
 
 import workflows
 import workflows.transport
+from workflows.transport.common_transport import CommonTransport
 
 import zocalo.configuration
-from zocalo.util.rabbitmq import RabbitMQAPI
+from zocalo.util.dlq import DLQArchiveWriter, DLQIndex, IndexEntry
 
 
 def run() -> None:
@@ -53,6 +54,47 @@ def run() -> None:
         default=dlq_dump_path,
         help=f"Where to write out DLQ message files (default: {dlq_dump_path})",
     )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        dest="archive",
+        default=False,
+        help="Write messages into rolling JSON Lines archive files with an index,"
+        " instead of writing one file per message",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        dest="compress",
+        default=False,
+        help="Compress archive files with gzip (requires --archive)",
+    )
+    parser.add_argument(
+        "--archive-size",
+        action="store",
+        dest="archive_size",
+        type=int,
+        default=10000,
+        help="Maximum number of messages per archive file (default: 10000)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store",
+        dest="prefetch",
+        type=int,
+        default=1000,
+        help="Number of messages to prefetch from each queue in --archive mode,"
+        " and maximum number of messages to write before acknowledging them"
+        " (default: 1000)",
+    )
+    parser.add_argument(
+        "--index",
+        action="store",
+        dest="index",
+        default=None,
+        help="Record all purged messages in this SQLite index, which can be used"
+        " to select messages with zocalo.dlq_reinject",
+    )
     parser.add_argument(
         "queues",
         nargs="*",
@@ -70,6 +112,31 @@ def run() -> None:
 
     characterfilter = re.compile(r"[^a-zA-Z0-9._-]+", re.UNICODE)
     idlequeue: queue.Queue[Literal["start", "done"] | tuple[str, str]] = queue.Queue()
+    archivequeue: queue.Queue[tuple[str, Mapping[str, Any], int, dict[str, Any]]] = (
+        queue.Queue()
+    )
+    created_directories: set[pathlib.Path] = set()
+    index = DLQIndex(args.index) if args.index else None
+
+    def export_dlq_message(
+        header: Mapping[str, Any], message: Any, *, rabbitmq: bool
+    ) -> tuple[int, dict[str, Any]]:
+        if rabbitmq:
+            msg_time = int(datetime.timestamp(header["x-death"][0]["time"])) * 1000
+            header["x-death"][0]["time"] = datetime.timestamp(
+                header["x-death"][0]["time"]
+            )
+        else:
+            msg_time = int(header["timestamp"])
+        dlqmsg = {
+            "exported": {
+                "date": time.strftime("%Y-%m-%d"),
+                "time": time.strftime("%H:%M:%S"),
+            },
+            "header": header,
+            "message": message,
+        }
+        return msg_time, dlqmsg
 
     def receive_dlq_message(
         header: Mapping[str, Any],
@@ -79,17 +146,13 @@ def run() -> None:
         rabbitmq: bool = False,
     ) -> None:
         idlequeue.put_nowait("start")
-        if rabbitmq:
-            msg_time = int(datetime.timestamp(header["x-death"][0]["time"])) * 1000
-            header["x-death"][0]["time"] = datetime.timestamp(
-                header["x-death"][0]["time"]
-            )
-        else:
-            msg_time = int(header["timestamp"])
+        msg_time, dlqmsg = export_dlq_message(header, message, rabbitmq=rabbitmq)
         timestamp = time.localtime(msg_time / 1000)
         millisec = msg_time % 1000
         filepath = pathlib.Path(args.location, time.strftime("%Y-%m-%d", timestamp))
-        filepath.mkdir(parents=True, exist_ok=True)
+        if filepath not in created_directories:
+            filepath.mkdir(parents=True, exist_ok=True)
+            created_directories.add(filepath)
         filename = filepath / (
             "msg-"
             + time.strftime("%Y%m%d-%H%M%S", timestamp)
@@ -97,17 +160,10 @@ def run() -> None:
             + characterfilter.sub("_", str(header["message-id"]))
         )
 
-        dlqmsg = {
-            "exported": {
-                "date": time.strftime("%Y-%m-%d"),
-                "time": time.strftime("%H:%M:%S"),
-            },
-            "header": header,
-            "message": message,
-        }
-
         with filename.open("w") as fh:
             json.dump(dlqmsg, fh, indent=2, sort_keys=True)
+        if index:
+            index.add(dlqmsg, path=filename, timestamp=msg_time)
         idlequeue.put_nowait(
             (
                 queue_name,
@@ -117,24 +173,62 @@ def run() -> None:
         transport.ack(header)
         idlequeue.put_nowait("done")
 
+    def queue_dlq_message(
+        header: Mapping[str, Any],
+        message: Any,
+        *,
+        queue_name: str,
+        rabbitmq: bool = False,
+    ) -> None:
+        # Archiving happens in the main thread, so that messages can be
+        # written and acknowledged in bulk
+        msg_time, dlqmsg = export_dlq_message(header, message, rabbitmq=rabbitmq)
+        archivequeue.put_nowait((queue_name, header, msg_time, dlqmsg))
+
     transport.connect()
     if not queues:
         if args.transport == "StompTransport":
             queues = [dlqprefix + ".>"]
         elif args.transport == "PikaTransport":
+            from zocalo.util.rabbitmq import RabbitMQAPI
+
             rmq = RabbitMQAPI.from_zocalo_configuration(zc)
-            queues = [q.name for q in rmq.queues() if q.name.startswith("dlq.")]
+            queues = [
+                q.name
+                for q in rmq.iter_queues(
+                    pattern=r"^dlq\.", use_regex=True, columns=["name"]
+                )
+                if q.name and q.name.startswith("dlq.")
+            ]
     print(f"Looking for DLQ messages in {len(queues)} queues...")
     for queue_ in queues:
-        transport.subscribe(
-            queue_,
-            partial(
-                receive_dlq_message,
-                rabbitmq=args.transport == "PikaTransport",
-                queue_name=queue_,
-            ),
-            acknowledgement=True,
-        )
+        if args.archive:
+            transport.subscribe(
+                queue_,
+                partial(
+                    queue_dlq_message,
+                    rabbitmq=args.transport == "PikaTransport",
+                    queue_name=queue_,
+                ),
+                acknowledgement=True,
+                prefetch_count=args.prefetch,
+            )
+        else:
+            transport.subscribe(
+                queue_,
+                partial(
+                    receive_dlq_message,
+                    rabbitmq=args.transport == "PikaTransport",
+                    queue_name=queue_,
+                ),
+                acknowledgement=True,
+            )
+    if args.archive:
+        _archive_messages(transport, archivequeue, args, index)
+        transport.disconnect()
+        if index:
+            index.close()
+        return
     messages: dict[str, list[str]] = {}
     try:
         idlequeue.get(True, args.wait or 3)
@@ -153,3 +247,79 @@ def run() -> None:
 
         print("Done.")
     transport.disconnect()
+    if index:
+        index.close()
+
+
+def _archive_messages(
+    transport: CommonTransport,
+    archivequeue: queue.Queue[tuple[str, Mapping[str, Any], int, dict[str, Any]]],
+    args: argparse.Namespace,
+    index: DLQIndex | None = None,
+) -> None:
+    """Write received DLQ messages into archive files, and acknowledge them in
+    bulk once they have been safely written to disk."""
+    unacknowledged: dict[str, list[Mapping[str, Any]]] = {}
+    unindexed: list[IndexEntry] = []
+    counts: dict[str, int] = {}
+    count = 0
+    start = last_sync = last_progress = time.monotonic()
+
+    def sync_and_acknowledge() -> None:
+        archive.sync()
+        if index:
+            index.add_many(unindexed)
+        unindexed.clear()
+        for headers in unacknowledged.values():
+            if args.transport == "PikaTransport":
+                # Acknowledge all messages on this subscription up to the last
+                transport.ack(headers[-1], multiple=True)
+            else:
+                for header in headers:
+                    transport.ack(header)
+        unacknowledged.clear()
+
+    with DLQArchiveWriter(
+        args.location, compress=args.compress, max_messages=args.archive_size
+    ) as archive:
+        timeout = args.wait or 3
+        while True:
+            try:
+                queue_name, header, msg_time, dlqmsg = archivequeue.get(True, timeout)
+            except queue.Empty:
+                break
+            timeout = args.wait or 1
+            path, line = archive.write(
+                dlqmsg,
+                queue=queue_name,
+                message_id=str(header["message-id"]),
+                timestamp=msg_time,
+            )
+            if index:
+                unindexed.append(IndexEntry(dlqmsg, path, line, timestamp=msg_time))
+            unacknowledged.setdefault(queue_name, []).append(header)
+            counts[queue_name] = counts.get(queue_name, 0) + 1
+            count += 1
+
+            now = time.monotonic()
+            if count % args.prefetch == 0 or now - last_sync > 1:
+                sync_and_acknowledge()
+                last_sync = now
+            if now - last_progress > 1:
+                print(
+                    f"\r{count} messages archived"
+                    f" ({count / (now - start):.0f} messages/s)",
+                    end="",
+                    file=sys.stderr,
+                    flush=True,
+                )
+                last_progress = now
+        sync_and_acknowledge()
+
+    if count:
+        print(f"\r{count} messages archived", file=sys.stderr)
+    for queuename, q_count in counts.items():
+        print(f"Found {q_count} DLQ messages in {queuename}")
+    for archive_file in archive.archives:
+        print(f"    {archive_file}")
+    print("Done.")
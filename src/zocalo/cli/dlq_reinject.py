@@ -1,7 +1,7 @@
 #
 # zocalo.dlq_reinject
-#   Take a dead letter queue message from a file and send it back to its queue
-#   for a retry.
+#   Take dead letter queue messages from files or DLQ archives and send them
+#   back to their queues for a retry.
 #
 from __future__ import annotations
 
@@ -11,13 +11,19 @@ import os
 import re
 import select
 import sys
-import time
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from pprint import pprint
+from typing import Any
 
 import workflows.transport
 
 import zocalo.configuration
-from zocalo.util.rabbitmq import RabbitMQAPI
+from zocalo.util.dlq import DLQIndex, is_dlq_archive, read_dlq_archive
+from zocalo.util.ratelimit import TokenBucket
 
 
 def run() -> None:
@@ -52,15 +58,80 @@ def run() -> None:
         dest="destination_override",
         help="Reinject messages to a different destination. Any name given must include the stomp prefix.",
     )
+    parser.add_argument(
+        "--rate",
+        action="store",
+        type=float,
+        default=None,
+        dest="rate",
+        help="Reinject at most this many messages per second (default: unlimited)",
+    )
+    parser.add_argument(
+        "--burst",
+        action="store",
+        type=int,
+        default=None,
+        dest="burst",
+        help="Allow bursts of up to this many messages when rate limiting"
+        " (default: one second's worth)",
+    )
     parser.add_argument(
         "-w",
         "--wait",
+        type=float,
         default=None,
         dest="wait",
-        help="Wait this many seconds between reinjections",
+        help="Wait this many seconds between reinjections."
+        " Equivalent to --rate 1/WAIT --burst 1",
+    )
+    parser.add_argument(
+        "--threads",
+        action="store",
+        type=int,
+        default=1,
+        dest="threads",
+        help="Number of messages to reinject concurrently. Messages may be"
+        " reinjected out of order if this is larger than 1 (default: 1)",
+    )
+    parser.add_argument(
+        "--index",
+        action="store",
+        default=None,
+        dest="index",
+        help="SQLite index of DLQ messages, as written by zocalo.dlq_purge --index."
+        " Any files given are added to the index. If no files are given then"
+        " messages are selected from the entire index.",
+    )
+    selection = parser.add_argument_group(
+        "message selection",
+        "Only reinject messages matching all of these criteria",
+    )
+    selection.add_argument("--queue", dest="select_queue", help="Original queue name")
+    selection.add_argument(
+        "--dcid", dest="select_dcid", type=int, help="Data collection ID"
+    )
+    selection.add_argument("--guid", dest="select_guid", help="Recipe ID")
+    selection.add_argument(
+        "--recipe", dest="select_recipe", help="Name of a requested recipe"
+    )
+    selection.add_argument(
+        "--since",
+        dest="select_since",
+        type=datetime.fromisoformat,
+        help="Messages dead-lettered at or after this time (ISO 8601)",
+    )
+    selection.add_argument(
+        "--until",
+        dest="select_until",
+        type=datetime.fromisoformat,
+        help="Messages dead-lettered before this time (ISO 8601)",
     )
     parser.add_argument(
-        "files", nargs="*", help="File(s) containing DLQ messages to be reinjected"
+        "files",
+        nargs="*",
+        help="File(s) containing DLQ messages to be reinjected."
+        " These can be single messages or DLQ archives created by"
+        " zocalo.dlq_purge --archive",
     )
 
     zc.add_command_line_options(parser)
@@ -74,7 +145,7 @@ def run() -> None:
     except Exception:
         stdin_fileno = None
     if isinstance(stdin_fileno, int) and select.select([sys.stdin], [], [], 0.0)[0]:
-        dlq_purge_filename_format = re.compile(r"^  \/")
+        dlq_purge_filename_format = re.compile(r"^ +\/")
         while True:
             line = sys.stdin.readline()
             if not line:
@@ -83,31 +154,54 @@ def run() -> None:
                 stdin.append(line.strip())
         print(f"{len(stdin)} filenames read from stdin")
 
-    if not stdin and not args.files:
+    if not stdin and not args.files and not args.index:
         sys.exit("No DLQ message files given.")
 
-    transport.connect()
+    # Without selection criteria, all messages in all files are reinjected.
+    # Otherwise files are indexed, in memory if no index file is given, and
+    # only matching messages are reinjected.
+    files = args.files + stdin
+    index = None
+    dlq_messages: dict[str, list[int] | None] = dict.fromkeys(files)
+    criteria = {
+        key[len("select_") :]: value
+        for key, value in vars(args).items()
+        if key.startswith("select_") and value is not None
+    }
+    if args.index or criteria:
+        index = DLQIndex(args.index or ":memory:")
+        for dlqfile in files:
+            if os.path.exists(dlqfile):
+                index.add_file(dlqfile)
+        for key in ("since", "until"):
+            if key in criteria:
+                criteria[key] = int(criteria[key].timestamp() * 1000)
+        dlq_messages = dict(index.select(**criteria, paths=files or None))
+        print(f"{sum(map(len, dlq_messages.values()))} messages selected")
+
+    ratelimit = None
+    if args.wait:
+        ratelimit = TokenBucket(1 / args.wait, burst=1)
+    elif args.rate:
+        ratelimit = TokenBucket(args.rate, burst=args.burst)
 
-    first = True
-    for dlqfile in args.files + stdin:
-        if not os.path.exists(dlqfile):
-            print(f"Ignoring missing file {dlqfile}")
-            continue
-        if not first and args.wait:
-            time.sleep(float(args.wait))
-        first = False
-        with open(dlqfile) as fh:
-            dlqmsg = json.load(fh)
-        print(f"Parsing message from {dlqfile}")
-        if (
-            not isinstance(dlqmsg, dict)
-            or not dlqmsg.get("header")
-            or not dlqmsg.get("message")
-        ):
-            sys.exit("File is not a valid DLQ message.")
-        if args.verbose:
-            pprint(dlqmsg)
+    # Exchange types are looked up once per run, and only if required
+    exchange_types: dict[str, str] | None = None
 
+    def get_exchange_type(exchange: str) -> str | None:
+        nonlocal exchange_types
+        if exchange_types is None:
+            from zocalo.util.rabbitmq import RabbitMQAPI
+
+            rmqapi = RabbitMQAPI.from_zocalo_configuration(zc)
+            exchange_types = {
+                exch["name"]: exch["type"] for exch in rmqapi.get("exchanges").json()
+            }
+        return exchange_types.get(exchange)
+
+    def prepare(dlqmsg: dict[str, Any]) -> tuple[Callable[..., None], tuple, dict]:
+        """Work out how to reinject a DLQ message. Returns the function to call
+        with its arguments."""
         if args.transport == "StompTransport":
             destination = (
                 dlqmsg["header"]
@@ -115,10 +209,8 @@ def run() -> None:
                 .split("/", 2)
             )
             if destination[1] == "queue":
-                print("sending...")
                 send_function = transport.send
             elif destination[1] == "topic":
-                print("broadcasting...")
                 send_function = transport.broadcast
             else:
                 sys.exit("Cannot process message, unknown message mechanism")
@@ -139,38 +231,114 @@ def run() -> None:
                 if drop_field in header:
                     del header[drop_field]
             header["dlq-reinjected"] = "True"
-            send_function(
-                destination[2], dlqmsg["message"], headers=header, ignore_namespace=True
+            return (
+                send_function,
+                (destination[2], dlqmsg["message"]),
+                {"headers": header, "ignore_namespace": True},
             )
         elif args.transport == "PikaTransport":
-            print("pika transport detected")
             header = dlqmsg["header"]
             header["dlq-reinjected"] = "True"
             exchange = header.get("x-death", [{}])[0].get("exchange")
             destination = header.get("x-death", [{}])[0].get("queue")
-            if exchange:
-                rmqapi = RabbitMQAPI.from_zocalo_configuration(zc)
-                exchange_info = rmqapi.get("queues").json()
-                for exch in exchange_info:
-                    if exch["name"] == exchange:
-                        if exch["type"] == "fanout":
-                            transport.broadcast(
-                                args.destination_override or destination,
-                                dlqmsg["message"],
-                                headers=_rabbit_prepare_header(header),
-                            )
-            else:
-                destination = header.get("x-death", [{}])[0].get("queue")
-                transport.send(
-                    args.destination_override or destination,
-                    dlqmsg["message"],
-                    headers=_rabbit_prepare_header(header),
+            send_function = transport.send
+            if exchange and get_exchange_type(exchange) == "fanout":
+                send_function = transport.broadcast
+            return (
+                send_function,
+                (args.destination_override or destination, dlqmsg["message"]),
+                {"headers": _rabbit_prepare_header(header)},
+            )
+        sys.exit(f"Transport {args.transport} is not supported")
+
+    transport.connect()
+
+    # Number of messages in flight for each file, and files that have been
+    # read completely. Files are removed once all their messages are sent.
+    lock = threading.Lock()
+    in_flight: dict[str, int] = {}
+    read_completely: set[str] = set()
+    failed: set[str] = set()
+    sent = 0
+
+    def file_finished(dlqfile: str) -> None:
+        if not args.remove or dlqfile in failed:
+            return
+        # Archives are only removed once all of their messages are reinjected
+        if index and index.remove(dlqfile, dlq_messages[dlqfile]):
+            return
+        os.remove(dlqfile)
+
+    def message_done(dlqfile: str, future: Future) -> None:
+        nonlocal sent
+        slots.release()
+        with lock:
+            in_flight[dlqfile] -= 1
+            if future.exception():
+                print(
+                    f"Could not reinject message from {dlqfile}: {future.exception()}"
                 )
-        if args.remove:
-            os.remove(dlqfile)
-        print("Done.\n")
+                failed.add(dlqfile)
+            else:
+                sent += 1
+            finished = not in_flight[dlqfile] and dlqfile in read_completely
+        if finished:
+            file_finished(dlqfile)
+
+    # Limit the number of messages held in memory waiting to be sent
+    slots = threading.BoundedSemaphore(2 * args.threads)
+    with ThreadPoolExecutor(
+        max_workers=args.threads, thread_name_prefix="dlq_reinject"
+    ) as executor:
+        for dlqfile, lines in dlq_messages.items():
+            if not os.path.exists(dlqfile):
+                print(f"Ignoring missing file {dlqfile}")
+                continue
+            with lock:
+                in_flight[dlqfile] = 0
+            if is_dlq_archive(dlqfile):
+                print(f"Reinjecting messages from archive {dlqfile}")
+                messages: Iterable[dict[str, Any]] = read_dlq_archive(dlqfile)
+                if lines is not None:
+                    selected = set(lines)
+                    messages = (
+                        dlqmsg
+                        for line, dlqmsg in enumerate(messages)
+                        if line in selected
+                    )
+            else:
+                print(f"Parsing message from {dlqfile}")
+                with open(dlqfile) as fh:
+                    messages = [json.load(fh)]
+            for dlqmsg in messages:
+                if (
+                    not isinstance(dlqmsg, dict)
+                    or not dlqmsg.get("header")
+                    or not dlqmsg.get("message")
+                ):
+                    sys.exit("File is not a valid DLQ message.")
+                if args.verbose:
+                    pprint(dlqmsg)
+                send_function, send_args, send_kwargs = prepare(dlqmsg)
+                if ratelimit:
+                    ratelimit.acquire()
+                slots.acquire()
+                with lock:
+                    in_flight[dlqfile] += 1
+                future = executor.submit(send_function, *send_args, **send_kwargs)
+                future.add_done_callback(partial(message_done, dlqfile))
+            with lock:
+                read_completely.add(dlqfile)
+                finished = not in_flight[dlqfile]
+            if finished:
+                file_finished(dlqfile)
 
     transport.disconnect()
+    if index:
+        index.close()
+    print(f"Done. {sent} messages reinjected.")
+    if failed:
+        sys.exit(f"Could not reinject all messages from {len(failed)} file(s)")
 
 
 def _rabbit_prepare_header(header: dict) -> dict:
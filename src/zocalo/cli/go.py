@@ -6,23 +6,50 @@
 from __future__ import annotations
 
 import argparse
+import copy
 import getpass
 import json
 import pathlib
 import socket
+import sqlite3
 import sys
 import uuid
 from pprint import pprint
 from typing import Any, Literal
 
-import workflows.recipe
 import workflows.transport
+from workflows.transport.common_transport import CommonTransport
 
 import zocalo.configuration.argparse
+from zocalo.util.outbox import Outbox, OutboxItem, default_outbox_location
 
 # Example: zocalo.go -r example-xia2 527189
 
 
+def _batch_entries(dcids: list[str], batchfile: str | None) -> list[dict[str, Any]]:
+    """Read batch entries from the command line and a batch file."""
+    entries: list[dict[str, Any]] = [{"dcid": dcid} for dcid in dcids]
+    if not batchfile:
+        return entries
+    if batchfile == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(batchfile) as fh:
+            lines = fh.readlines()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            entry = json.loads(line)
+            if not isinstance(entry.get("parameters", {}), dict):
+                sys.exit(f"Invalid batch entry {line}")
+            entries.append(entry)
+        else:
+            entries.append({"dcid": line})
+    return entries
+
+
 def run() -> None:
     zc = zocalo.configuration.from_file()
     zc.activate()
@@ -113,7 +140,37 @@ def run() -> None:
         help="Verify that everything is in place that the message could be sent, but don't actually send the message",
     )
     parser.add_argument(
-        "dcid", nargs="*", help="Data collection ID of required processing"
+        "--flush",
+        dest="flush",
+        action="store_true",
+        default=False,
+        help="Only send messages waiting in the local outbox, then exit",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        dest="batchfile",
+        metavar="FILE",
+        action="store",
+        default=None,
+        help="Submit processing for every data collection ID listed in this file"
+        " ('-' for stdin). Each line contains either an ID, or a JSON object with"
+        ' optional "dcid" and "parameters" keys.',
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batchsize",
+        metavar="N",
+        action="store",
+        type=int,
+        default=100,
+        help="Number of messages sent per transaction in batch mode (default: 100)",
+    )
+    parser.add_argument(
+        "dcid",
+        nargs="*",
+        help="Data collection ID of required processing."
+        " Multiple IDs can be given to submit them in a single batch.",
     )
 
     zc.add_command_line_options(parser)
@@ -126,6 +183,132 @@ def run() -> None:
     else:
         dropfile_fallback = False
 
+    def open_outbox() -> Outbox | None:
+        """Open the local outbox, unless it is disabled or unavailable."""
+        storage = zc.storage or {}
+        location = storage.get("zocalo.go.outbox")
+        if location is False:
+            return None
+        try:
+            # Write-ahead logging is only safe on a local filesystem, so must
+            # be enabled explicitly for an explicitly configured location
+            return Outbox(
+                location or default_outbox_location(),
+                wal=bool(location and storage.get("zocalo.go.outbox_wal")),
+            )
+        except (OSError, sqlite3.Error) as e:
+            print(f"Could not open local outbox: {e}")
+            return None
+
+    def flush_outbox(
+        outbox: Outbox, transport: CommonTransport, ids: list[int], force: bool = False
+    ) -> None:
+        sent = outbox.flush(
+            lambda message, headers: transport.send(
+                "processing_recipe", message, headers=headers
+            ),
+            ids=ids,
+            force=force,
+        )
+        deferred = len(set(sent) - set(ids))
+        if deferred:
+            print(f"Sent {deferred} message(s) deferred by previous invocations")
+
+    def send_batch(items: list[tuple[str, dict[str, Any]]]) -> bool:
+        """Send many messages over a single connection, in transactions of
+        --batch-size messages, and report the outcome for each message.
+        Returns True if all messages were sent."""
+        headers = {
+            "zocalo.go.user": getpass.getuser(),
+            "zocalo.go.host": socket.gethostname(),
+        }
+        if args.verbose:
+            for _, message in items:
+                pprint(message)
+        if dropfile_fallback and args.dropfile:
+            for _, message in items:
+                write_message_to_dropfile(message, headers)
+            return True
+        transport = workflows.transport.lookup(args.transport)()
+        if args.dryrun:
+            print(f"Not sending {len(items)} messages (running with --dry-run)")
+            return True
+
+        txn = None
+
+        def send(message: dict[str, Any], headers: dict[str, Any]) -> None:
+            nonlocal txn
+            if txn is None:
+                txn = transport.transaction_begin()
+            transport.send(
+                "processing_recipe", message, headers=headers, transaction=txn
+            )
+
+        def commit() -> None:
+            nonlocal txn
+            if txn is not None:
+                transport.transaction_commit(txn)
+                txn = None
+
+        submitted: set[int] = set()
+        outbox = open_outbox()
+        try:
+            if outbox is not None:
+                ids = outbox.put_many((message, headers) for _, message in items)
+                positions = {item_id: n for n, item_id in enumerate(ids)}
+                deferred = 0
+
+                def report(sent: list[OutboxItem]) -> None:
+                    nonlocal deferred
+                    for item in sent:
+                        if item.id in positions:
+                            print(f"{items[positions[item.id]][0]}: submitted")
+                            submitted.add(positions[item.id])
+                        else:
+                            deferred += 1
+
+                transport.connect()
+                outbox.flush(
+                    send,
+                    ids=ids,
+                    batch_size=args.batchsize,
+                    commit=commit,
+                    on_sent=report,
+                )
+                if deferred:
+                    print(
+                        f"Sent {deferred} message(s) deferred by previous invocations"
+                    )
+            else:
+                transport.connect()
+                for start in range(0, len(items), args.batchsize):
+                    batch = items[start : start + args.batchsize]
+                    for _, message in batch:
+                        send(message, headers)
+                    commit()
+                    for n, (label, _) in enumerate(batch, start=start):
+                        print(f"{label}: submitted")
+                        submitted.add(n)
+            transport.disconnect()
+        except (KeyboardInterrupt, AssertionError, TypeError, ValueError):
+            raise
+        except Exception as e:
+            print(f"\nCould not send all messages: {e!r}\n")
+            if outbox is not None and dropfile_fallback:
+                move_outbox_to_dropfile(outbox)
+            for n, (label, message) in enumerate(items):
+                if n in submitted:
+                    continue
+                if dropfile_fallback:
+                    print(f"{label}: deferred")
+                    if outbox is None:
+                        write_message_to_dropfile(message, headers)
+                elif outbox is not None:
+                    print(f"{label}: deferred, stored in local outbox {outbox.path}")
+                else:
+                    print(f"{label}: failed")
+        return len(submitted) == len(items)
+
     def write_message_to_dropfile(
         message: dict[str, Any], headers: dict[str, str]
     ) -> None:
@@ -140,6 +323,11 @@ def run() -> None:
         fallback.write_text(message_serialized)
         print("Message successfully stored in %s" % fallback)
 
+    def move_outbox_to_dropfile(outbox: Outbox) -> None:
+        """Hand all undeliverable messages in the outbox over to zocalo.pickup
+        by moving them into the fallback location."""
+        outbox.flush(write_message_to_dropfile, force=True)
+
     def send_or_defer(message: dict[str, Any]) -> None:
         headers = {
             "zocalo.go.user": getpass.getuser(),
@@ -149,13 +337,22 @@ def run() -> None:
             pprint(message)
         if dropfile_fallback and args.dropfile:
             return write_message_to_dropfile(message, headers)
+        outbox = None
         try:
             transport = workflows.transport.lookup(args.transport)()
             if args.dryrun:
                 print("Not sending message (running with --dry-run)")
                 return
+            # Store the message before attempting to send it, so that it is
+            # not lost if anything goes wrong
+            outbox = open_outbox()
+            if outbox is not None:
+                item = outbox.put(message, headers)
             transport.connect()
-            transport.send("processing_recipe", message, headers=headers)
+            if outbox is not None:
+                flush_outbox(outbox, transport, [item])
+            else:
+                transport.send("processing_recipe", message, headers=headers)
             transport.disconnect()
         except (
             KeyboardInterrupt,
@@ -168,6 +365,17 @@ def run() -> None:
         ):
             raise
         except Exception:
+            if outbox is not None and not dropfile_fallback:
+                import traceback
+
+                print("\n\n")
+                traceback.print_exc()
+                print(
+                    f"\n\nMessage stored in local outbox {outbox.path}. It will be"
+                    " sent by the next invocation of zocalo.go, or by running"
+                    " zocalo.go --flush"
+                )
+                return
             if not dropfile_fallback:
                 raise
             print("\n\n")
@@ -175,7 +383,27 @@ def run() -> None:
 
             traceback.print_exc()
             print("\n\nAttempting to store message in fallback location")
-            write_message_to_dropfile(message, headers)
+            if outbox is not None:
+                move_outbox_to_dropfile(outbox)
+            else:
+                write_message_to_dropfile(message, headers)
+
+    if args.flush:
+        outbox = open_outbox()
+        if outbox is None:
+            sys.exit("No local outbox available")
+        if not len(outbox):
+            print("Local outbox is empty")
+            sys.exit(0)
+        transport = workflows.transport.lookup(args.transport)()
+        try:
+            transport.connect()
+            flush_outbox(outbox, transport, [], force=True)
+            transport.disconnect()
+        except Exception as e:
+            sys.exit(f"Could not send messages: {e!r}")
+        print(f"{len(outbox)} message(s) remaining in local outbox")
+        sys.exit(0)
 
     message = {"recipes": args.recipe, "parameters": {}}
     for kv in args.parameters:
@@ -193,12 +421,14 @@ def run() -> None:
         sys.exit("No recipes specified.")
 
     if args.recipefile:
+        from workflows.recipe import Recipe
+
         with open(args.recipefile) as fh:
-            custom_recipe = workflows.recipe.Recipe(json.load(fh))
+            custom_recipe = Recipe(json.load(fh))
         custom_recipe.validate()
         message["custom_recipe"] = custom_recipe.recipe
 
-    if args.nodcid:
+    if args.nodcid and not args.batchfile:
         if args.recipe:
             print("Running recipes", args.recipe)
         if args.recipefile:
@@ -208,8 +438,42 @@ def run() -> None:
         print("\nSubmitted.")
         sys.exit(0)
 
-    if len(args.dcid) > 1:
-        sys.exit("Only a single data collection ID can be specified.")
+    if args.batchfile or len(args.dcid) > 1:
+        if args.reprocess:
+            if args.recipe:
+                print("Running recipes", args.recipe)
+        elif not message["recipes"] and not message.get("custom_recipe"):
+            sys.exit("No recipes specified.")
+        items = []
+        for entry in _batch_entries(args.dcid, args.batchfile):
+            batch_message = copy.deepcopy(message)
+            batch_message["parameters"].update(entry.get("parameters", {}))
+            if "dcid" in entry:
+                dcid = int(entry["dcid"])
+                assert dcid > 0, "Invalid data collection ID given."
+                if args.reprocess:
+                    batch_message["parameters"]["ispyb_process"] = dcid
+                else:
+                    batch_message["parameters"]["ispyb_dcid"] = dcid
+                label = str(dcid)
+            elif args.nodcid:
+                label = json.dumps(entry.get("parameters", {}))
+            else:
+                sys.exit(
+                    "You must either specify a data collection ID or option"
+                    f" --no-dcid for {entry}"
+                )
+            if args.autoprocscalingid:
+                apsid = int(args.autoprocscalingid)
+                assert apsid > 0, "Invalid auto processing scaling ID given."
+                batch_message["parameters"]["ispyb_autoprocscalingid"] = apsid
+            items.append((label, batch_message))
+        print(f"Submitting {len(items)} processing requests")
+        if not send_batch(items):
+            sys.exit(1)
+        print("\nSubmitted.")
+        sys.exit(0)
+
     if not args.dcid:
         sys.exit("You must either specify a data collection ID or option --no-dcid.")
 
@@ -1,15 +1,109 @@
 from __future__ import annotations
 
 import argparse
+import fcntl
 import json
+import os
 import pathlib
 import sys
 import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 import workflows.transport
 
 import zocalo.configuration
+from zocalo.util.ratelimit import TokenBucket
+
+# Files in the drop directory used by zocalo.pickup itself. These are hidden
+# files, which are never considered to be messages.
+JOURNAL = ".zocalo.pickup.journal"
+LOCKFILE = ".zocalo.pickup.lock"
+
+
+def _stat_entries(entries: list[os.DirEntry]) -> list[tuple[float, str]]:
+    result = []
+    for entry in entries:
+        try:
+            if entry.is_file():
+                result.append((entry.stat().st_mtime, entry.name))
+        except OSError:
+            # File was picked up by someone else in the meantime
+            pass
+    return result
+
+
+def scan_dropdir(
+    dropdir: pathlib.Path, threads: int = 1, chunk_size: int = 1000
+) -> list[tuple[float, str]]:
+    """Find all message files in a drop directory.
+
+    Only file names and modification times are read. With more than one
+    thread, file metadata is read in parallel, which helps with very large
+    directories on network file systems.
+
+    :param dropdir: The directory to scan
+    :param threads: Number of threads reading file metadata
+    :param chunk_size: Number of files handed to a thread at a time
+    :return: A list of (modification time, file name) tuples, oldest first
+    """
+    files: list[tuple[float, str]] = []
+    with os.scandir(dropdir) as it:
+        entries = (entry for entry in it if not entry.name.startswith("."))
+        if threads <= 1:
+            files = _stat_entries(list(entries))
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for result in executor.map(
+                    _stat_entries, _chunked(entries, chunk_size)
+                ):
+                    files.extend(result)
+    files.sort()
+    return files
+
+
+def _chunked(
+    entries: Iterator[os.DirEntry], chunk_size: int
+) -> Iterator[list[os.DirEntry]]:
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_journal(dropdir: pathlib.Path, names: list[str]) -> None:
+    """Record files whose messages have been sent, but which may not have
+    been deleted yet."""
+    journal = dropdir / JOURNAL
+    with journal.open("w") as fh:
+        fh.write("".join(f"{name}\n" for name in names))
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def _complete_journal(dropdir: pathlib.Path) -> int:
+    """Delete all files listed in the journal left behind by a previous run,
+    as their messages have already been sent. Returns the number of files
+    deleted."""
+    journal = dropdir / JOURNAL
+    try:
+        names = journal.read_text().split()
+    except FileNotFoundError:
+        return 0
+    count = 0
+    for name in names:
+        try:
+            (dropdir / name).unlink()
+            count += 1
+        except FileNotFoundError:
+            pass
+    journal.unlink()
+    return count
 
 
 def run() -> None:
@@ -27,10 +121,38 @@ def run() -> None:
         "--delay",
         dest="delay",
         action="store",
-        type=int,
+        type=float,
         default=2,
         help="Number of seconds to wait between message dispatches",
     )
+    parser.add_argument(
+        "-r",
+        "--rate",
+        dest="rate",
+        action="store",
+        type=float,
+        default=None,
+        help="Send up to this many messages per second, instead of waiting"
+        " --delay seconds between messages",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch",
+        dest="batch",
+        action="store",
+        type=int,
+        default=1,
+        help="Number of messages sent per transaction. Files are only deleted"
+        " once their transaction has been committed (default: 1)",
+    )
+    parser.add_argument(
+        "--scan-threads",
+        dest="scan_threads",
+        action="store",
+        type=int,
+        default=1,
+        help="Number of threads used to scan the backlog directory",
+    )
     parser.add_argument(
         "-w",
         "--wait",
@@ -53,7 +175,20 @@ def run() -> None:
     args = parser.parse_args()
 
     try:
-        files = list(dropdir.iterdir())
+        lockfile = (dropdir / LOCKFILE).open("a")
+    except OSError:
+        sys.exit("This program is only available to privileged users")
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        sys.exit("Another instance of zocalo.pickup is already running")
+
+    recovered = _complete_journal(dropdir)
+    if recovered:
+        print(f"Removed {recovered} files already sent by a previous run")
+
+    try:
+        files = scan_dropdir(dropdir, threads=args.scan_threads)
     except OSError:
         sys.exit("This program is only available to privileged users")
 
@@ -65,44 +200,74 @@ def run() -> None:
         print(f"Waiting {args.wait} seconds")
         time.sleep(args.wait)
 
+    ratelimit = None
+    if args.rate:
+        ratelimit = TokenBucket(args.rate, burst=max(args.rate, args.batch))
+    elif args.delay:
+        ratelimit = TokenBucket(1 / args.delay, burst=1)
+
     print(f"Connecting to {args.transport}...")
     transport = workflows.transport.lookup(args.transport)()
     transport.connect()
 
-    file_info: dict[pathlib.Path, dict[str, Any]] = {f: {} for f in files}
-
-    for f, finfo in file_info.items():
-        with f.open() as fh:
-            data = json.load(fh)
-            finfo["message"] = data["message"]
-            finfo["headers"] = data["headers"]
-        finfo["originating-host"] = finfo["headers"].get("zocalo.go.host")
-        finfo["recipes"] = ",".join(finfo["message"].get("recipes", []))
-        finfo["mtime"] = f.stat().st_mtime
-
     count = 0
-    file_count = len(file_info)
-    for f, finfo in dict(
-        sorted(file_info.items(), key=lambda item: item[1]["mtime"])
-    ).items():
-        print(
-            f"Sending {f} from host {file_info[f]['originating-host']}"
-            f" with recipes {file_info[f]['recipes']}"
-        )
-        assert f.exists()
-        transport.send(
-            "processing_recipe",
-            file_info[f]["message"],
-            headers=file_info[f]["headers"],
-        )
-        f.unlink()
-        count = count + 1
+    file_count = len(files)
+    batch: list[pathlib.Path] = []
+    txn = None
+
+    def commit() -> None:
+        nonlocal count, txn
+        if txn is None:
+            return
+        transport.transaction_commit(txn)
+        txn = None
+        # Messages have been sent. Record this before deleting the files, so
+        # that an interrupted run does not cause them to be sent again.
+        _write_journal(dropdir, [f.name for f in batch])
+        for f in batch:
+            f.unlink(missing_ok=True)
+        (dropdir / JOURNAL).unlink()
+        count += len(batch)
         print(f"Done ({count} of {file_count})")
-        try:
-            time.sleep(args.delay)
-        except KeyboardInterrupt:
-            print("CTRL+C - stopping")
-            time.sleep(0.5)
-            sys.exit(1)
+        batch.clear()
+
+    try:
+        for _, name in files:
+            f = dropdir / name
+            try:
+                with f.open() as fh:
+                    data = json.load(fh)
+                message: dict[str, Any] = data["message"]
+                headers: dict[str, Any] = data["headers"]
+            except FileNotFoundError:
+                file_count -= 1
+                continue
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Skipping {f}, which is not a valid message file: {e!r}")
+                file_count -= 1
+                continue
+            print(
+                f"Sending {f} from host {headers.get('zocalo.go.host')}"
+                f" with recipes {','.join(message.get('recipes', []))}"
+            )
+            if args.verbose:
+                print(json.dumps(data, indent=2))
+            if ratelimit:
+                ratelimit.acquire()
+            if txn is None:
+                txn = transport.transaction_begin()
+            transport.send(
+                "processing_recipe", message, headers=headers, transaction=txn
+            )
+            batch.append(f)
+            if len(batch) >= args.batch:
+                commit()
+        commit()
+    except KeyboardInterrupt:
+        print("CTRL+C - stopping")
+        if txn is not None:
+            transport.transaction_abort(txn)
+        transport.disconnect()
+        sys.exit(1)
 
     transport.disconnect()
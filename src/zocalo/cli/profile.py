@@ -0,0 +1,90 @@
+#
+# zocalo.profile
+#   Record a profile of running zocalo services
+#
+
+from __future__ import annotations
+
+import argparse
+import socket
+import sys
+
+import workflows
+import workflows.services
+import workflows.transport
+
+import zocalo.configuration
+
+
+def run(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Ask running service instances to record a CPU or memory"
+        " profile. Profiles are written by the services to the location given"
+        " by the storage setting zocalo.profiler.location."
+    )
+
+    # Load configuration
+    zc = zocalo.configuration.from_file()
+    zc.activate()
+
+    known_services = sorted(workflows.services.get_known_services())
+    parser.add_argument("-?", action="help", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "HOSTS",
+        nargs="*",
+        type=str,
+        help="Specific service instances specified as hostname.pid",
+    )
+    parser.add_argument(
+        "-s",
+        "--service",
+        dest="services",
+        metavar="SVC",
+        action="append",
+        default=[],
+        help="Profile all instances of a service. Known services: "
+        + ", ".join(known_services),
+    )
+    parser.add_argument(
+        "-m",
+        "--memory",
+        dest="mode",
+        action="store_const",
+        const="memory",
+        default="cpu",
+        help="Trace memory allocations instead of sampling CPU usage",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        dest="duration",
+        type=float,
+        default=30,
+        help="Number of seconds to profile for (default: 30)",
+    )
+    zc.add_command_line_options(parser)
+    workflows.transport.add_command_line_options(parser, transport_argument=True)
+    args = parser.parse_args(argv)
+
+    if not args.services and not len(args.HOSTS):
+        print("Need to specify one or more services to profile.")
+        print("Either specify service groups with -s or specify specific instances")
+        print("as: hostname.pid")
+        sys.exit(1)
+
+    transport = workflows.transport.lookup(args.transport)()
+    transport.connect()
+
+    request = {"command": "profile", "mode": args.mode, "duration": args.duration}
+    for host in args.HOSTS:
+        if host.count(".") == 1:
+            # See also workflows.util.generate_unique_host_id()
+            host = ".".join(reversed(socket.gethostname().split(".")[1:])) + "." + host
+        transport.broadcast("command", {**request, "host": host})
+        print(f"Requesting {args.mode} profile of", host)
+
+    for service in args.services:
+        transport.broadcast("command", {**request, "service": service})
+        print(f"Requesting {args.mode} profile of all instances of", service)
+
+    transport.disconnect()
@@ -7,6 +7,7 @@
 from __future__ import annotations
 
 import argparse
+import os
 import queue
 import sys
 import time
@@ -18,6 +19,7 @@ import workflows.recipe.wrapper
 import workflows.transport
 
 import zocalo.configuration
+from zocalo.util.ratelimit import TokenBucket
 
 
 def show_cluster_info(step: dict[str, Any]) -> None:
@@ -34,6 +36,131 @@ def show_cluster_info(step: dict[str, Any]) -> None:
 show_additional_info = {"cluster.submission": show_cluster_info}
 
 
+def show_message_info(
+    header: Mapping[str, Any], message: Any, target_queue: str
+) -> str:
+    """Print information about a message, and work out its destination if the
+    target queue is '.'"""
+    print()
+    try:
+        print(
+            "Message date: {:%Y-%m-%d %H:%M:%S}".format(
+                datetime.fromtimestamp(int(header["timestamp"]) / 1000)
+            )
+        )
+    except Exception:
+        pass
+
+    try:
+        print(f"Recipe ID:    {message['environment']['ID']}")
+        r = workflows.recipe.wrapper.RecipeWrapper(message=message)
+        if target_queue == ".":
+            assert r.recipe_step
+            target_queue = r.recipe_step["queue"]
+            print(f"Target Queue: {target_queue}")
+        additional_info_function = show_additional_info.get(target_queue)
+        if additional_info_function:
+            assert r.recipe_step
+            additional_info_function(r.recipe_step)
+    except Exception:
+        pass
+    return target_queue
+
+
+def recipe_destination(message: Any) -> str:
+    """Determine the destination of a recipe message, or return '.' if the
+    destination can not be determined."""
+    try:
+        r = workflows.recipe.wrapper.RecipeWrapper(message=message)
+        assert r.recipe_step
+        return r.recipe_step["queue"]
+    except Exception:
+        return "."
+
+
+def shovel_drain(
+    zc: zocalo.configuration.Configuration,
+    source: str,
+    destination: str,
+    *,
+    stop: float = 60,
+    interval: float = 1,
+) -> None:
+    """Move all messages from one RabbitMQ queue to another using a dynamic
+    shovel, and report progress until the shovel has moved all messages that
+    were in the source queue when it started, or the source queue has not
+    shrunk for stop seconds (0 = forever)."""
+    import requests
+    from workflows.transport.pika_transport import PikaTransport
+
+    from zocalo.util.rabbitmq import RabbitMQAPI, ShovelSpec
+
+    rmq = RabbitMQAPI.from_zocalo_configuration(zc)
+    # The virtual host may be set on the command line or in the configuration
+    vhost = PikaTransport.config.get(
+        "--rabbit-vhost", PikaTransport.defaults["--rabbit-vhost"]
+    )
+    shovel = ShovelSpec(
+        vhost=vhost,
+        name=f"zocalo.queue_drain.{source}.{os.getpid()}",
+        src_queue=source,
+        dest_queue=destination,
+        src_delete_after="queue-length",
+    )
+    initial = rmq.queues(vhost=vhost, name=source).messages or 0
+    print(f"Moving {initial} message(s) from {source} to {destination} via shovel")
+    rmq.shovel_declare(shovel)
+
+    drain_start = last_progress = time.time()
+    remaining = lowest = initial
+    shovel_seen = False
+    try:
+        while remaining:
+            time.sleep(interval)
+            current = rmq.queues(vhost=vhost, name=source).messages or 0
+            state = next((s for s in rmq.shovels(vhost) if s.name == shovel.name), None)
+            now = time.time()
+            remaining = current
+            moved = max(initial - remaining, 0)
+            print(
+                "%4d message(s) drained in %.1f seconds (%.0f messages/s),"
+                " %d remaining"
+                % (moved, now - drain_start, moved / (now - drain_start), remaining)
+            )
+            # Messages may be published to the source queue while draining, so
+            # only count it as progress when the queue shrinks further
+            if current < lowest:
+                lowest = current
+                last_progress = now
+            if state is not None:
+                shovel_seen = True
+                if state.state == "terminated":
+                    print(f"Shovel terminated: {state.reason}")
+                    break
+            elif shovel_seen:
+                # The shovel removes itself once it has moved all messages
+                # present at startup
+                print("Shovel finished")
+                break
+            if stop and now - last_progress > stop:
+                print(f"No progress for {stop:.1f} seconds")
+                break
+    except KeyboardInterrupt:
+        print("\nCancelling")
+    finally:
+        # The shovel removes itself once it has moved all messages present at
+        # startup, but may still exist if it was interrupted or stalled
+        try:
+            rmq.shovel_delete(vhost, shovel.name)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+    print(
+        "%d message(s) drained, %d message(s) remaining"
+        % (max(initial - remaining, 0), remaining)
+    )
+
+
 def run(argv: list[str] | None = None) -> None:
     # Load configuration
     zc = zocalo.configuration.from_file()
@@ -58,6 +185,29 @@ def run(argv: list[str] | None = None) -> None:
         default=5,
         help="Wait this many seconds between deliveries",
     )
+    throughput = parser.add_argument_group(
+        "throughput mode",
+        "Setting any of these options drains messages as fast as allowed, without"
+        " printing information about every message. Recipe messages are only"
+        " parsed if required to determine their destination.",
+    )
+    throughput.add_argument(
+        "--rate",
+        action="store",
+        dest="rate",
+        type=float,
+        default=None,
+        help="Drain at most this many messages per second, instead of waiting"
+        " between deliveries",
+    )
+    throughput.add_argument(
+        "--batch",
+        action="store",
+        dest="batch",
+        type=int,
+        default=None,
+        help="Move up to this many messages in a single transaction",
+    )
     parser.add_argument(
         "--stop",
         action="store",
@@ -66,10 +216,26 @@ def run(argv: list[str] | None = None) -> None:
         default=60,
         help="Stop if no message seen for this many seconds (0 = forever)",
     )
+    parser.add_argument(
+        "--shovel",
+        action="store_true",
+        dest="shovel",
+        default=False,
+        help="RabbitMQ only: move messages with a temporary dynamic shovel on the"
+        " broker, rather than passing them through this client",
+    )
     zc.add_command_line_options(parser)
     workflows.transport.add_command_line_options(parser, transport_argument=True)
     args = parser.parse_args(argv)
 
+    if args.shovel:
+        if args.transport != "PikaTransport":
+            sys.exit("--shovel can only be used with the PikaTransport")
+        if args.DEST == ".":
+            sys.exit("Automatic destinations can not be used with --shovel")
+        shovel_drain(zc, args.SOURCE, args.DEST, stop=args.stop)
+        return
+
     transport = workflows.transport.lookup(args.transport)()
     transport.connect()
 
@@ -78,11 +244,25 @@ def run(argv: list[str] | None = None) -> None:
     def receive_message(header: Mapping[str, Any], message: Any) -> None:
         messages.put((header, message))
 
-    print(f"Reading messages from {args.SOURCE}")
-    subscription_id = transport.subscribe(
-        args.SOURCE, receive_message, acknowledgement=True
+    throughput_mode = args.rate is not None or args.batch is not None
+    batch_size = max(args.batch or 1, 1)
+    ratelimit = (
+        TokenBucket(args.rate, burst=max(args.rate, batch_size)) if args.rate else None
     )
 
+    print(f"Reading messages from {args.SOURCE}")
+    if throughput_mode:
+        subscription_id = transport.subscribe(
+            args.SOURCE,
+            receive_message,
+            acknowledgement=True,
+            prefetch_count=2 * batch_size,
+        )
+    else:
+        subscription_id = transport.subscribe(
+            args.SOURCE, receive_message, acknowledgement=True
+        )
+
     if args.DEST == ".":
         print("Writing messages to automatically determined destinations")
     else:
@@ -102,7 +282,7 @@ def run(argv: list[str] | None = None) -> None:
             "redelivered",
         }
     )
-    drain_start = time.time()
+    drain_start = last_progress = time.time()
     idle_time = 0.0
     try:
         while True:
@@ -114,47 +294,52 @@ def run(argv: list[str] | None = None) -> None:
                     break
                 continue
             idle_time = 0
-            print()
-            try:
-                print(
-                    "Message date: {:%Y-%m-%d %H:%M:%S}".format(
-                        datetime.fromtimestamp(int(header["timestamp"]) / 1000)
-                    )
-                )
-            except Exception:
-                pass
-            target_queue = args.DEST
+            batch = [(header, message)]
+            while len(batch) < batch_size:
+                try:
+                    batch.append(messages.get_nowait())
+                except queue.Empty:
+                    break
 
-            try:
-                print(f"Recipe ID:    {message['environment']['ID']}")
-                r = workflows.recipe.wrapper.RecipeWrapper(message=message)
-                if target_queue == ".":
-                    assert r.recipe_step
-                    target_queue = r.recipe_step["queue"]
-                    print(f"Target Queue: {target_queue}")
-                additional_info_function = show_additional_info.get(target_queue)
-                if additional_info_function:
-                    assert r.recipe_step
-                    additional_info_function(r.recipe_step)
-            except Exception:
-                pass
-
-            if target_queue == ".":
-                exit("Could not determine target queue for message")
-
-            new_headers = {
-                key: header[key] for key in header if key not in header_filter
-            }
+            if ratelimit:
+                ratelimit.acquire(len(batch))
             txn = transport.transaction_begin(subscription_id=subscription_id)
-            transport.send(target_queue, message, headers=new_headers, transaction=txn)
-            transport.ack(header, transaction=txn)
+            for header, message in batch:
+                if not throughput_mode:
+                    target_queue = show_message_info(header, message, args.DEST)
+                elif args.DEST == ".":
+                    target_queue = recipe_destination(message)
+                else:
+                    target_queue = args.DEST
+                if target_queue == ".":
+                    transport.transaction_abort(txn)
+                    exit("Could not determine target queue for message")
+
+                new_headers = {
+                    key: header[key] for key in header if key not in header_filter
+                }
+                transport.send(
+                    target_queue, message, headers=new_headers, transaction=txn
+                )
+                transport.ack(header, transaction=txn)
             transport.transaction_commit(txn)
-            message_count = message_count + 1
-            print(
-                "%4d message(s) drained in %.1f seconds"
-                % (message_count, time.time() - drain_start)
-            )
-            time.sleep(args.wait)
+            message_count = message_count + len(batch)
+            if not throughput_mode:
+                print(
+                    "%4d message(s) drained in %.1f seconds"
+                    % (message_count, time.time() - drain_start)
+                )
+                time.sleep(args.wait)
+            elif time.time() - last_progress > 1:
+                last_progress = time.time()
+                print(
+                    "%4d message(s) drained in %.1f seconds (%.0f messages/s)"
+                    % (
+                        message_count,
+                        last_progress - drain_start,
+                        message_count / (last_progress - drain_start),
+                    )
+                )
     except KeyboardInterrupt:
         sys.exit(
             "\nCancelling, %d message(s) drained, %d message(s) unprocessed in memory"
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+import zocalo.configuration
+
+#
+# zocalo.queue_metrics
+#   Record and query the history of RabbitMQ queue depths and rates
+#
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration such as 90, 90s, 15m, 2h or 7d into seconds."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid duration: {value}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2) or "s"]
+
+
+def _format(value: float | None, precision: int = 1) -> str:
+    return "-" if value is None else f"{value:.{precision}f}"
+
+
+def run() -> None:
+    zc = zocalo.configuration.from_file()
+    zc.activate()
+
+    parser = argparse.ArgumentParser(
+        usage="zocalo.queue_metrics [options] {collect,show} ...",
+        description="Record and query the history of RabbitMQ queues",
+    )
+    parser.add_argument("-?", action="help", help=argparse.SUPPRESS)
+    parser.add_argument(
+        "-d",
+        "--directory",
+        dest="directory",
+        type=Path,
+        default=None,
+        help="Location of the metrics store (default: storage setting"
+        " zocalo.queue_metrics.location)",
+    )
+    zc.add_command_line_options(parser)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    collect_parser = subparsers.add_parser(
+        "collect", help="Poll the RabbitMQ management API and record samples"
+    )
+    collect_parser.add_argument(
+        "-i",
+        "--interval",
+        dest="interval",
+        type=parse_duration,
+        default=10.0,
+        help="Time between polls (default: 10s)",
+    )
+    collect_parser.add_argument(
+        "--once", action="store_true", help="Record a single sample and exit"
+    )
+    collect_parser.add_argument(
+        "--vhost", dest="vhost", default=None, help="Only record queues in this vhost"
+    )
+    collect_parser.add_argument(
+        "--pattern",
+        dest="pattern",
+        default=None,
+        help="Only record queues whose names match this pattern",
+    )
+    collect_parser.add_argument(
+        "--regex",
+        dest="use_regex",
+        action="store_true",
+        help="Interpret --pattern as a regular expression",
+    )
+
+    show_parser = subparsers.add_parser("show", help="Summarise recorded queues")
+    show_parser.add_argument(
+        "queues",
+        nargs="*",
+        help="Queues to show, optionally as vhost/name (default: all queues)",
+    )
+    show_parser.add_argument(
+        "-s",
+        "--since",
+        dest="since",
+        type=parse_duration,
+        default=3600.0,
+        help="Period to summarise, e.g. 15m, 2h, 7d (default: 1h)",
+    )
+    show_parser.add_argument(
+        "--json", dest="json", action="store_true", help="Write summaries as JSON"
+    )
+
+    args = parser.parse_args()
+
+    directory = args.directory
+    if directory is None and zc.storage:
+        directory = zc.storage.get("zocalo.queue_metrics.location")
+    if not directory:
+        sys.exit("No metrics store location specified")
+
+    from zocalo.util import queue_metrics
+
+    store = queue_metrics.QueueMetricsStore(directory)
+    try:
+        if args.command == "collect":
+            from zocalo.util.rabbitmq import RabbitMQAPI
+
+            api = RabbitMQAPI.from_zocalo_configuration(zc)
+            options = {
+                "vhost": args.vhost,
+                "pattern": args.pattern,
+                "use_regex": args.use_regex,
+            }
+            if args.once:
+                count = queue_metrics.collect(api, store, **options)
+                print(f"Recorded {count} queues")
+            else:
+                queue_metrics.run_collector(api, store, args.interval, **options)
+            return
+
+        since = time.time() - args.since
+        summaries = {}
+        for vhost, name in store.queues():
+            if args.queues and not {name, f"{vhost}/{name}"} & set(args.queues):
+                continue
+            summaries[f"{vhost}/{name}"] = store.metrics(vhost, name).summary(since)
+        if args.json:
+            print(json.dumps(summaries, indent=2))
+            return
+        if not summaries:
+            print("No metrics recorded")
+            return
+        width = max(len(queue) for queue in summaries)
+        print(
+            f"{'Queue':{width}}  {'Depth':>8} {'p50':>8} {'p95':>8} {'Max':>8}"
+            f" {'Cons':>5} {'Util':>5} {'In/s':>8} {'Out/s':>8} {'Anom':>5}"
+        )
+        for queue, s in summaries.items():
+            print(
+                f"{queue:{width}}  {_format(s['messages'], 0):>8}"
+                f" {_format(s['messages_p50'], 0):>8}"
+                f" {_format(s['messages_p95'], 0):>8}"
+                f" {_format(s['messages_max'], 0):>8}"
+                f" {_format(s['consumers'], 0):>5}"
+                f" {_format(s['consumer_utilisation_p50'], 2):>5}"
+                f" {_format(s['publish_rate'], 2):>8}"
+                f" {_format(s['deliver_rate'], 2):>8}"
+                f" {s['anomalies']:>5}"
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    run()
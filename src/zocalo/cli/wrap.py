@@ -107,10 +107,28 @@ def run() -> None:
     # Connect to transport and start sending notifications
     transport = workflows.transport.lookup(args.transport)()
     transport.connect()
-    st = zocalo.wrapper.StatusNotifications(transport.broadcast_status, args.wrapper)
+    storage = zc.storage or {}
+    st = zocalo.wrapper.StatusNotifications(
+        transport.broadcast_status,
+        args.wrapper,
+        interval=float(storage.get("zocalo.wrap.status_interval", 3)),
+        min_interval=float(storage.get("zocalo.wrap.status_min_interval", 0)),
+        jitter=float(storage.get("zocalo.wrap.status_jitter", 0)),
+        delta=bool(storage.get("zocalo.wrap.status_delta", False)),
+    )
     for field, value in zocalo.util.extended_status_dictionary().items():
         st.set_static_status_field(field, value)
 
+    # Optionally record resource usage of the wrapped process and its children
+    sampler = None
+    if storage.get("zocalo.wrap.resource_sampling"):
+        from zocalo.util.resources import ResourceSampler
+
+        sampler = ResourceSampler(
+            interval=float(storage["zocalo.wrap.resource_sampling"]),
+            callback=lambda sample: st.set_static_status_field("resources", sample),
+        )
+
     environment = {"config": zc}
 
     # Instantiate chosen wrapper
@@ -152,7 +170,14 @@ def run() -> None:
         instance.failure(e)
         st.set_status(workflows.services.common_service.Status.ERROR)
 
-    instance.done("Finished processing")
+    if sampler:
+        sampler.shutdown()
+        sampler.join()
+        resources = sampler.summary()
+        log.info("Resource usage: %s", resources)
+        instance.done({"message": "Finished processing", "resources": resources})
+    else:
+        instance.done("Finished processing")
 
     st.shutdown()
     st.join()
@@ -34,6 +34,10 @@ class ConfigSchema(mm.Schema):
     include = mm.fields.List(mm.fields.Str())
 
 
+# Creating schema objects is comparatively slow, so only do this once
+_config_schema_fields = frozenset(ConfigSchema().fields)
+
+
 class PluginSchema(mm.Schema):
     plugin = mm.fields.Str(
         required=True,
@@ -85,7 +89,7 @@ class Configuration:
         self._plugin_configurations: dict[str, pathlib.Path | dict[str, typing.Any]] = {
             name: config
             for name, config in yaml_dict.items()
-            if name not in ConfigSchema().fields
+            if name not in _config_schema_fields
         }
         for name in _configuration_plugins:
             setattr(self, "_" + name, None)
@@ -318,7 +322,7 @@ def _read_configuration_yaml(configuration: str) -> dict:
 
     plugin_fields: dict[str, mm.fields.Field] = {}
     for key in yaml_dict:
-        if key in ConfigSchema().fields:
+        if key in _config_schema_fields:
             continue
         plugin_fields[key] = mm.fields.Nested(
             PluginSchema, unknown=mm.EXCLUDE, required=True
@@ -410,7 +414,7 @@ def _merge_configuration(
 
         # Ensure all referenced plugins are defined and valid
         for plugin in parsed["environments"][environment]:
-            if plugin in ConfigSchema().fields:
+            if plugin in _config_schema_fields:
                 raise ConfigurationError(
                     f"Configuration error: environment {environment} references reserved name {plugin}"
                 )
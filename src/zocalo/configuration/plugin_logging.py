@@ -2,7 +2,12 @@ from __future__ import annotations
 
 import copy
 import logging.config
+import logging.handlers
+import os
+import queue
 import socket
+import threading
+from collections.abc import Sequence
 from typing import Any
 
 import graypy.handler
@@ -68,15 +73,28 @@ class Logging:
         logconfig.setdefault("version", 1)
         logconfig.setdefault("disable_existing_loggers", False)
         logconfig.setdefault("incremental", False)
+        queue_config = logconfig.pop("queue", None)
 
-        if logconfig["incremental"] and not _config_is_incremental(logconfig):
+        if logconfig["incremental"] and (
+            queue_config or not _config_is_incremental(logconfig)
+        ):
             raise zocalo.ConfigurationError(
                 "Logging configuration error: definition defines items not allowed "
                 "in an incremental definition"
             )
+        queue_settings = (
+            _parse_queue_config(
+                queue_config, defined_handlers=list(logconfig.get("handlers", {}))
+            )
+            if queue_config
+            else None
+        )
 
         logging.config.dictConfig(logconfig)
 
+        if queue_settings:
+            _queue_handlers(**queue_settings)
+
         for level, verbosity_def in enumerate(logconfig.get("verbose", [])):
             if not isinstance(verbosity_def, dict):
                 raise zocalo.ConfigurationError(
@@ -149,6 +167,191 @@ def GraylogUDPHandler(*, host: str, port: int) -> logging.Handler:
     return graypy.GELFUDPHandler(_resolve_hostname(host), port, level_names=True)
 
 
+OVERFLOW_POLICIES = ("drop_new", "drop_old", "block")
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Passes log records to other handlers via a bounded queue, so that slow
+    handlers, such as a Graylog handler with an unresponsive server, are run
+    in a background thread instead of the thread that logs the message.
+
+    When the queue is full the 'overflow' policy decides what happens:
+    'drop_new' (default) discards the new record, 'drop_old' discards the
+    oldest queued record, and 'block' waits for space in the queue.
+
+    Dropped records are counted in the 'dropped' attribute and in the
+    zocalo_logging_dropped_records metric, and a warning with the number of
+    dropped records is passed on ahead of the next queued record.
+    """
+
+    def __init__(
+        self,
+        handlers: Sequence[logging.Handler],
+        maxsize: int = 10000,
+        overflow: str = "drop_new",
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {overflow!r}, must be one of {OVERFLOW_POLICIES}"
+            )
+        if maxsize < 1:
+            raise ValueError(f"Queue size must be positive, not {maxsize}")
+        super().__init__(queue.Queue(maxsize))
+        self.queue: queue.Queue
+        self.overflow = overflow
+        self.dropped = 0
+        self._unreported = 0
+        # Not the handler lock, which is held while waiting for queue space
+        self._dropped_lock = threading.Lock()
+        self._maxsize = maxsize
+        self._targets = tuple(handlers)
+
+        import zocalo.util.metrics
+
+        self._dropped_metric = zocalo.util.metrics.counter(
+            "zocalo_logging_dropped_records",
+            "Log records dropped because a logging queue was full",
+            ["handler"],
+        ).labels(",".join(h.name or type(h).__name__ for h in self._targets))
+        self._start_listener()
+
+    def _start_listener(self) -> None:
+        self._pid = os.getpid()
+        self.listener = _DroppedRecordsListener(self, self._targets)
+        self.listener.start()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler.prepare() keep the exception information and the
+        # unformatted message, as records are only passed to other handlers in
+        # the same process, which may want to format them themselves
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            # The listener thread does not survive a fork, and the queue may
+            # have been in use at the time
+            self.queue = queue.Queue(self._maxsize)
+            self._start_listener()
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == "drop_old":
+            try:
+                oldest = self.queue.get_nowait()
+                if oldest is self.listener._sentinel:
+                    # Never drop the request to stop the listener
+                    self.queue.put_nowait(oldest)
+                else:
+                    self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        with self._dropped_lock:
+            self.dropped += 1
+            self._unreported += 1
+        self._dropped_metric.inc()
+
+    def take_unreported(self) -> int:
+        """Return the number of records dropped since the last call."""
+        with self._dropped_lock:
+            unreported, self._unreported = self._unreported, 0
+        return unreported
+
+    def close(self) -> None:
+        # Pass on all queued records before closing
+        if self._pid == os.getpid() and self.listener._thread is not None:
+            self.listener.stop()
+        super().close()
+
+
+class _DroppedRecordsListener(logging.handlers.QueueListener):
+    def __init__(
+        self, handler: BoundedQueueHandler, targets: Sequence[logging.Handler]
+    ):
+        super().__init__(handler.queue, *targets, respect_handler_level=True)
+        self._source = handler
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+    def handle(self, record: logging.LogRecord) -> None:
+        dropped = self._source.take_unreported()
+        if dropped:
+            super().handle(
+                logging.LogRecord(
+                    __name__,
+                    logging.WARNING,
+                    __file__,
+                    0,
+                    "Dropped %d log records as the logging queue was full",
+                    (dropped,),
+                    None,
+                )
+            )
+        super().handle(record)
+
+
+def _parse_queue_config(config: Any, *, defined_handlers: list[str]) -> dict[str, Any]:
+    if config is True:
+        config = {}
+    if not isinstance(config, dict):
+        raise zocalo.ConfigurationError(
+            "Logging configuration error: queue definition is not a dictionary"
+        )
+    unknown = set(config) - {"handlers", "size", "overflow"}
+    if unknown:
+        raise zocalo.ConfigurationError(
+            f"Logging configuration error: unknown queue settings {sorted(unknown)}"
+        )
+    names = config.get("handlers", defined_handlers)
+    undefined = set(names) - set(defined_handlers)
+    if undefined:
+        raise zocalo.ConfigurationError(
+            "Logging configuration error: queue refers to undefined handlers "
+            f"{sorted(undefined)}"
+        )
+    size = config.get("size", 10000)
+    if not isinstance(size, int) or size < 1:
+        raise zocalo.ConfigurationError(
+            f"Logging configuration error: invalid queue size {size!r}"
+        )
+    overflow = config.get("overflow", "drop_new")
+    if overflow not in OVERFLOW_POLICIES:
+        raise zocalo.ConfigurationError(
+            f"Logging configuration error: queue overflow policy must be one of "
+            f"{', '.join(OVERFLOW_POLICIES)}, not {overflow!r}"
+        )
+    return {"names": names, "maxsize": size, "overflow": overflow}
+
+
+def _queue_handlers(names: Sequence[str], maxsize: int, overflow: str) -> None:
+    """Replace the named handlers on all loggers with queue handlers that pass
+    records on to the original handlers in a background thread."""
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    replacements: dict[logging.Handler, BoundedQueueHandler] = {}
+    for logger in loggers:
+        for n, handler in enumerate(logger.handlers):
+            if handler.name not in names:
+                continue
+            if handler not in replacements:
+                replacements[handler] = BoundedQueueHandler(
+                    [handler], maxsize=maxsize, overflow=overflow
+                )
+            logger.handlers[n] = replacements[handler]
+
+
 class DowngradeFilter(logging.Filter):
     """
     Reduces the level of a log message within certain boundaries.
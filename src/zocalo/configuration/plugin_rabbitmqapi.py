@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any
 
-from marshmallow import fields
+from marshmallow import fields, validate
 
 from zocalo.configuration import PluginSchema
 
@@ -13,6 +13,10 @@ class RabbitAPI:
         username = fields.Str(required=True)
         password = fields.Str(required=True)
         vhost = fields.Str()
+        timeout = fields.Float(validate=validate.Range(min=0, min_inclusive=False))
+        retries = fields.Int(validate=validate.Range(min=0))
+        backoff = fields.Float(validate=validate.Range(min=0))
+        cache_ttl = fields.Float(validate=validate.Range(min=0))
 
     @staticmethod
     def activate(configuration: dict[str, Any]) -> dict[str, Any]:
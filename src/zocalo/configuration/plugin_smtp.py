@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any
 
-from marshmallow import fields
+from marshmallow import fields, validate
 
 from zocalo.configuration import PluginSchema
 
@@ -12,6 +12,7 @@ class SMTP:
         host = fields.Str(required=True)
         port = fields.Int(required=True)
         from_ = fields.Email(data_key="from")
+        max_payload_length = fields.Int(validate=validate.Range(min=1))
 
     @staticmethod
     def activate(configuration: dict[str, Any]) -> dict[str, Any]:
@@ -2,13 +2,18 @@ from __future__ import annotations
 
 import logging
 import sys
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 import workflows.contrib.start_service
+import workflows.services
 import workflows.transport
 
 import zocalo.configuration.argparse
 import zocalo.util
+import zocalo.util.metrics
+
+if TYPE_CHECKING:
+    from zocalo.util.profiler import ServiceProfiler
 
 
 def start_service() -> None:
@@ -19,10 +24,45 @@ def start_service() -> None:
     )
 
 
+class ServiceProcess:
+    """Runs a service in the service process, after setting up anything the
+    service process needs from zocalo. This happens in the service process
+    itself and only depends on the service environment, so it does not
+    matter how multiprocessing starts the service process."""
+
+    def __init__(self, service: Any):
+        self.service = service
+
+    def __call__(self, **kwargs: Any) -> None:
+        environment = self.service._environment
+        # Metrics are recorded in the service process, so are served from here
+        zocalo.util.metrics.start_from_environment(environment)
+        if environment.get("zocalo_profiler"):
+            from zocalo.util.profiler import ServiceProfiler
+
+            ServiceProfiler(**environment["zocalo_profiler"]).install(self.service)
+        type(self.service).start(self.service, **kwargs)
+
+
+class ServiceFactory:
+    """Creates service instances that are started through ServiceProcess"""
+
+    def __init__(self, service_class: type):
+        self.service_class = service_class
+
+    def __call__(self, **kwargs: Any) -> Any:
+        service = self.service_class(**kwargs)
+        # The frontend uses service.start as the target of the service process
+        service.start = ServiceProcess(service)
+        return service
+
+
 class ServiceStarter(workflows.contrib.start_service.ServiceStarter):
     """Starts a workflow service"""
 
     __frontendref = None
+    profiler: ServiceProfiler | None = None
+    _command_channel: str | None = None
 
     def setup_logging(self) -> None:
         """Initialize common logging framework. Everything is logged to central
@@ -98,6 +138,21 @@ class ServiceStarter(workflows.contrib.start_service.ServiceStarter):
             default=False,
             help="Restart service on failure",
         )
+        parser.add_option(
+            "--metrics-port",
+            dest="metrics_port",
+            metavar="PORT",
+            type="int",
+            default=None,
+            help="Expose service metrics in the OpenMetrics format on this port",
+        )
+        parser.add_option(
+            "--metrics-host",
+            dest="metrics_host",
+            metavar="ADDRESS",
+            default="127.0.0.1",
+            help="Address of the metrics endpoint (default: 127.0.0.1)",
+        )
         self._zc.add_command_line_options(parser)
         self.log.debug("Launching %r", sys.argv)
 
@@ -119,6 +174,28 @@ class ServiceStarter(workflows.contrib.start_service.ServiceStarter):
         kwargs["environment"] = kwargs.get("environment", {})
         kwargs["environment"]["live"] = self.use_live_infrastructure
         kwargs["environment"]["config"] = self._zc
+        if self.options.metrics_port is not None:
+            kwargs["environment"]["zocalo_metrics"] = {
+                "port": self.options.metrics_port,
+                "host": self.options.metrics_host,
+            }
+
+        # Allow profiling the service on request
+        profile_location = (
+            self._zc.storage.get("zocalo.profiler.location")
+            if self._zc.storage
+            else None
+        )
+        if profile_location:
+            from zocalo.util.profiler import ServiceProfiler
+
+            self.profiler = ServiceProfiler(profile_location)
+            self._command_channel = kwargs.get("transport_command_channel")
+            kwargs["environment"]["zocalo_profiler"] = {"location": profile_location}
+
+        service_class = workflows.services.lookup(kwargs["service"])
+        if service_class:
+            kwargs["service"] = ServiceFactory(service_class)
         return kwargs
 
     def on_frontend_preparation(self, frontend: Any) -> None:  # pyright: ignore[reportIncompatibleMethodOverride]
@@ -128,6 +205,8 @@ class ServiceStarter(workflows.contrib.start_service.ServiceStarter):
         extended_status = zocalo.util.extended_status_dictionary()
         if self.options.tag:
             extended_status["tag"] = self.options.tag
+        if self.options.metrics_port is not None:
+            extended_status["metrics_port"] = str(self.options.metrics_port)
 
         original_status_function = frontend.get_status
 
@@ -137,3 +216,6 @@ class ServiceStarter(workflows.contrib.start_service.ServiceStarter):
             return status
 
         frontend.get_status = extend_status_wrapper
+
+        if self.profiler:
+            self.profiler.attach(frontend, self._command_channel)
@@ -15,6 +15,18 @@ import workflows.recipe
 from opentelemetry import trace
 from workflows.services.common_service import CommonService
 
+import zocalo.util.metrics
+
+_dispatch_seconds = zocalo.util.metrics.histogram(
+    "zocalo_dispatcher_dispatch_seconds",
+    "Time taken to turn a processing request into a running recipe",
+)
+_requests = zocalo.util.metrics.counter(
+    "zocalo_dispatcher_requests",
+    "Processing requests handled by the dispatcher, by outcome",
+    ["outcome"],
+)
+
 
 def _extract_dcid(params: dict) -> int | None:
     """Helper method to get dcid. Used for injecting it into current span"""
@@ -223,6 +235,7 @@ class Dispatcher(CommonService):
                 "Dispatcher rejected malformed message: parameters not given as dictionary"
             )
             self.transport.nack(header)
+            _requests.labels("rejected").inc()
             return
 
         # Unless 'guid' is already defined then generate a unique recipe IDs for
@@ -275,6 +288,7 @@ class Dispatcher(CommonService):
                         )
                         self.log.info("Message not yet ready for processing")
                         self.transport.transaction_commit(txn)
+                        _requests.labels("delayed").inc()
                         return
                     elif parameters.get("dispatcher_error_queue"):
                         # Drop message into error queue
@@ -291,6 +305,7 @@ class Dispatcher(CommonService):
                             "Message rejected to specified error queue as still not ready for processing"
                         )
                         self.transport.transaction_commit(txn)
+                        _requests.labels("expired").inc()
                         return
                     else:
                         # Unhandled error, send message to DLQ
@@ -298,6 +313,7 @@ class Dispatcher(CommonService):
                             "Message rejected as still not ready for processing",
                         )
                         self.transport.nack(header)
+                        _requests.labels("expired").inc()
                         return
 
             filtered_message = copy.deepcopy(message)
@@ -320,6 +336,7 @@ class Dispatcher(CommonService):
                         exc_info=True,
                     )
                     self.transport.nack(header)
+                    _requests.labels("rejected").inc()
                     return
 
             self.log.debug("Mangled processing request:\n" + str(filtered_message))
@@ -353,7 +370,7 @@ class Dispatcher(CommonService):
 
             # Commit transaction
             self.transport.transaction_commit(txn)
-            self.log.info(
-                "Processed incoming message in %.4f seconds",
-                timeit.default_timer() - start_time,
-            )
+            duration = timeit.default_timer() - start_time
+            _dispatch_seconds.observe(duration)
+            _requests.labels("dispatched").inc()
+            self.log.info("Processed incoming message in %.4f seconds", duration)
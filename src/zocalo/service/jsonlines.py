@@ -7,6 +7,13 @@ from pathlib import Path
 import workflows.recipe
 from workflows.services.common_service import CommonService
 
+import zocalo.util.metrics
+
+_buffered_messages = zocalo.util.metrics.gauge(
+    "zocalo_jsonlines_buffered_messages",
+    "Messages received but not yet written to disk",
+)
+
 
 class JSONLines(CommonService):
     """Write received messages into a JSONLines file on disk"""
@@ -59,6 +66,7 @@ class JSONLines(CommonService):
             self._data.setdefault(output_filename, [])
             self._data[output_filename].append((header, filtered_message))
             n_stored_messages = sum(len(v) for v in self._data.values())
+            _buffered_messages.set(n_stored_messages)
 
         if n_stored_messages == 100:
             self.log.info("Triggering process messages")
@@ -91,3 +99,4 @@ class JSONLines(CommonService):
 
                 # delete this data now we've processed it
                 del self._data[output_filename]
+                _buffered_messages.set(sum(len(v) for v in self._data.values()))
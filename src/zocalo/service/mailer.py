@@ -1,14 +1,26 @@
 from __future__ import annotations
 
 import email.message
+import io
 import pprint
 import smtplib
+from collections.abc import Callable
 from typing import Any
 
 import workflows.recipe
 from workflows.services.common_service import CommonService
 
 import zocalo.configuration
+import zocalo.util.metrics
+
+_send_seconds = zocalo.util.metrics.histogram(
+    "zocalo_mailer_send_seconds", "Time taken to deliver a message to the SMTP server"
+)
+_notifications = zocalo.util.metrics.counter(
+    "zocalo_mailer_notifications",
+    "Mail notifications handled by the mailer, by outcome",
+    ["outcome"],
+)
 
 
 class _SafeDict(dict):
@@ -19,6 +31,115 @@ class _SafeDict(dict):
         return "{" + key + "}"
 
 
+class _LazySafeDict(_SafeDict):
+    """A _SafeDict where some values are only computed when they are first
+    looked up. This way expensive fields are not generated for templates that
+    do not reference them."""
+
+    def __init__(self, **factories: Callable[[], Any]):
+        super().__init__()
+        self._factories = factories
+
+    def __missing__(self, key: str) -> Any:
+        if key in self._factories:
+            value = self[key] = self._factories[key]()
+            return value
+        return super().__missing__(key)
+
+
+class _PayloadTruncated(Exception):
+    pass
+
+
+class _BoundedStringIO(io.StringIO):
+    """A string buffer that refuses to grow beyond a set number of characters."""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self._remaining = limit
+
+    def write(self, s: str) -> int:
+        if len(s) > self._remaining:
+            super().write(s[: self._remaining])
+            self._remaining = 0
+            raise _PayloadTruncated()
+        self._remaining -= len(s)
+        return super().write(s)
+
+
+# Line width used when pretty-printing payloads
+_PPRINT_WIDTH = 80
+
+
+def _clip(obj: Any, budget: list[int]) -> Any:
+    """Return a copy of a payload reduced to roughly its first budget[0]
+    characters of output, so that formatting it costs no more than that.
+
+    budget is shared between recursive calls and counts down a lower bound
+    on the length of the representation of everything kept so far."""
+    if budget[0] <= 0:
+        return obj
+    if type(obj) in (str, bytes):
+        budget[0] -= len(obj)
+        return obj[: len(obj) + budget[0]] if budget[0] < 0 else obj
+    if type(obj) in (dict, list, tuple, set, frozenset):
+        budget[0] -= 2
+        items = obj.items() if type(obj) is dict else obj
+        if type(obj) in (dict, set, frozenset):
+            # Clip in the order the items are printed in
+            try:
+                items = sorted(items)
+            except TypeError:
+                return obj
+        kept = []
+        for item in items:
+            if budget[0] <= 0:
+                break
+            if type(obj) is dict:
+                key, value = item
+                _clip(key, budget)
+                # Anything left out is beyond the limit, so just needs a stand-in
+                item = (key, _clip(value, budget) if budget[0] > 0 else ...)
+            else:
+                item = _clip(item, budget)
+            kept.append(item)
+        return type(obj)(kept)
+    budget[0] -= 1
+    return obj
+
+
+def _format_payload(message: Any, limit: int | None = None) -> str:
+    """Render a message payload for inclusion in an email.
+
+    If a limit is given then the output is truncated to that many characters,
+    and only as much of the payload as is needed for that is formatted."""
+    # Leave room for the trailing newline written by PrettyPrinter.pprint()
+    buffer = _BoundedStringIO(limit + 1) if limit else io.StringIO()
+    try:
+        if isinstance(message, list):
+            for n, line in enumerate(message):
+                if n:
+                    buffer.write("\n")
+                buffer.write(line)
+        else:
+            if limit:
+                # Keep enough beyond the limit that everything printed within
+                # it is laid out as it would be for the whole payload
+                message = _clip(message, [limit + _PPRINT_WIDTH + 1])
+            pprint.PrettyPrinter(stream=buffer, width=_PPRINT_WIDTH).pprint(message)
+            buffer.seek(buffer.tell() - 1)
+            buffer.truncate()
+    except _PayloadTruncated:
+        pass
+    else:
+        if not limit or buffer.tell() <= limit:
+            return buffer.getvalue()
+    return (
+        buffer.getvalue()[:limit]
+        + f"\n[... payload truncated after {limit} characters]"
+    )
+
+
 class Mailer(CommonService):
     """A service that generates emails from messages."""
 
@@ -122,13 +243,13 @@ class Mailer(CommonService):
             return
         if isinstance(content, list):
             content = "".join(content)
-        if isinstance(message, list):
-            pprint_message = "\n".join(message)
-        else:
-            pprint_message = pprint.pformat(message)
 
+        payload_limit = self.config.smtp.get("max_payload_length")
         content = content.format_map(
-            _SafeDict(payload=message, pprint_payload=pprint_message)
+            _LazySafeDict(
+                payload=lambda: message,
+                pprint_payload=lambda: _format_payload(message, payload_limit),
+            )
         )
 
         self.log.info("Sending mail notification %r to %r", subject, recipients)
@@ -144,17 +265,25 @@ class Mailer(CommonService):
             msg["To"] = recipients
             msg["From"] = sender
             msg.set_content(content)
-            with smtplib.SMTP(
-                host=self.config.smtp["host"], port=self.config.smtp["port"], timeout=60
-            ) as s:
+            with (
+                _send_seconds.time(),
+                smtplib.SMTP(
+                    host=self.config.smtp["host"],
+                    port=self.config.smtp["port"],
+                    timeout=60,
+                ) as s,
+            ):
                 s.send_message(msg)
         except TimeoutError as e:
+            _notifications.labels("timeout").inc()
             self.log.error(
                 f"Message delivery failed with timeout: {e}",
             )
         except Exception as e:
+            _notifications.labels("failed").inc()
             self.log.error(
                 f"Message delivery failed with error {e}",
             )
         else:
+            _notifications.labels("sent").inc()
             self.log.debug("Message sent successfully")
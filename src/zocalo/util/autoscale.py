@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import json
+import math
+import statistics
+import threading
+import time
+from collections.abc import Mapping, Sequence
+from typing import Any, NamedTuple
+
+from pydantic import BaseModel, ConfigDict, Field
+from workflows.services.common_service import CommonService
+from workflows.transport.common_transport import CommonTransport
+
+# Columns of the queue listing used by the advisor
+COLUMNS = [
+    "name",
+    "vhost",
+    "messages_ready",
+    "messages_unacknowledged",
+    "consumers",
+    "message_stats.publish",
+    "message_stats.ack",
+    "message_stats.deliver_get",
+]
+
+# Service states in which an instance no longer counts towards capacity
+_FINISHED = {
+    CommonService.SERVICE_STATUS_SHUTDOWN,
+    CommonService.SERVICE_STATUS_END,
+    CommonService.SERVICE_STATUS_ERROR,
+    CommonService.SERVICE_STATUS_TEARDOWN,
+}
+
+
+class ScalingPolicy(BaseModel):
+    queues: list[str] = Field(..., description="Queues consumed by the service.")
+    vhost: str | None = Field(
+        None, description="Virtual host of the queues. If unset, any virtual host."
+    )
+    min_instances: int = Field(0, ge=0)
+    max_instances: int = Field(10, ge=0)
+    target_drain_time: float = Field(
+        300,
+        gt=0,
+        description="Number of seconds in which the backlog should be cleared.",
+    )
+    instance_rate: float | None = Field(
+        None,
+        gt=0,
+        description="Messages per second processed by one instance. Only used"
+        " until a rate has been observed.",
+    )
+    scale_down_utilisation: float = Field(
+        0.5,
+        ge=0,
+        le=1,
+        description="Only scale down while instances are busy for less than"
+        " this fraction of the time.",
+    )
+    max_step: int | None = Field(
+        None, gt=0, description="Maximum change in the number of instances at once."
+    )
+    model_config = ConfigDict(extra="forbid")
+
+
+class Recommendation(NamedTuple):
+    service: str
+    current: int
+    target: int
+    action: str
+    backlog: int
+    arrival_rate: float | None
+    processing_rate: float | None
+    drain_time: float | None
+    reason: str
+
+
+class ServiceStatusMonitor:
+    def __init__(self, transport: CommonTransport, expiry: float = 30):
+        """Keep track of running service instances by listening to the status
+        messages that every zocalo service broadcasts.
+
+        :param expiry: Number of seconds after which an instance that has not
+                       broadcast its status is considered gone
+        """
+        self._transport = transport
+        self._expiry = expiry
+        self._instances: dict[str, tuple[float, dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._transport.subscribe_broadcast("transient.status", self.receive)
+
+    def receive(self, header: Mapping[str, Any], message: Any) -> None:
+        if isinstance(message, (str, bytes)):
+            try:
+                message = json.loads(message)
+            except ValueError:
+                return
+        if not isinstance(message, dict) or "host" not in message:
+            return
+        with self._lock:
+            self._instances[message["host"]] = (time.monotonic(), message)
+
+    def instances(self) -> dict[str, list[dict[str, Any]]]:
+        """The most recent status of every live instance, by service name."""
+        cutoff = time.monotonic() - self._expiry
+        services: dict[str, list[dict[str, Any]]] = {}
+        with self._lock:
+            for host, (seen, status) in list(self._instances.items()):
+                if seen < cutoff:
+                    del self._instances[host]
+                elif status.get("status") not in _FINISHED:
+                    services.setdefault(status.get("service", ""), []).append(status)
+        return services
+
+
+def _busy_fraction(status: Mapping[str, Any]) -> float | None:
+    utilization = status.get("utilization")
+    if not isinstance(utilization, Mapping):
+        return None
+    # Status codes become strings when sent as JSON
+    busy = CommonService.SERVICE_STATUS_PROCESSING
+    return float(utilization.get(busy, utilization.get(str(busy), 0)))
+
+
+def _stat(queue: Any, counter: str) -> float | None:
+    stats = getattr(queue, "message_stats", None)
+    if stats is None:
+        return None
+    if isinstance(stats, Mapping):
+        return stats.get(counter)
+    return getattr(stats, counter, None)
+
+
+def _total(values: Sequence[float | None]) -> float | None:
+    """The sum of all values, or None if any value is unknown."""
+    if not values or any(v is None for v in values):
+        return None
+    return sum(v for v in values if v is not None)
+
+
+class AutoscaleAdvisor:
+    def __init__(self, policies: Mapping[str, ScalingPolicy]):
+        """Recommend a number of instances for each service from the backlog
+        and throughput of the queues it consumes.
+
+        Arrival and processing rates are derived from the message counters of
+        consecutive observations, so the first recommendation of an advisor
+        can only use the instance_rate of a policy.
+
+        The target is the number of instances needed to keep up with arriving
+        messages and clear the current backlog within the target drain time,
+        at the capacity per instance observed so far. Where the utilisation
+        of the instances is known, the capacity is the throughput per instance
+        divided by the fraction of the time instances are busy. Scaling down
+        is held back while instances are busy for more than
+        scale_down_utilisation of the time.
+        """
+        self.policies = dict(policies)
+        self._previous: dict[
+            tuple[str, str], tuple[float, float | None, float | None]
+        ] = {}
+
+    def _rates(self, queue: Any, now: float) -> tuple[float | None, float | None]:
+        key = (queue.vhost, queue.name)
+        published = _stat(queue, "publish")
+        processed = _stat(queue, "ack")
+        if processed is None:
+            processed = _stat(queue, "deliver_get")
+        previous = self._previous.get(key)
+        self._previous[key] = (now, published, processed)
+        if previous is None or now <= previous[0]:
+            return None, None
+
+        def rate(current: float | None, before: float | None) -> float | None:
+            if current is None or before is None or current < before:
+                # Not available, or the counter was reset
+                return None
+            return (current - before) / (now - previous[0])
+
+        return rate(published, previous[1]), rate(processed, previous[2])
+
+    def recommend(
+        self,
+        queues: Sequence[Any],
+        instances: Mapping[str, Sequence[Mapping[str, Any]]] | None = None,
+        now: float | None = None,
+    ) -> list[Recommendation]:
+        """Recommend a number of instances for every service with a policy.
+
+        :param queues: QueueInfo or QueueSummary objects with (at least) the
+                       fields in COLUMNS
+        :param instances: Live instances of each service, as returned by
+                          ServiceStatusMonitor.instances(). If not given, the
+                          number of consumers on the queues of a service is
+                          used instead.
+        """
+        if now is None:
+            now = time.time()
+        rates = {(q.vhost, q.name): self._rates(q, now) for q in queues}
+        recommendations = []
+        for service, policy in self.policies.items():
+            selected = [
+                q
+                for q in queues
+                if q.name in policy.queues
+                and (policy.vhost is None or q.vhost == policy.vhost)
+            ]
+            recommendations.append(
+                self._recommend(
+                    service,
+                    policy,
+                    selected,
+                    [rates[(q.vhost, q.name)] for q in selected],
+                    None if instances is None else instances.get(service, []),
+                )
+            )
+        return recommendations
+
+    def _recommend(
+        self,
+        service: str,
+        policy: ScalingPolicy,
+        queues: Sequence[Any],
+        rates: Sequence[tuple[float | None, float | None]],
+        instances: Sequence[Mapping[str, Any]] | None,
+    ) -> Recommendation:
+        backlog = sum(q.messages_ready or 0 for q in queues)
+        if instances is None:
+            current = max((q.consumers or 0 for q in queues), default=0)
+            busy = None
+        else:
+            current = len(instances)
+            fractions = [
+                f
+                for f in (_busy_fraction(status) for status in instances)
+                if f is not None
+            ]
+            busy = statistics.fmean(fractions) if fractions else None
+        arrival = _total([r[0] for r in rates])
+        processing = _total([r[1] for r in rates])
+
+        drain_time: float | None
+        if not backlog:
+            drain_time = 0.0
+        elif processing is not None and processing > (arrival or 0):
+            drain_time = backlog / (processing - (arrival or 0))
+        else:
+            drain_time = None
+
+        instance_rate = policy.instance_rate
+        if current and processing:
+            # Observed throughput understates what idle instances could do,
+            # so scale it up to the capacity of a fully busy instance
+            instance_rate = processing / (current * (busy or 1))
+        if instance_rate:
+            needed = (arrival or 0) + backlog / policy.target_drain_time
+            target = math.ceil(needed / instance_rate)
+            reason = (
+                f"{needed:.2f} msg/s needed at {instance_rate:.2f} msg/s per instance"
+            )
+            if (
+                target < current
+                and busy is not None
+                and busy > policy.scale_down_utilisation
+            ):
+                target = current
+                reason += f", but instances are {busy:.0%} busy"
+        elif backlog and not current:
+            target = 1
+            reason = "backlog without any instances"
+        else:
+            target = current
+            reason = "throughput not yet known"
+
+        target = min(max(target, policy.min_instances), policy.max_instances)
+        if policy.max_step:
+            target = min(
+                max(target, current - policy.max_step), current + policy.max_step
+            )
+        if target > current:
+            action = "scale_up"
+        elif target < current:
+            action = "scale_down"
+        else:
+            action = "hold"
+        return Recommendation(
+            service=service,
+            current=current,
+            target=target,
+            action=action,
+            backlog=backlog,
+            arrival_rate=arrival,
+            processing_rate=processing,
+            drain_time=drain_time,
+            reason=reason,
+        )
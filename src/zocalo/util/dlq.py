@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, NamedTuple
+
+logger = logging.getLogger("zocalo.util.dlq")
+
+# Name of the file listing the messages contained in all archives in a directory
+ARCHIVE_INDEX = "index.jsonl"
+
+
+def is_dlq_archive(path: str | os.PathLike) -> bool:
+    """Whether a file name refers to a DLQ archive rather than a single message."""
+    return Path(path).name.endswith((".jsonl", ".jsonl.gz")) and (
+        Path(path).name != ARCHIVE_INDEX
+    )
+
+
+def read_dlq_archive(path: str | os.PathLike) -> Iterator[dict[str, Any]]:
+    """Iterate over the DLQ messages stored in an archive file.
+
+    Compressed archives that were not closed properly, for example because
+    the process writing them was killed, are read up to the last complete
+    message.
+    """
+    path = Path(path)
+    opener = gzip.open if path.name.endswith(".gz") else open
+    with opener(path, "rt") as fh:
+        try:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, json.JSONDecodeError) as e:
+            logger.warning(f"DLQ archive {path} is truncated: {e}")
+
+
+class DLQArchiveWriter:
+    def __init__(
+        self,
+        location: str | os.PathLike,
+        *,
+        compress: bool = False,
+        max_messages: int = 10000,
+    ):
+        """Write DLQ messages into rolling JSON Lines archive files.
+
+        Every message is stored as a single line in the same format as the
+        individual DLQ message files. Once an archive contains max_messages
+        messages the next message is written into a new archive. Each message
+        is also listed in an index file in the same directory, which records
+        the archive, line number, source queue, message ID and timestamp.
+
+        Messages are only guaranteed to be on disk after sync() returns.
+
+        Args:
+            location: Directory to write archives and index into.
+            compress: Write gzip-compressed archives.
+            max_messages: Maximum number of messages per archive file.
+        """
+        self._location = Path(location)
+        self._location.mkdir(parents=True, exist_ok=True)
+        self._compress = compress
+        self._max_messages = max_messages
+        self._raw: IO[bytes] | None = None
+        self._fh: IO[bytes] | None = None
+        self._lines = 0
+        self._pending_index: list[str] = []
+        self._index = (self._location / ARCHIVE_INDEX).open("a")
+        self.archives: list[Path] = []
+
+    def _open_next_archive(self) -> None:
+        self._close_archive()
+        suffix = ".jsonl.gz" if self._compress else ".jsonl"
+        name = (
+            f"dlq-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+            f"-{len(self.archives):04d}"
+        )
+        path = self._location / (name + suffix)
+        self._raw = path.open("xb")
+        if self._compress:
+            self._fh = gzip.GzipFile(filename=name, fileobj=self._raw, mode="wb")
+        else:
+            self._fh = self._raw
+        self._lines = 0
+        self.archives.append(path)
+
+    def write(
+        self,
+        dlqmsg: dict[str, Any],
+        *,
+        queue: str,
+        message_id: str,
+        timestamp: int,
+    ) -> tuple[Path, int]:
+        """Append a DLQ message to the current archive.
+
+        Args:
+            dlqmsg: The DLQ message, containing "header" and "message" keys.
+            queue: The name of the queue the message was taken from.
+            message_id: The message ID.
+            timestamp: The time the message was dead-lettered, in milliseconds.
+
+        Returns:
+            The path of the archive and the line number of the message.
+        """
+        if not self._fh or self._lines >= self._max_messages:
+            self.sync()
+            self._open_next_archive()
+        assert self._fh
+        self._fh.write(json.dumps(dlqmsg, sort_keys=True).encode() + b"\n")
+        self._pending_index.append(
+            json.dumps(
+                {
+                    "archive": self.archives[-1].name,
+                    "line": self._lines,
+                    "queue": queue,
+                    "message-id": message_id,
+                    "timestamp": timestamp,
+                }
+            )
+            + "\n"
+        )
+        self._lines += 1
+        return self.archives[-1], self._lines - 1
+
+    def sync(self) -> None:
+        """Flush all written messages to disk, then update the index."""
+        if self._fh and self._raw:
+            if isinstance(self._fh, gzip.GzipFile):
+                self._fh.flush(zlib.Z_SYNC_FLUSH)
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        if self._pending_index:
+            self._index.writelines(self._pending_index)
+            self._index.flush()
+            os.fsync(self._index.fileno())
+            self._pending_index = []
+
+    def _close_archive(self) -> None:
+        if self._fh and self._raw:
+            self._fh.close()
+            if self._fh is not self._raw:
+                self._raw.close()
+        self._fh = self._raw = None
+
+    def close(self) -> None:
+        """Sync and close all files."""
+        self.sync()
+        self._close_archive()
+        self._index.close()
+
+    def __enter__(self) -> DLQArchiveWriter:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+def _original_queue(header: dict[str, Any]) -> str | None:
+    """Find the name of the queue a DLQ message was originally sent to."""
+    if header.get("x-death"):
+        return header["x-death"][0].get("queue")
+    destination = header.get("original-destination", header.get("destination"))
+    if destination:
+        return destination.split("/", 2)[-1]
+    return None
+
+
+def _message_timestamp(header: dict[str, Any]) -> int | None:
+    """Find the time a DLQ message was dead-lettered, in milliseconds."""
+    if header.get("x-death"):
+        dead = header["x-death"][0].get("time")
+        if isinstance(dead, datetime):
+            return int(dead.timestamp() * 1000)
+        if dead is not None:
+            return int(float(dead) * 1000)
+    if header.get("timestamp"):
+        return int(header["timestamp"])
+    return None
+
+
+def _message_dcid(message: Any) -> int | None:
+    """Find the data collection ID referred to by a DLQ message, if any."""
+    if not isinstance(message, dict):
+        return None
+    candidates = [message.get("parameters"), message.get("payload")]
+    recipe = message.get("recipe")
+    if isinstance(recipe, dict) and message.get("recipe-pointer") is not None:
+        step = recipe.get(str(message["recipe-pointer"]))
+        if isinstance(step, dict):
+            candidates.insert(0, step.get("parameters"))
+    for candidate in candidates:
+        if not isinstance(candidate, dict):
+            continue
+        for key in ("ispyb_dcid", "dcid"):
+            try:
+                return int(candidate[key])
+            except (KeyError, TypeError, ValueError):
+                pass
+    return None
+
+
+class IndexEntry(NamedTuple):
+    """A DLQ message to be added to a DLQIndex"""
+
+    dlqmsg: dict[str, Any]
+    path: str | os.PathLike
+    line: int = 0
+    queue: str | None = None
+    timestamp: int | None = None
+
+
+class DLQIndex:
+    _schema = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            line INTEGER NOT NULL,
+            queue TEXT,
+            message_id TEXT,
+            timestamp INTEGER,
+            guid TEXT,
+            dcid INTEGER,
+            UNIQUE (path, line)
+        );
+        CREATE INDEX IF NOT EXISTS messages_queue ON messages (queue);
+        CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+        CREATE INDEX IF NOT EXISTS messages_guid ON messages (guid);
+        CREATE INDEX IF NOT EXISTS messages_dcid ON messages (dcid);
+        CREATE TABLE IF NOT EXISTS recipes (
+            message INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+            recipe TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS recipes_recipe ON recipes (recipe);
+        CREATE INDEX IF NOT EXISTS recipes_message ON recipes (message);
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        """An SQLite index of DLQ messages stored in files and archives.
+
+        Messages are indexed by their original queue, the time they were
+        dead-lettered, their recipe ID (guid), the data collection ID they
+        refer to and the recipes they request, so that subsets of messages
+        can be selected without reading every file.
+
+        Messages are identified by the absolute path of the file they are
+        stored in and their line number within a DLQ archive. Single message
+        files use line 0.
+        The index may be used from multiple threads.
+        """
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA foreign_keys = ON")
+        self._db.executescript(self._schema)
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        dlqmsg: dict[str, Any],
+        *,
+        path: str | os.PathLike,
+        line: int = 0,
+        queue: str | None = None,
+        timestamp: int | None = None,
+    ) -> None:
+        """Add a DLQ message to the index, replacing any previous entry for
+        the same location.
+
+        Args:
+            dlqmsg: The DLQ message, containing "header" and "message" keys.
+            path: The file the message is stored in.
+            line: The line number of the message within a DLQ archive.
+            queue: The original queue of the message. Determined from the
+                message header if not given.
+            timestamp: The time the message was dead-lettered, in milliseconds.
+                Determined from the message header if not given.
+        """
+        self.add_many([IndexEntry(dlqmsg, path, line, queue, timestamp)])
+
+    def add_many(self, entries: Iterable[IndexEntry]) -> int:
+        """Add DLQ messages to the index in a single transaction, replacing
+        any previous entries for the same locations. See add() for the
+        fields of each entry.
+
+        Returns:
+            The number of messages indexed.
+        """
+        messages = []
+        recipes = []
+        for entry in entries:
+            header = entry.dlqmsg.get("header") or {}
+            message = entry.dlqmsg.get("message")
+            guid = None
+            path = os.path.abspath(entry.path)
+            if isinstance(message, dict):
+                guid = (message.get("environment") or {}).get("ID")
+                if isinstance(message.get("recipes"), list):
+                    recipes.extend(
+                        (str(recipe), path, entry.line) for recipe in message["recipes"]
+                    )
+            messages.append(
+                (
+                    path,
+                    entry.line,
+                    entry.queue or _original_queue(header),
+                    None
+                    if header.get("message-id") is None
+                    else str(header["message-id"]),
+                    entry.timestamp
+                    if entry.timestamp is not None
+                    else _message_timestamp(header),
+                    None if guid is None else str(guid),
+                    _message_dcid(message),
+                )
+            )
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM messages WHERE path = ? AND line = ?",
+                [m[:2] for m in messages],
+            )
+            self._db.executemany(
+                "INSERT INTO messages"
+                " (path, line, queue, message_id, timestamp, guid, dcid)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                messages,
+            )
+            self._db.executemany(
+                "INSERT INTO recipes (message, recipe)"
+                " SELECT id, ? FROM messages WHERE path = ? AND line = ?",
+                recipes,
+            )
+        return len(messages)
+
+    def add_file(self, path: str | os.PathLike) -> int:
+        """Add all messages stored in a DLQ message file or archive to the index.
+
+        Returns the number of messages indexed."""
+        if is_dlq_archive(path):
+            return self.add_many(
+                IndexEntry(dlqmsg, path, line)
+                for line, dlqmsg in enumerate(read_dlq_archive(path))
+            )
+        with open(path) as fh:
+            return self.add_many([IndexEntry(json.load(fh), path)])
+
+    def select(
+        self,
+        *,
+        queue: str | None = None,
+        dcid: int | None = None,
+        guid: str | None = None,
+        recipe: str | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        paths: list[str | os.PathLike] | None = None,
+    ) -> dict[str, list[int]]:
+        """Find indexed messages matching all given criteria.
+
+        Args:
+            queue: Original queue name.
+            dcid: Data collection ID.
+            guid: Recipe ID.
+            recipe: Name of a recipe requested by the message.
+            since: Only messages dead-lettered at or after this time,
+                in milliseconds.
+            until: Only messages dead-lettered before this time, in milliseconds.
+            paths: Only messages stored in these files.
+
+        Returns:
+            A dictionary mapping absolute file paths to sorted lists of line
+            numbers.
+        """
+        conditions = []
+        parameters: list[Any] = []
+        for column, value in (("queue", queue), ("dcid", dcid), ("guid", guid)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(until)
+        if recipe is not None:
+            conditions.append("id IN (SELECT message FROM recipes WHERE recipe = ?)")
+            parameters.append(recipe)
+        if paths is not None:
+            conditions.append(f"path IN ({', '.join('?' * len(paths))})")
+            parameters.extend(os.path.abspath(p) for p in paths)
+        query = "SELECT path, line FROM messages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp, path, line"
+        selection: dict[str, list[int]] = {}
+        with self._lock:
+            for path, line in self._db.execute(query, parameters):
+                selection.setdefault(path, []).append(line)
+        for lines in selection.values():
+            lines.sort()
+        return selection
+
+    def remove(self, path: str | os.PathLike, lines: list[int] | None = None) -> int:
+        """Remove messages from the index.
+
+        Args:
+            path: The file the messages are stored in.
+            lines: The line numbers of the messages. Removes all messages
+                stored in the file if not given.
+
+        Returns:
+            The number of messages from this file remaining in the index.
+        """
+        with self._lock, self._db:
+            if lines is None:
+                self._db.execute(
+                    "DELETE FROM messages WHERE path = ?", (os.path.abspath(path),)
+                )
+            else:
+                self._db.executemany(
+                    "DELETE FROM messages WHERE path = ? AND line = ?",
+                    [(os.path.abspath(path), line) for line in lines],
+                )
+            (remaining,) = self._db.execute(
+                "SELECT COUNT(*) FROM messages WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone()
+        return remaining
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> DLQIndex:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
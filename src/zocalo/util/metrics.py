@@ -0,0 +1,435 @@
+from __future__ import annotations
+
+import contextlib
+import http.server
+import logging
+import math
+import threading
+import time
+from collections.abc import Iterator, Mapping, Sequence
+from typing import Any, Generic, TypeVar
+
+logger = logging.getLogger("zocalo.util.metrics")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.075,
+    0.1,
+    0.25,
+    0.5,
+    0.75,
+    1.0,
+    2.5,
+    5.0,
+    7.5,
+    10.0,
+    math.inf,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Child:
+    """The value of a metric for one combination of label values."""
+
+    def __init__(self, metric: _Metric):
+        self._registry = metric._registry
+        self._lock = threading.Lock()
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        raise NotImplementedError
+
+
+class CounterChild(_Child):
+    def __init__(self, metric: _Metric):
+        super().__init__(metric)
+        self._value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        if not self._registry.enabled:
+            return
+        if amount < 0:
+            raise ValueError(f"Counters can only be increased, not by {amount}")
+        with self._lock:
+            self._value += amount
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [("_total", {}, self._value)]
+
+
+class GaugeChild(_Child):
+    def __init__(self, metric: _Metric):
+        super().__init__(metric)
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._value = float(value)
+
+    def inc(self, amount: float = 1) -> None:
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [("", {}, self._value)]
+
+
+class HistogramChild(_Child):
+    def __init__(self, metric: _Metric):
+        super().__init__(metric)
+        assert isinstance(metric, Histogram)
+        self._upper_bounds = metric.buckets
+        self._buckets = [0] * len(self._upper_bounds)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._sum += value
+            for n, bound in enumerate(self._upper_bounds):
+                if value <= bound:
+                    self._buckets[n] += 1
+                    break
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the number of seconds spent in a with-block."""
+        if not self._registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            buckets = list(self._buckets)
+            total = self._sum
+        samples = []
+        count = 0
+        for bound, observations in zip(self._upper_bounds, buckets):
+            count += observations
+            samples.append(("_bucket", {"le": _format_value(bound)}, float(count)))
+        samples.append(("_count", {}, float(count)))
+        samples.append(("_sum", {}, total))
+        return samples
+
+
+ChildT = TypeVar("ChildT", bound=_Child)
+
+
+class _Metric(Generic[ChildT]):
+    type_name = ""
+    _child_class: type[ChildT]
+
+    def __init__(
+        self,
+        registry: Registry,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+    ):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], ChildT] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._unlabelled = self._child_class(self)
+            self._children[()] = self._unlabelled
+
+    def labels(self, *values: Any, **kwargs: Any) -> ChildT:
+        """The metric for a combination of label values, given either in the
+        order of the label names or as keyword arguments."""
+        if kwargs:
+            if values:
+                raise ValueError(
+                    "Label values must be given either by position or name"
+                )
+            try:
+                values = tuple(kwargs.pop(name) for name in self.labelnames)
+            except KeyError as e:
+                raise ValueError(f"Missing label {e} for metric {self.name}") from None
+            if kwargs:
+                raise ValueError(f"Unknown labels {sorted(kwargs)} for {self.name}")
+        if len(values) != len(self.labelnames) or not self.labelnames:
+            raise ValueError(
+                f"Metric {self.name} takes labels {self.labelnames}, not {values}"
+            )
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._child_class(self))
+        return child
+
+    def _child(self) -> ChildT:
+        if self.labelnames:
+            raise ValueError(f"Metric {self.name} requires labels {self.labelnames}")
+        return self._unlabelled
+
+    def exposition(self) -> list[str]:
+        lines = [f"# TYPE {self.name} {self.type_name}"]
+        if self.documentation:
+            lines.append(
+                f"# HELP {self.name} "
+                + self.documentation.replace("\\", r"\\").replace("\n", r"\n")
+            )
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, child in children:
+            for suffix, extra, value in child.samples():
+                labels = _labels(
+                    self.labelnames + tuple(extra), values + tuple(extra.values())
+                )
+                lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric[CounterChild]):
+    """A monotonically increasing count, such as a number of messages."""
+
+    type_name = "counter"
+    _child_class = CounterChild
+
+    def inc(self, amount: float = 1) -> None:
+        self._child().inc(amount)
+
+
+class Gauge(_Metric[GaugeChild]):
+    """A value that can go up and down, such as a number of buffered messages."""
+
+    type_name = "gauge"
+    _child_class = GaugeChild
+
+    def set(self, value: float) -> None:
+        self._child().set(value)
+
+    def inc(self, amount: float = 1) -> None:
+        self._child().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self._child().dec(amount)
+
+
+class Histogram(_Metric[HistogramChild]):
+    """The distribution of observed values, such as processing times, counted
+    into cumulative buckets."""
+
+    type_name = "histogram"
+    _child_class = HistogramChild
+
+    def __init__(
+        self,
+        registry: Registry,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        bounds = sorted(float(b) for b in buckets)
+        if not bounds or bounds[-1] != math.inf:
+            bounds.append(math.inf)
+        if "le" in labelnames:
+            raise ValueError("Histograms can not use the label name 'le'")
+        self.buckets = tuple(bounds)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value: float) -> None:
+        self._child().observe(value)
+
+    def time(self) -> contextlib.AbstractContextManager[None]:
+        """Observe the number of seconds spent in a with-block."""
+        return self._child().time()
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class Registry:
+    def __init__(self) -> None:
+        """A collection of metrics that can be exposed in the OpenMetrics text
+        format.
+
+        Registries start out disabled. While disabled, recording a value on any
+        of its metrics returns immediately, so code can be instrumented
+        unconditionally without a measurable cost for services that do not
+        expose metrics.
+        """
+        self.enabled = False
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(
+        self, cls: type[MetricT], name: str, *args: Any, **kwargs: Any
+    ) -> MetricT:
+        if cls is Counter and name.endswith("_total"):
+            name = name[: -len("_total")]
+        with self._lock:
+            existing = self._metrics.get(name)
+            if existing is not None:
+                if type(existing) is not cls:
+                    raise ValueError(
+                        f"Metric {name} is already registered as a {existing.type_name}"
+                    )
+                return existing  # type: ignore[return-value]
+            metric = self._metrics[name] = cls(self, name, *args, **kwargs)
+            return metric
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Return the counter with this name, creating it if necessary."""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        """Return the gauge with this name, creating it if necessary."""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Return the histogram with this name, creating it if necessary."""
+        return self._register(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def exposition(self) -> str:
+        """All metrics in the OpenMetrics text format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.exposition())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry: Registry
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(
+            "Metrics request from %s: " + format, self.client_address[0], *args
+        )
+
+
+def start_http_server(
+    port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY
+) -> http.server.ThreadingHTTPServer:
+    """Enable a registry and expose its metrics on /metrics in a background
+    thread.
+
+    :param port: Port to listen on. Use 0 to pick any free port, which can
+                 then be read from server.server_address
+    :param host: Address to listen on. Defaults to local connections only
+    :return: The running server. Call shutdown() on it to stop serving.
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    registry.enabled = True
+    threading.Thread(
+        target=server.serve_forever, name="zocalo-metrics", daemon=True
+    ).start()
+    logger.debug("Serving metrics on %s:%d", *server.server_address[:2])
+    return server
+
+
+_server: http.server.ThreadingHTTPServer | None = None
+
+
+def start_from_environment(
+    environment: Mapping[str, Any] | None,
+) -> http.server.ThreadingHTTPServer | None:
+    """Start the metrics endpoint of a service process, if one was requested
+    with zocalo.service --metrics-port. zocalo.service calls this in every
+    service process before the service starts, as metrics are recorded in
+    the service process rather than the frontend. Repeated calls in the same
+    process return the running server."""
+    global _server
+    settings = (environment or {}).get("zocalo_metrics")
+    if not settings:
+        return None
+    if _server is None:
+        try:
+            _server = start_http_server(
+                settings["port"], settings.get("host", "127.0.0.1")
+            )
+        except OSError as e:
+            logger.error(
+                "Could not start metrics endpoint on port %s: %s", settings["port"], e
+            )
+    return _server
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import Any, NamedTuple
+
+logger = logging.getLogger("zocalo.util.outbox")
+
+
+class OutboxItem(NamedTuple):
+    id: int
+    message: Any
+    headers: dict[str, Any]
+    attempts: int
+    created: float
+
+
+def default_outbox_location() -> Path:
+    """The per-user location of the zocalo.go outbox."""
+    state = os.environ.get("XDG_STATE_HOME") or os.path.expanduser("~/.local/state")
+    return Path(state) / "zocalo" / "outbox.sqlite"
+
+
+class Outbox:
+    _schema = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            headers TEXT NOT NULL,
+            created REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            last_error TEXT
+        );
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        *,
+        backoff: float = 30,
+        max_backoff: float = 3600,
+        claim_timeout: float = 300,
+        wal: bool = False,
+    ):
+        """A durable local store of messages waiting to be sent.
+
+        Messages are committed to an SQLite database before any attempt is
+        made to send them, and are only removed once they have been sent.
+        Messages that could not be sent are retried on a later flush, with
+        an exponentially increasing delay between attempts. Multiple processes
+        can safely share an outbox: messages are claimed by a process for the
+        duration of a flush, so that they are not sent twice.
+
+        By default the database uses SQLite's rollback journal, which is safe
+        on network filesystems such as home directories on NFS. Write-ahead
+        logging is faster with many concurrent writers, but relies on shared
+        memory and must only be enabled for databases on a local filesystem.
+
+        :param path: Location of the SQLite database, created if necessary
+        :param backoff: Delay before retrying a message after its first
+                        failed attempt, in seconds. Doubles with every
+                        further failed attempt.
+        :param max_backoff: Maximum delay between attempts, in seconds
+        :param claim_timeout: Number of seconds after which messages claimed
+                              by a process that did not finish flushing them
+                              become available again
+        :param wal: Use write-ahead logging. The database must be on a local
+                    filesystem.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._claim_timeout = claim_timeout
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if wal:
+            self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(self._schema)
+
+    def put(self, message: Any, headers: dict[str, Any]) -> int:
+        """Durably store a message. Returns the ID of the outbox entry."""
+        return self.put_many([(message, headers)])[0]
+
+    def put_many(self, items: Iterable[tuple[Any, dict[str, Any]]]) -> list[int]:
+        """Durably store many messages in a single transaction.
+
+        Returns the IDs of the outbox entries, in order."""
+        now = time.time()
+        ids = []
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for message, headers in items:
+                ids.append(
+                    self._db.execute(
+                        "INSERT INTO outbox (message, headers, created) VALUES (?, ?, ?)",
+                        (json.dumps(message), json.dumps(headers), now),
+                    ).lastrowid
+                )
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return ids
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def claim(
+        self, ids: Iterable[int] = (), *, force: bool = False
+    ) -> list[OutboxItem]:
+        """Claim all messages that are due to be sent, plus the given messages
+        regardless of when they are due, for this process. With force=True
+        all messages are claimed.
+
+        Messages claimed by another process are not returned."""
+        ids = list(ids)
+        now = time.time()
+        due = float("inf") if force else now
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self._db.execute(
+                "SELECT id, message, headers, attempts, created FROM outbox"
+                " WHERE claimed_until < ? AND (next_attempt <= ?"
+                f" OR id IN ({', '.join('?' * len(ids))})) ORDER BY id",
+                (now, due, *ids),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                [(now + self._claim_timeout, row[0]) for row in rows],
+            )
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return [
+            OutboxItem(
+                id=row[0],
+                message=json.loads(row[1]),
+                headers=json.loads(row[2]),
+                attempts=row[3],
+                created=row[4],
+            )
+            for row in rows
+        ]
+
+    def sent(self, ids: Iterable[int]) -> None:
+        """Remove messages that have been sent."""
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+        self._db.execute("COMMIT")
+
+    def failed(self, items: Iterable[OutboxItem], error: str | None = None) -> None:
+        """Release claimed messages that could not be sent, and schedule their
+        next attempt."""
+        now = time.time()
+        self._db.execute("BEGIN IMMEDIATE")
+        self._db.executemany(
+            "UPDATE outbox SET attempts = ?, next_attempt = ?, claimed_until = 0,"
+            " last_error = ? WHERE id = ?",
+            [
+                (
+                    item.attempts + 1,
+                    now + min(self._backoff * 2**item.attempts, self._max_backoff),
+                    error,
+                    item.id,
+                )
+                for item in items
+            ],
+        )
+        self._db.execute("COMMIT")
+
+    def flush(
+        self,
+        send: Callable[[Any, dict[str, Any]], None],
+        ids: Iterable[int] = (),
+        batch_size: int = 100,
+        *,
+        force: bool = False,
+        commit: Callable[[], None] | None = None,
+        on_sent: Callable[[list[OutboxItem]], None] | None = None,
+    ) -> list[int]:
+        """Send all messages that are due, plus the given messages.
+
+        Messages are sent in order with the provided function, and removed
+        from the outbox in batches once they have been sent. If sending a
+        message fails, it and all remaining claimed messages are scheduled
+        for a later attempt and the exception is raised.
+
+        :param send: Function called with message and headers for each message
+        :param ids: Messages to send regardless of whether they are due
+        :param batch_size: Number of sent messages to remove from the outbox
+                           at a time
+        :param force: Send all messages, including those not yet due
+        :param commit: Function called at the end of each batch. If given,
+                       messages only count as sent once this function
+                       returns, so that batches can be sent in transactions.
+        :param on_sent: Function called with each batch of sent messages
+        :return: The IDs of all messages that were sent
+        """
+        items = self.claim(ids, force=force)
+        sent = 0
+        done = 0
+
+        def complete_batch() -> None:
+            nonlocal done
+            if commit:
+                commit()
+            self.sent(item.id for item in items[done:sent])
+            if on_sent:
+                on_sent(items[done:sent])
+            done = sent
+
+        try:
+            for item in items:
+                send(item.message, item.headers)
+                sent += 1
+                if sent - done >= batch_size:
+                    complete_batch()
+            if sent > done:
+                complete_batch()
+        except BaseException as e:
+            if not commit and sent > done:
+                # Messages were sent individually, and need not be sent again
+                self.sent(item.id for item in items[done:sent])
+                if on_sent:
+                    on_sent(items[done:sent])
+                done = sent
+            self.failed(items[done:], error=repr(e))
+            logger.debug(f"Could not send messages from outbox: {e!r}")
+            raise
+        return [item.id for item in items]
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> Outbox:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import collections
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Mapping
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+logger = logging.getLogger("zocalo.util.profiler")
+
+# Signals that start a profile of the given kind
+SIGNALS = {"cpu": signal.SIGUSR1, "memory": signal.SIGUSR2}
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(duration: float, interval: float = 0.005) -> collections.Counter[str]:
+    """Periodically record the call stacks of all other threads.
+
+    :param duration: Number of seconds to sample for
+    :param interval: Number of seconds between samples
+    :return: Number of samples of every stack, keyed by the ';'-separated
+             frames of the stack, starting with the thread name at the root.
+             This is the 'folded' input format of common flame graph tools.
+    """
+    own_thread = threading.get_ident()
+    stacks: collections.Counter[str] = collections.Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_thread:
+                continue
+            stack = []
+            current: FrameType | None = frame
+            while current is not None:
+                stack.append(_frame_name(current))
+                current = current.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def trace_allocations(
+    duration: float, frames: int = 10, limit: int = 50
+) -> tuple[tracemalloc.Snapshot, str]:
+    """Trace memory allocations of the process with tracemalloc.
+
+    :param duration: Number of seconds to trace allocations for
+    :param frames: Number of frames recorded for each allocation
+    :param limit: Number of lines in the report
+    :return: A snapshot at the end of the period, and a report of the lines
+             of code whose allocations grew the most during the period
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(duration)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before = before.filter_traces(filters)
+    after = after.filter_traces(filters)
+    statistics = after.compare_to(before, "lineno")
+    total = sum(s.size for s in after.statistics("filename"))
+    report = [
+        f"Traced memory after {duration:g} seconds: {total / 1024**2:.1f} MiB,"
+        f" {sum(s.size_diff for s in statistics) / 1024**2:+.1f} MiB",
+        "",
+    ]
+    report.extend(str(s) for s in statistics[:limit])
+    return after, "\n".join(report) + "\n"
+
+
+class ServiceProfiler:
+    def __init__(self, location: str | os.PathLike, default_duration: float = 30):
+        """Profile a running service on demand, and write the results to a
+        directory.
+
+        Profiles are requested in the zocalo.service frontend process, either
+        with a 'profile' message on the transport command channel or with a
+        signal (SIGUSR1 for a CPU profile, SIGUSR2 for a memory profile).
+        The frontend passes the request on to the service process through
+        its command pipe. The service process has its own instance, which
+        records the profile and also reacts to the same signals sent to the
+        service process directly.
+
+        CPU profiles sample the stacks of all threads, and are written in
+        the folded format understood by flame graph tools. Memory profiles
+        use tracemalloc, and are written as a text report of the largest
+        allocation increases along with a snapshot that can be loaded with
+        tracemalloc.Snapshot.load().
+
+        :param location: Directory to write profiles to
+        :param default_duration: Number of seconds to profile for when not
+                                 specified in the request
+        """
+        self.location = Path(location)
+        self.default_duration = default_duration
+        self.frontend: Any = None
+        self._running = threading.Lock()
+
+    def attach(self, frontend: Any, channel: str | None = None) -> None:
+        """Forward profile requests to the service started by a frontend.
+        Requests are taken from signals sent to the frontend process, and
+        from its transport command channel if given. This must be called in
+        the main thread of the frontend process."""
+        self.frontend = frontend
+        for signum in SIGNALS.values():
+            signal.signal(signum, self._request_on_signal)
+        if channel:
+            frontend._transport.subscribe_broadcast(channel, self.process_command)
+
+    def install(self, service: Any) -> None:
+        """Record profiles of the current service process on request. This
+        must be called in the main thread of the service process, before the
+        service is started."""
+        service._register("profile", self.process_request)
+        for signum in SIGNALS.values():
+            signal.signal(signum, self._start_on_signal)
+
+    def request(self, mode: str, duration: float | None = None) -> bool:
+        """Ask the service process to record a profile."""
+        if mode not in SIGNALS:
+            raise ValueError(f"Unknown profile mode {mode!r}")
+        if getattr(self.frontend, "_service", None) is None:
+            logger.warning("Can not record %s profile: no service running", mode)
+            return False
+        duration = duration or self.default_duration
+        logger.info("Requesting %s profile of service for %g seconds", mode, duration)
+        self.frontend.send_command(
+            {"band": "profile", "payload": {"mode": mode, "duration": duration}}
+        )
+        return True
+
+    def process_command(self, header: Mapping[str, Any], message: Any) -> None:
+        """Handle 'profile' messages on the transport command channel. As for
+        other commands the message must name the host or the service class of
+        the instance, and may specify a mode ('cpu' or 'memory') and a
+        duration in seconds."""
+        if not isinstance(message, dict) or message.get("command") != "profile":
+            return
+        relevant = False
+        if "host" in message:
+            if message["host"] != self.frontend.get_host_id():
+                return
+            relevant = True
+        if "service" in message:
+            if message["service"] != self.frontend._service_class_name:
+                return
+            relevant = True
+        if not relevant:
+            return
+        try:
+            duration = float(message.get("duration") or self.default_duration)
+            self.request(message.get("mode", "cpu"), duration)
+        except (TypeError, ValueError) as e:
+            logger.warning("Received invalid profile command %r: %s", message, e)
+
+    def process_request(self, payload: Any) -> None:
+        """Handle a profile request passed on by the frontend."""
+        try:
+            mode = payload["mode"]
+            if mode not in SIGNALS:
+                raise ValueError(f"Unknown profile mode {mode!r}")
+            duration = float(payload.get("duration") or self.default_duration)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Received invalid profile request %r: %s", payload, e)
+            return
+        self.start(mode, duration)
+
+    def _mode(self, signum: int) -> str:
+        return next(m for m, s in SIGNALS.items() if s == signum)
+
+    def _request_on_signal(self, signum: int, frame: FrameType | None) -> None:
+        self.request(self._mode(signum))
+
+    def _start_on_signal(self, signum: int, frame: FrameType | None) -> None:
+        self.start(self._mode(signum), self.default_duration)
+
+    def start(self, mode: str, duration: float) -> threading.Thread | None:
+        """Record a profile of this process in a background thread. Only one
+        profile is recorded at a time."""
+        if not self._running.acquire(blocking=False):
+            logger.warning("Ignoring %s profile request: already profiling", mode)
+            return None
+
+        def run() -> None:
+            try:
+                self.profile(mode, duration)
+            except Exception:
+                logger.error("Could not record %s profile", mode, exc_info=True)
+            finally:
+                self._running.release()
+
+        thread = threading.Thread(target=run, name="zocalo-profiler", daemon=True)
+        thread.start()
+        return thread
+
+    def profile(self, mode: str, duration: float) -> Path:
+        """Record a profile of this process and write it to the profile
+        directory. Returns the path of the written profile."""
+        self.location.mkdir(parents=True, exist_ok=True)
+        stem = (
+            f"{socket.gethostname()}-{os.getpid()}"
+            f"-{time.strftime('%Y%m%d-%H%M%S')}-{mode}"
+        )
+        logger.info("Recording %s profile for %g seconds", mode, duration)
+        if mode == "cpu":
+            stacks = sample_stacks(duration)
+            path = self.location / f"{stem}.folded"
+            tmp = path.with_name(f".{path.name}.tmp")
+            with tmp.open("w") as fh:
+                for stack, count in stacks.most_common():
+                    fh.write(f"{stack} {count}\n")
+            tmp.replace(path)
+        elif mode == "memory":
+            snapshot, report = trace_allocations(duration)
+            snapshot.dump(str(self.location / f"{stem}.tracemalloc"))
+            path = self.location / f"{stem}.txt"
+            path.write_text(report)
+        else:
+            raise ValueError(f"Unknown profile mode {mode!r}")
+        logger.info("Wrote %s profile to %s", mode, path)
+        return path
@@ -0,0 +1,490 @@
+from __future__ import annotations
+
+import array
+import collections
+import logging
+import math
+import mmap
+import os
+import statistics
+import struct
+import threading
+import time
+import urllib.parse
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import requests
+
+from zocalo.util.rabbitmq import RabbitMQAPI
+
+logger = logging.getLogger("zocalo.util.queue_metrics")
+
+# Values recorded for each queue
+FIELDS = (
+    "messages",
+    "messages_ready",
+    "messages_unacknowledged",
+    "consumers",
+    "consumer_utilisation",
+    "publish",
+    "deliver_get",
+    "ack",
+    "redeliver",
+)
+
+# Fields holding cumulative message counts, from which rates are derived
+COUNTERS = frozenset({"publish", "deliver_get", "ack", "redeliver"})
+
+# Columns requested from the management API
+COLUMNS = [
+    "name",
+    "vhost",
+    "messages",
+    "messages_ready",
+    "messages_unacknowledged",
+    "consumers",
+    "consumer_utilisation",
+    *(f"message_stats.{counter}" for counter in sorted(COUNTERS)),
+]
+
+
+class Tier(NamedTuple):
+    # Minimum number of seconds between samples, 0 keeps every sample
+    resolution: float
+    # Number of samples kept
+    capacity: int
+
+
+# Every sample for the last 360 polls, one sample per minute for a day, and
+# one sample per hour for 30 days. With the default fields a file takes 200 KB.
+DEFAULT_TIERS = (Tier(0, 360), Tier(60, 1440), Tier(3600, 720))
+
+
+class Sample(NamedTuple):
+    timestamp: float
+    values: tuple[float, ...]
+
+
+class SeriesFile:
+    _magic = b"ZQMR"
+    _header = struct.Struct("<4sHHH2x")
+    _tier_header = struct.Struct("<dIII4x")
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        tiers: Sequence[Tier] = DEFAULT_TIERS,
+        nfields: int = len(FIELDS),
+    ):
+        """A fixed size, memory mapped file holding a time series in a set of
+        ring buffers of decreasing resolution.
+
+        Every sample is added to each tier. A tier only keeps the most recent
+        sample in each interval of its resolution, so that coarser tiers
+        cover longer periods in the same space. Missing values are stored as
+        NaN.
+
+        An existing file is opened with the tiers it was created with. The
+        file is mapped into memory on first use, and again after close().
+
+        :param path: Location of the file, created if necessary
+        :param tiers: The tiers of a new file, finest first
+        :param nfields: The number of values in each sample of a new file
+        """
+        self.path = Path(path)
+        if self.path.exists():
+            with self.path.open("rb") as fh:
+                magic, version, nfields, ntiers = self._header.unpack(
+                    fh.read(self._header.size)
+                )
+                if magic != self._magic or version != 1:
+                    raise ValueError(f"{self.path} is not a queue metrics file")
+                tiers = [
+                    Tier(*self._tier_header.unpack(fh.read(self._tier_header.size))[:2])
+                    for _ in range(ntiers)
+                ]
+        else:
+            self._create(tiers, nfields)
+        self.tiers = tuple(tiers)
+        self.nfields = nfields
+        self._record = struct.Struct(f"<{nfields + 1}d")
+        self._offsets = []
+        offset = self._header.size + self._tier_header.size * len(self.tiers)
+        for tier in self.tiers:
+            self._offsets.append(offset)
+            offset += tier.capacity * self._record.size
+        self._size = offset
+        self._mmap: mmap.mmap | None = None
+        self._lock = threading.Lock()
+
+    def _create(self, tiers: Sequence[Tier], nfields: int) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = self._header.size + sum(
+            self._tier_header.size + tier.capacity * (nfields + 1) * 8 for tier in tiers
+        )
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with tmp.open("wb") as fh:
+            fh.write(self._header.pack(self._magic, 1, nfields, len(tiers)))
+            for tier in tiers:
+                fh.write(self._tier_header.pack(tier.resolution, tier.capacity, 0, 0))
+            fh.truncate(size)
+        tmp.replace(self.path)
+
+    def _mapping(self) -> mmap.mmap:
+        if self._mmap is None:
+            with self.path.open("r+b") as fh:
+                self._mmap = mmap.mmap(fh.fileno(), self._size)
+        return self._mmap
+
+    def _tier_state(self, mapping: mmap.mmap, index: int) -> tuple[int, int]:
+        _, _, head, count = self._tier_header.unpack_from(
+            mapping, self._header.size + self._tier_header.size * index
+        )
+        return head, count
+
+    def append(self, timestamp: float, values: Sequence[float | None]) -> None:
+        if len(values) != self.nfields:
+            raise ValueError(f"Expected {self.nfields} values, not {len(values)}")
+        record = [math.nan if v is None else float(v) for v in values]
+        with self._lock:
+            mapping = self._mapping()
+            for index, tier in enumerate(self.tiers):
+                head, count = self._tier_state(mapping, index)
+                position = head
+                if count and tier.resolution:
+                    latest = (head - 1) % tier.capacity
+                    (latest_timestamp,) = struct.unpack_from(
+                        "<d",
+                        mapping,
+                        self._offsets[index] + latest * self._record.size,
+                    )
+                    if (
+                        timestamp // tier.resolution
+                        == latest_timestamp // tier.resolution
+                    ):
+                        # Replace the latest sample in the same interval
+                        position = latest
+                self._record.pack_into(
+                    mapping,
+                    self._offsets[index] + position * self._record.size,
+                    timestamp,
+                    *record,
+                )
+                if position == head:
+                    self._tier_header.pack_into(
+                        mapping,
+                        self._header.size + self._tier_header.size * index,
+                        tier.resolution,
+                        tier.capacity,
+                        (head + 1) % tier.capacity,
+                        min(count + 1, tier.capacity),
+                    )
+
+    def samples(self, tier: int = 0) -> list[Sample]:
+        """All samples held in a tier, oldest first."""
+        capacity = self.tiers[tier].capacity
+        width = self.nfields + 1
+        with self._lock:
+            mapping = self._mapping()
+            head, count = self._tier_state(mapping, tier)
+            data = array.array("d")
+            data.frombytes(
+                mapping[
+                    self._offsets[tier] : self._offsets[tier]
+                    + capacity * self._record.size
+                ]
+            )
+        if count < capacity:
+            order = [*range(count)]
+        else:
+            order = [*range(head, capacity), *range(head)]
+        return [
+            Sample(data[i * width], tuple(data[i * width + 1 : (i + 1) * width]))
+            for i in order
+        ]
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+
+    def close(self) -> None:
+        """Unmap the file, releasing its file descriptor."""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+
+def _robust_scores(values: Sequence[float]) -> list[float]:
+    """Modified z-scores based on the median absolute deviation, falling back
+    to standard scores if more than half of all values are identical."""
+    median = statistics.median(values)
+    mad = statistics.median(abs(v - median) for v in values)
+    if mad:
+        return [0.6745 * (v - median) / mad for v in values]
+    stdev = statistics.pstdev(values)
+    if not stdev:
+        return [0.0] * len(values)
+    mean = statistics.fmean(values)
+    return [(v - mean) / stdev for v in values]
+
+
+class QueueMetrics:
+    def __init__(self, series: SeriesFile):
+        """Query the history of a single queue.
+
+        Queries read from the finest tier that covers the requested period.
+        For counters (see COUNTERS) values are per-second rates between
+        consecutive samples, ignoring intervals in which the counter was
+        reset. For all other fields values are the sampled values.
+        """
+        self._series = series
+
+    def _samples(self, since: float | None, until: float | None) -> list[Sample]:
+        candidates = [self._series.samples(i) for i in range(len(self._series.tiers))]
+        samples = candidates[-1]
+        for candidate in candidates:
+            if candidate and (since is None or candidate[0].timestamp <= since):
+                samples = candidate
+                break
+        return [
+            s
+            for s in samples
+            if (since is None or s.timestamp >= since)
+            and (until is None or s.timestamp <= until)
+        ]
+
+    def series(
+        self, field: str, since: float | None = None, until: float | None = None
+    ) -> list[tuple[float, float]]:
+        """Return (timestamp, value) pairs for a field. For counters, each
+        rate is reported at the end of its interval."""
+        index = FIELDS.index(field)
+        samples = [
+            (s.timestamp, s.values[index])
+            for s in self._samples(since, until)
+            if not math.isnan(s.values[index])
+        ]
+        if field not in COUNTERS:
+            return samples
+        return [
+            (t1, (v1 - v0) / (t1 - t0))
+            for (t0, v0), (t1, v1) in zip(samples, samples[1:])
+            if t1 > t0 and v1 >= v0
+        ]
+
+    def rate(
+        self, field: str, since: float | None = None, until: float | None = None
+    ) -> float | None:
+        """The average rate of a counter over a period, in messages per second."""
+        if field not in COUNTERS:
+            raise ValueError(f"{field} is not a counter")
+        index = FIELDS.index(field)
+        samples = [
+            s for s in self._samples(since, until) if not math.isnan(s.values[index])
+        ]
+        if len(samples) < 2 or samples[-1].timestamp <= samples[0].timestamp:
+            return None
+        increase = sum(
+            max(s1.values[index] - s0.values[index], 0)
+            for s0, s1 in zip(samples, samples[1:])
+        )
+        return increase / (samples[-1].timestamp - samples[0].timestamp)
+
+    def percentile(
+        self,
+        field: str,
+        q: float,
+        since: float | None = None,
+        until: float | None = None,
+    ) -> float | None:
+        """The q-th percentile (0-100) of a field over a period, interpolating
+        linearly between values."""
+        values = sorted(v for _, v in self.series(field, since, until))
+        if not values:
+            return None
+        position = (len(values) - 1) * q / 100
+        lower = math.floor(position)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+    def anomalies(
+        self,
+        field: str,
+        since: float | None = None,
+        until: float | None = None,
+        threshold: float = 3.5,
+    ) -> list[tuple[float, float, float]]:
+        """Find values of a field that are unusual compared to the rest of the
+        period, using a robust z-score.
+
+        :return: A list of (timestamp, value, score) tuples for all values
+                 whose score exceeds the threshold in either direction
+        """
+        series = self.series(field, since, until)
+        if len(series) < 3:
+            return []
+        scores = _robust_scores([v for _, v in series])
+        return [
+            (t, v, score)
+            for (t, v), score in zip(series, scores)
+            if abs(score) > threshold
+        ]
+
+    def summary(
+        self, since: float | None = None, until: float | None = None
+    ) -> dict[str, Any]:
+        """A summary of the queue over a period."""
+        samples = self._samples(since, until)
+
+        def latest(field: str) -> float | None:
+            value = samples[-1].values[FIELDS.index(field)] if samples else math.nan
+            return None if math.isnan(value) else value
+
+        return {
+            "samples": len(samples),
+            "messages": latest("messages"),
+            "messages_p50": self.percentile("messages", 50, since, until),
+            "messages_p95": self.percentile("messages", 95, since, until),
+            "messages_max": self.percentile("messages", 100, since, until),
+            "consumers": latest("consumers"),
+            "consumer_utilisation_p50": self.percentile(
+                "consumer_utilisation", 50, since, until
+            ),
+            "publish_rate": self.rate("publish", since, until),
+            "deliver_rate": self.rate("deliver_get", since, until),
+            "ack_rate": self.rate("ack", since, until),
+            "anomalies": len(self.anomalies("messages", since, until)),
+        }
+
+
+class QueueMetricsStore:
+    suffix = ".zqm"
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        tiers: Sequence[Tier] = DEFAULT_TIERS,
+        max_open: int = 128,
+    ):
+        """A directory of time series files, one per queue.
+
+        Only the most recently used files are kept open, so that a store
+        with thousands of queues does not run out of file descriptors.
+
+        :param directory: Location of the store, created if necessary
+        :param tiers: Tiers used for new queues
+        :param max_open: Maximum number of files kept open
+        """
+        self.directory = Path(directory)
+        self.tiers = tuple(tiers)
+        self.max_open = max_open
+        self._files: collections.OrderedDict[tuple[str, str], SeriesFile] = (
+            collections.OrderedDict()
+        )
+
+    def _path(self, vhost: str, name: str) -> Path:
+        return (
+            self.directory
+            / urllib.parse.quote(vhost, safe="")
+            / f"{urllib.parse.quote(name, safe='')}{self.suffix}"
+        )
+
+    def _open(self, vhost: str, name: str, create: bool = False) -> SeriesFile:
+        key = (vhost, name)
+        if key in self._files:
+            self._files.move_to_end(key)
+            return self._files[key]
+        path = self._path(vhost, name)
+        if not create and not path.exists():
+            raise KeyError(f"No metrics recorded for queue {name} in {vhost}")
+        series = self._files[key] = SeriesFile(path, self.tiers)
+        while len(self._files) > self.max_open:
+            _, evicted = self._files.popitem(last=False)
+            evicted.flush()
+            evicted.close()
+        return series
+
+    def append(
+        self, vhost: str, name: str, timestamp: float, values: Sequence[float | None]
+    ) -> None:
+        self._open(vhost, name, create=True).append(timestamp, values)
+
+    def queues(self) -> list[tuple[str, str]]:
+        """All (vhost, name) pairs with recorded metrics."""
+        if not self.directory.is_dir():
+            return []
+        return sorted(
+            (
+                urllib.parse.unquote(path.parent.name),
+                urllib.parse.unquote(path.name.removesuffix(self.suffix)),
+            )
+            for path in self.directory.glob(f"*/*{self.suffix}")
+        )
+
+    def metrics(self, vhost: str, name: str) -> QueueMetrics:
+        return QueueMetrics(self._open(vhost, name))
+
+    def flush(self) -> None:
+        for series in self._files.values():
+            series.flush()
+
+    def close(self) -> None:
+        for series in self._files.values():
+            series.close()
+        self._files.clear()
+
+
+def collect(
+    api: RabbitMQAPI,
+    store: QueueMetricsStore,
+    vhost: str | None = None,
+    pattern: str | None = None,
+    use_regex: bool = False,
+    timestamp: float | None = None,
+) -> int:
+    """Record one sample of every queue. Only the recorded columns are
+    requested from the management API.
+
+    :return: The number of queues sampled
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    count = 0
+    for queue in api.iter_queues(
+        vhost, pattern=pattern, use_regex=use_regex, columns=COLUMNS
+    ):
+        # Nested columns are returned as plain dictionaries
+        stats = getattr(queue, "message_stats", None) or {}
+        values = [
+            stats.get(field) if field in COUNTERS else getattr(queue, field, None)
+            for field in FIELDS
+        ]
+        store.append(queue.vhost, queue.name, timestamp, values)
+        count += 1
+    store.flush()
+    return count
+
+
+def run_collector(
+    api: RabbitMQAPI,
+    store: QueueMetricsStore,
+    interval: float,
+    stop: threading.Event | None = None,
+    **kwargs: Any,
+) -> None:
+    """Record samples every interval seconds until stopped. Further arguments
+    are passed to collect(). Samples that can not be taken because the
+    management API can not be reached are skipped."""
+    stop = stop or threading.Event()
+    next_poll = time.monotonic()
+    while not stop.is_set():
+        try:
+            collect(api, store, **kwargs)
+        except requests.RequestException as e:
+            logger.warning(f"Could not sample queue metrics: {e}")
+        next_poll += interval
+        stop.wait(max(next_poll - time.monotonic(), 0))
@@ -7,13 +7,27 @@ import hashlib
 import logging
 import pathlib
 import secrets
+import threading
+import time
 import urllib
 import urllib.parse
 import urllib.request
-from typing import Any, Self, overload
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, NamedTuple, Self, overload
 
 import requests
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    ModelWrapValidatorHandler,
+    PrivateAttr,
+    ValidationInfo,
+    model_validator,
+)
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from workflows.transport import pika_transport
 
 import zocalo.configuration
@@ -21,7 +35,7 @@ import zocalo.configuration
 logger = logging.getLogger("zocalo.util.rabbitmq")
 
 
-def _quote(arg: str) -> str:
+def quote_vhost(arg: str) -> str:
     """URL-quote a VHost name (which can contain /)"""
     return urllib.parse.quote(arg, safe=[])
 
@@ -55,6 +69,7 @@ class MessageStats(BaseModel):
         description="Count of messages delivered in no-acknowledgement mode in response to basic.get.",
     )
     deliver_get: int | None = Field(None, description="Sum of all four of the above.")
+    ack: int | None = Field(None, description="Count of messages acknowledged.")
     redeliver: int | None = Field(
         None,
         description="Count of subset of messages in deliver_get which had the redelivered flag set.",
@@ -592,6 +607,96 @@ class QueueInfo(QueueSpec):
     )
 
 
+class QueueSummary(BaseModel):
+    """Queue information restricted to a subset of columns.
+
+    Columns other than those declared here are kept as extra attributes."""
+
+    name: str | None = Field(
+        None,
+        description="The name of the queue with non-ASCII characters escaped as in C.",
+    )
+    vhost: str | None = Field(
+        None,
+        description="Virtual host name with non-ASCII characters escaped as in C.",
+    )
+    messages: int | None = Field(
+        None, description="Sum of ready and unacknowledged messages (queue depth)."
+    )
+    messages_ready: int | None = Field(
+        None, description="Number of messages ready to be delivered to clients."
+    )
+    messages_unacknowledged: int | None = Field(
+        None,
+        description="Number of messages delivered to clients but not yet acknowledged.",
+    )
+    consumers: int | None = Field(None, description="Number of consumers.")
+    model_config = ConfigDict(extra="allow")
+
+
+class ShovelAckMode(enum.Enum):
+    """When the shovel acknowledges messages taken from the source."""
+
+    on_confirm = "on-confirm"
+    on_publish = "on-publish"
+    no_ack = "no-ack"
+
+
+class ShovelSpec(BaseModel):
+    """A dynamic shovel moving messages from one queue into another."""
+
+    vhost: str = Field(
+        ..., description="Virtual host name with non-ASCII characters escaped as in C."
+    )
+    name: str = Field(..., description="The name of the shovel.")
+    src_uri: str = Field(
+        "amqp://",
+        alias="src-uri",
+        description="AMQP URI of the source broker. The default connects to the local broker and the shovel's virtual host.",
+    )
+    src_queue: str = Field(
+        ..., alias="src-queue", description="The queue to take messages from."
+    )
+    dest_uri: str = Field(
+        "amqp://",
+        alias="dest-uri",
+        description="AMQP URI of the destination broker. The default connects to the local broker and the shovel's virtual host.",
+    )
+    dest_queue: str = Field(
+        ..., alias="dest-queue", description="The queue to move messages into."
+    )
+    src_delete_after: str | int = Field(
+        "never",
+        alias="src-delete-after",
+        description='Delete the shovel after moving this many messages. "queue-length" deletes the shovel once the messages present at startup have been moved.',
+    )
+    ack_mode: ShovelAckMode = Field(
+        default=ShovelAckMode.on_confirm,
+        alias="ack-mode",
+        description="When messages taken from the source are acknowledged.",
+    )
+    src_prefetch_count: int | None = Field(
+        None,
+        alias="src-prefetch-count",
+        description="The maximum number of unacknowledged messages the shovel may hold.",
+    )
+    model_config = ConfigDict(
+        use_enum_values=True, validate_default=True, populate_by_name=True
+    )
+
+
+class ShovelInfo(BaseModel):
+    vhost: str = Field(
+        ..., description="Virtual host name with non-ASCII characters escaped as in C."
+    )
+    name: str = Field(..., description="The name of the shovel.")
+    type: str = Field(..., description='Either "dynamic" or "static".')
+    state: str = Field(..., description='One of "starting", "running" or "terminated".')
+    reason: str | None = Field(
+        None, description="The reason a shovel terminated, if it did."
+    )
+
+
 class HashingAlgorithm(enum.Enum):
     rabbit_password_hashing_sha256 = "rabbit_password_hashing_sha256"
     rabbit_password_hashing_sha512 = "rabbit_password_hashing_sha512"
@@ -614,6 +719,103 @@ class UserSpec(BaseModel):
     model_config = ConfigDict(use_enum_values=True)
 
 
+class Definitions(BaseModel):
+    """A whole topology, as exported and imported by the definitions endpoint.
+
+    Definitions that have no model here, such as topic permissions and
+    runtime parameters, are preserved as extra fields.
+    """
+
+    rabbit_version: str | None = None
+    rabbitmq_version: str | None = None
+    users: list[UserSpec] = Field(default_factory=list)
+    vhosts: list[VHostSpec] = Field(default_factory=list)
+    permissions: list[PermissionSpec] = Field(default_factory=list)
+    policies: list[PolicySpec] = Field(default_factory=list)
+    queues: list[QueueSpec] = Field(default_factory=list)
+    exchanges: list[ExchangeSpec] = Field(default_factory=list)
+    bindings: list[BindingSpec] = Field(default_factory=list)
+    model_config = ConfigDict(extra="allow")
+    # Fields of exported virtual hosts that have no equivalent in VHostSpec,
+    # such as limits, by virtual host name
+    _vhost_extras: dict[str, dict[str, Any]] = PrivateAttr(default_factory=dict)
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _from_export(
+        cls, data: Any, handler: ModelWrapValidatorHandler[Self], info: ValidationInfo
+    ) -> Self:
+        # Convert the representation used by the definitions endpoint into
+        # that used by the per-object endpoints. Definitions exported for a
+        # single virtual host leave out the virtual host of each component,
+        # which can be given as the 'vhost' of the validation context.
+        if not isinstance(data, dict):
+            return handler(data)
+        vhost = (info.context or {}).get("vhost")
+        # Copy the exported items so that they can be converted in place
+        data = {
+            key: [dict(item) if isinstance(item, dict) else item for item in value]
+            if key in cls.model_fields and isinstance(value, list)
+            else value
+            for key, value in data.items()
+        }
+
+        def exported(key: str) -> list[dict[str, Any]]:
+            # Items given as models rather than exported dicts are left as is
+            return [item for item in data.get(key, []) if isinstance(item, dict)]
+
+        for user in exported("users"):
+            if isinstance(user.get("tags"), str):
+                user["tags"] = [t for t in user["tags"].split(",") if t]
+        data["vhosts"] = [
+            {**(item.get("metadata") or {}), **item} if isinstance(item, dict) else item
+            for item in data.get("vhosts", [])
+        ]
+        vhost_extras = {
+            item["name"]: {
+                key: value
+                for key, value in item.items()
+                if key not in VHostSpec.model_fields
+            }
+            for item in exported("vhosts")
+            if "name" in item
+        }
+        dest_map = {"queue": "q", "exchange": "e"}
+        for binding in exported("bindings"):
+            destination_type = binding.get("destination_type")
+            binding["destination_type"] = dest_map.get(
+                destination_type, destination_type
+            )
+        if vhost is not None:
+            for key in ("policies", "queues", "exchanges", "bindings"):
+                for component in exported(key):
+                    component.setdefault("vhost", vhost)
+        definitions = handler(data)
+        definitions._vhost_extras = vhost_extras
+        return definitions
+
+    def to_export(self) -> dict[str, Any]:
+        """The representation of these definitions used by the definitions
+        endpoint."""
+        data = self.model_dump(mode="json", by_alias=True, exclude_none=True)
+        for user in data["users"]:
+            user["tags"] = ",".join(user["tags"])
+        vhosts = []
+        for vhost in data["vhosts"]:
+            extras = self._vhost_extras.get(vhost["name"], {})
+            metadata = {
+                **(extras.get("metadata") or {}),
+                "description": vhost.pop("description"),
+                "tags": vhost.pop("tags"),
+            }
+            vhosts.append({**extras, **vhost, "metadata": metadata})
+        data["vhosts"] = vhosts
+        dest_map = {"q": "queue", "e": "exchange"}
+        for binding in data["bindings"]:
+            binding["destination_type"] = dest_map[binding["destination_type"]]
+        return data
+
+
 def http_api_request(
     zc: zocalo.configuration.Configuration,
     api_path: str,
@@ -646,36 +848,241 @@ def http_api_request(
     return urllib.request.Request(f"{zc.rabbitmqapi['base_url']}{api_path}")
 
 
+class HealthCheckResult(NamedTuple):
+    check: str
+    ok: bool
+    result: Any
+    """The response of the health check, or the reason it could not be run"""
+    duration: float
+    """Time taken by the health check, in seconds"""
+    status_code: int | None = None
+
+
+# Healthy API endpoint found for each configured list of endpoints, and when
+# it was last found to be healthy
+_healthy_endpoints: dict[str, tuple[str, float]] = {}
+
+
+def healthy_endpoint(base_url: str) -> str | None:
+    """The API endpoint last found to be healthy by
+    RabbitMQAPI.from_zocalo_configuration for a comma-separated list of
+    endpoints, if any."""
+    healthy = _healthy_endpoints.get(base_url)
+    return healthy[0] if healthy else None
+
+
+def parse_binding(data: dict[str, Any]) -> BindingInfo:
+    """Create a BindingInfo from a binding returned by the API, which names
+    destination types in full."""
+    dest_map = {"queue": "q", "exchange": "e"}
+    return BindingInfo.model_validate(
+        {
+            key: dest_map[value] if key == "destination_type" else value
+            for key, value in data.items()
+        }
+    )
+
+
+class QueuePages:
+    def __init__(
+        self,
+        vhost: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str] | None = None,
+        page_size: int = 500,
+    ):
+        """The requests for listing queues one page at a time, and the parsing
+        of their results, shared by the synchronous and asynchronous clients.
+        See RabbitMQAPI.iter_queues for a description of the parameters.
+
+        Request the endpoint with params() until done, passing each result
+        to parse().
+        """
+        self.endpoint = "queues"
+        if vhost is not None:
+            self.endpoint = f"{self.endpoint}/{quote_vhost(vhost)}"
+        self._params: dict[str, Any] = {"page_size": page_size}
+        if pattern is not None:
+            self._params["name"] = pattern
+            self._params["use_regex"] = str(use_regex).lower()
+        if columns is not None:
+            self._params["columns"] = ",".join(columns)
+        self._model: type[QueueInfo] | type[QueueSummary] = (
+            QueueInfo if columns is None else QueueSummary
+        )
+        self.page = 1
+        self.done = False
+
+    def params(self) -> dict[str, Any]:
+        """Query parameters of the request for the next page"""
+        return {**self._params, "page": self.page}
+
+    def parse(self, result: Any) -> list[QueueInfo | QueueSummary]:
+        """The queues on a page, given the decoded response"""
+        if isinstance(result, list):
+            # Server does not support pagination
+            self.done = True
+            return [self._model(**qi) for qi in result]
+        if self.page >= result.get("page_count", 0):
+            self.done = True
+        else:
+            self.page += 1
+        return [self._model(**qi) for qi in result["items"]]
+
+
+# Connection pools shared between RabbitMQAPI instances using the same
+# credentials and retry policy
+_sessions: dict[tuple[str, str, int, float], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _session(
+    user: str, password: str, retries: int, backoff: float
+) -> requests.Session:
+    key = (user, password, retries, backoff)
+    with _sessions_lock:
+        if key not in _sessions:
+            session = requests.Session()
+            session.auth = (user, password)
+            if retries:
+                # Only retry requests that are safe to repeat
+                retry = Retry(
+                    total=retries,
+                    backoff_factor=backoff,
+                    status_forcelist=(502, 503, 504),
+                    allowed_methods=frozenset({"GET", "HEAD"}),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
+
 class RabbitMQAPI:
-    def __init__(self, url: str, user: str, password: str):
+    # How long a healthy API endpoint is used without checking it again
+    healthy_endpoint_ttl: float = 60
+    # How long health check results are reused
+    health_check_cache_ttl: float = 5
+
+    def __init__(
+        self,
+        url: str,
+        user: str,
+        password: str,
+        *,
+        timeout: float | None = None,
+        retries: int = 0,
+        backoff: float = 0.5,
+        cache_ttl: float = 0,
+    ):
+        """A client for the RabbitMQ management HTTP API.
+
+        Connections are pooled and shared between all clients using the same
+        credentials.
+
+        :param url: Base URL of the API, e.g. http://rabbitmq:15672/api
+        :param timeout: Default timeout for requests, in seconds
+        :param retries: Number of times to retry GET requests that failed
+                        to connect or returned a 502, 503 or 504 status.
+                        Health checks are never retried.
+        :param backoff: Backoff factor between retries, in seconds
+        :param cache_ttl: Cache successful GET responses for this many
+                          seconds. Once expired, cached responses carrying
+                          an ETag or Last-Modified header are revalidated
+                          with the server rather than downloaded again.
+                          Any PUT, POST or DELETE request clears the cache.
+        """
         self._url = url
-        self._session = requests.Session()
-        self._session.auth = (user, password)
+        self._session = _session(user, password, retries, backoff)
+        # Health checks must report the current state, so are never retried
+        self._probe_session = _session(user, password, 0, 0)
+        self._timeout = timeout
+        self._cache_ttl = cache_ttl
+        self._cache: dict[str, tuple[float, requests.Response]] = {}
+        self._cache_lock = threading.Lock()
+        self._health_check_results: tuple[float, list[HealthCheckResult]] | None = None
+
+    @staticmethod
+    def _configuration_options(
+        zc: zocalo.configuration.Configuration,
+    ) -> dict[str, Any]:
+        """Client options given in the rabbitmqapi configuration"""
+        return {
+            key: zc.rabbitmqapi[key]
+            for key in ("timeout", "retries", "backoff", "cache_ttl")
+            if zc.rabbitmqapi.get(key) is not None
+        }
 
     @classmethod
     def from_zocalo_configuration(cls, zc: zocalo.configuration.Configuration) -> Self:
-        instance = None
         base_url = zc.rabbitmqapi["base_url"]
-        for url in base_url.split(","):
+        options = cls._configuration_options(zc)
+        urls = base_url.split(",")
+        healthy = _healthy_endpoints.get(base_url)
+        if healthy:
+            if time.monotonic() - healthy[1] < cls.healthy_endpoint_ttl:
+                return cls(
+                    url=healthy[0],
+                    user=zc.rabbitmqapi["username"],
+                    password=zc.rabbitmqapi["password"],
+                    **options,
+                )
+            # Check the previously healthy endpoint first
+            urls.remove(healthy[0])
+            urls.insert(0, healthy[0])
+        for url in urls:
             instance = cls(
                 url=url,
                 user=zc.rabbitmqapi["username"],
                 password=zc.rabbitmqapi["password"],
+                **options,
             )
             try:
-                instance.get("health/checks/alarms")
-                break
+                instance._probe("health/checks/alarms")
             except requests.ConnectionError as e:
                 logger.warning(f"Could not connect to {url}: {e}")
-                instance = None
-        if not instance:
-            raise RuntimeError(f"Could not connect to RabbitMQ API: {base_url}")
-        return instance
+                continue
+            _healthy_endpoints[base_url] = (url, time.monotonic())
+            return instance
+        _healthy_endpoints.pop(base_url, None)
+        raise RuntimeError(f"Could not connect to RabbitMQ API: {base_url}")
 
     @property
     def health_checks(self) -> tuple[dict[str, Any], dict[str, str]]:
+        success = {}
+        failure = {}
+        for result in self.run_health_checks():
+            if result.ok:
+                success[result.check] = result.result
+            else:
+                failure[result.check] = result.result
+        return success, failure
+
+    def run_health_checks(
+        self, timeout: float = 5, cache_ttl: float | None = None
+    ) -> list[HealthCheckResult]:
+        """Run all health checks concurrently.
+
+        :param timeout: Timeout for each health check, in seconds. Checks
+                        that time out or fail to connect are reported as
+                        failed.
+        :param cache_ttl: Return the previous results if they are less than
+                          this many seconds old. Defaults to
+                          health_check_cache_ttl.
+        """
+        if cache_ttl is None:
+            cache_ttl = self.health_check_cache_ttl
+        with self._cache_lock:
+            cached = self._health_check_results
+        if cached and time.monotonic() - cached[0] < cache_ttl:
+            return cached[1]
+
         # https://rawcdn.githack.com/rabbitmq/rabbitmq-server/v3.9.7/deps/rabbitmq_management/priv/www/api/index.html
-        HEALTH_CHECKS = {
+        HEALTH_CHECKS = (
             "health/checks/alarms",
             "health/checks/local-alarms",
             "health/checks/certificate-expiration/1/months",
@@ -685,17 +1092,69 @@ class RabbitMQAPI:
             "health/checks/virtual-hosts",
             "health/checks/node-is-mirror-sync-critical",
             "health/checks/node-is-quorum-critical",
-        }
+        )
 
-        success = {}
-        failure = {}
-        for health_check in HEALTH_CHECKS:
-            response = self.get(health_check)
-            if response.status_code == requests.codes.ok:
-                success[health_check] = response.json()
-            else:
-                failure[health_check] = response.json()
-        return success, failure
+        def run_check(health_check: str) -> HealthCheckResult:
+            start = time.monotonic()
+            try:
+                response = self._probe(health_check, timeout=timeout)
+            except requests.RequestException as e:
+                return HealthCheckResult(
+                    check=health_check,
+                    ok=False,
+                    result={"status": "failed", "reason": str(e)},
+                    duration=time.monotonic() - start,
+                )
+            try:
+                result = response.json()
+            except ValueError:
+                result = {"status": "failed", "reason": response.reason}
+            return HealthCheckResult(
+                check=health_check,
+                ok=response.status_code == requests.codes.ok,
+                result=result,
+                duration=time.monotonic() - start,
+                status_code=response.status_code,
+            )
+
+        with ThreadPoolExecutor(max_workers=len(HEALTH_CHECKS)) as executor:
+            results = list(executor.map(run_check, HEALTH_CHECKS))
+        with self._cache_lock:
+            self._health_check_results = (time.monotonic(), results)
+        return results
+
+    @classmethod
+    def cluster_health_checks(
+        cls, zc: zocalo.configuration.Configuration, timeout: float = 5
+    ) -> dict[str, list[HealthCheckResult]]:
+        """Run the health checks on every node listed in the configuration
+        in parallel.
+
+        Returns the results for each node URL. Nodes that can not be reached
+        report all checks as failed."""
+        urls = zc.rabbitmqapi["base_url"].split(",")
+        instances = [
+            cls(
+                url=url,
+                user=zc.rabbitmqapi["username"],
+                password=zc.rabbitmqapi["password"],
+                **cls._configuration_options(zc),
+            )
+            for url in urls
+        ]
+        with ThreadPoolExecutor(max_workers=len(instances)) as executor:
+            results = executor.map(
+                lambda api: api.run_health_checks(timeout=timeout, cache_ttl=0),
+                instances,
+            )
+            return dict(zip(urls, results))
+
+    def _probe(self, endpoint: str, timeout: float | None = None) -> requests.Response:
+        """Send a single GET request to check the health of the server,
+        bypassing the cache and without any retries."""
+        return self._probe_session.get(
+            f"{self._url}/{endpoint}", timeout=timeout or self._timeout
+        )
 
     def get(
         self,
@@ -703,9 +1162,39 @@ class RabbitMQAPI:
         params: dict[str, Any] | None = None,
         timeout: float | None = None,
     ) -> requests.Response:
-        return self._session.get(
-            f"{self._url}/{endpoint}", params=params, timeout=timeout
+        url = f"{self._url}/{endpoint}"
+        if not self._cache_ttl:
+            return self._session.get(
+                url, params=params, timeout=timeout or self._timeout
+            )
+
+        key = requests.Request("GET", url, params=params).prepare().url or url
+        with self._cache_lock:
+            cached = self._cache.get(key)
+        headers = {}
+        if cached:
+            expires, response = cached
+            if time.monotonic() < expires:
+                return response
+            if response.headers.get("ETag"):
+                headers["If-None-Match"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                headers["If-Modified-Since"] = response.headers["Last-Modified"]
+
+        new_response = self._session.get(
+            url, params=params, headers=headers, timeout=timeout or self._timeout
         )
+        if cached and new_response.status_code == requests.codes.not_modified:
+            new_response = cached[1]
+        if new_response.status_code == requests.codes.ok:
+            with self._cache_lock:
+                self._cache[key] = (time.monotonic() + self._cache_ttl, new_response)
+        return new_response
+
+    def clear_cache(self) -> None:
+        """Discard all cached responses."""
+        with self._cache_lock:
+            self._cache.clear()
 
     def put(
         self,
@@ -714,8 +1203,12 @@ class RabbitMQAPI:
         json: dict[str, Any] | None = None,
         timeout: float | None = None,
     ) -> requests.Response:
+        self.clear_cache()
         return self._session.put(
-            f"{self._url}/{endpoint}", params=params, json=json, timeout=timeout
+            f"{self._url}/{endpoint}",
+            params=params,
+            json=json,
+            timeout=timeout or self._timeout,
         )
 
     def post(
@@ -725,8 +1218,12 @@ class RabbitMQAPI:
         json: dict[str, Any] | None = None,
         timeout: float | None = None,
     ) -> requests.Response:
+        self.clear_cache()
         return self._session.post(
-            f"{self._url}/{endpoint}", data=data, json=json, timeout=timeout
+            f"{self._url}/{endpoint}",
+            data=data,
+            json=json,
+            timeout=timeout or self._timeout,
         )
 
     def delete(
@@ -735,10 +1232,36 @@ class RabbitMQAPI:
         params: dict[str, Any] | None = None,
         timeout: float | None = None,
     ) -> requests.Response:
+        self.clear_cache()
         return self._session.delete(
-            f"{self._url}/{endpoint}", params=params, timeout=timeout
+            f"{self._url}/{endpoint}", params=params, timeout=timeout or self._timeout
         )
 
+    def definitions(self, vhost: str | None = None) -> Definitions:
+        """Export the whole topology of the server, or of one virtual host,
+        with a single request."""
+        endpoint = "definitions"
+        if vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+        response = self.get(endpoint)
+        response.raise_for_status()
+        return Definitions.model_validate(response.json(), context={"vhost": vhost})
+
+    def import_definitions(
+        self, definitions: Definitions, vhost: str | None = None
+    ) -> None:
+        """Create or update all components in the given definitions with a
+        single request. Components on the server that are not included in the
+        definitions are left unchanged.
+
+        When importing into a single virtual host, the definitions must not
+        contain users, virtual hosts or permissions."""
+        endpoint = "definitions"
+        if vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+        response = self.post(endpoint, json=definitions.to_export())
+        response.raise_for_status()
+
     def bindings(
         self,
         vhost: str | None = None,
@@ -748,7 +1271,7 @@ class RabbitMQAPI:
     ) -> list[BindingInfo]:
         endpoint = "bindings"
         if vhost is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
         _check = {source, destination, destination_type}
         if None in _check and len(_check) > 1:
             raise ValueError(
@@ -756,15 +1279,7 @@ class RabbitMQAPI:
             )
         if destination_type is not None:
             endpoint = f"{endpoint}/e/{source}/{destination_type}/{destination}"
-        dest_map = {"queue": "q", "exchange": "e"}
-
-        def conv(key: str, value: Any) -> Any:
-            return dest_map[value] if key == "destination_type" else value
-
-        return [
-            BindingInfo.model_validate({_r[0]: conv(_r[0], _r[1]) for _r in r.items()})
-            for r in self.get(endpoint).json()
-        ]
+        return [parse_binding(r) for r in self.get(endpoint).json()]
 
     def binding_declare(self, binding: BindingSpec) -> None:
         endpoint = f"bindings/{binding.vhost}/e/{binding.source}/{binding.destination_type.value}/{binding.destination}"
@@ -788,20 +1303,10 @@ class RabbitMQAPI:
         # If properties_key is not specified then all bindings between the specified
         # source and destination are deleted
         endpoint = (
-            f"bindings/{_quote(vhost)}/e/{source}/{destination_type}/{destination}"
+            f"bindings/{quote_vhost(vhost)}/e/{source}/{destination_type}/{destination}"
         )
         if properties_key is None:
-            dest_map = {"queue": "q", "exchange": "e"}
-
-            def conv(key: str, value: Any) -> Any:
-                return dest_map[value] if key == "destination_type" else value
-
-            props = [
-                BindingInfo.model_validate(
-                    {_r[0]: conv(_r[0], _r[1]) for _r in r.items()}
-                ).properties_key
-                for r in self.get(endpoint).json()
-            ]
+            props = [parse_binding(r).properties_key for r in self.get(endpoint).json()]
         else:
             props = [properties_key]
         for prop in props:
@@ -842,11 +1347,11 @@ class RabbitMQAPI:
     ) -> list[ExchangeInfo] | ExchangeInfo:
         endpoint = "exchanges"
         if vhost is not None and name is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}/{name}/"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/{name}/"
             response = self.get(endpoint)
             return ExchangeInfo(**response.json())
         elif vhost is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}/"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/"
         elif name is not None:
             raise ValueError("name can not be set without vhost")
         response = self.get(endpoint)
@@ -861,19 +1366,19 @@ class RabbitMQAPI:
         response.raise_for_status()
 
     def exchange_delete(self, vhost: str, name: str, if_unused: bool = False) -> None:
-        endpoint = f"exchanges/{_quote(vhost)}/{name}"
+        endpoint = f"exchanges/{quote_vhost(vhost)}/{name}"
         response = self.delete(endpoint, params={"if-unused": if_unused})
         response.raise_for_status()
 
     def policies(self, vhost: str | None = None) -> list[PolicySpec]:
         endpoint = "policies"
         if vhost is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}/"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/"
         response = self.get(endpoint)
         return [PolicySpec(**p) for p in response.json()]
 
     def policy(self, vhost: str, name: str) -> PolicySpec:
-        endpoint = f"policies/{_quote(vhost)}/{name}/"
+        endpoint = f"policies/{quote_vhost(vhost)}/{name}/"
         response = self.get(endpoint)
         return PolicySpec(**response.json())
 
@@ -888,7 +1393,7 @@ class RabbitMQAPI:
         response.raise_for_status()
 
     def clear_policy(self, vhost: str, name: str) -> None:
-        endpoint = f"policies/{_quote(vhost)}/{name}/"
+        endpoint = f"policies/{quote_vhost(vhost)}/{name}/"
         response = self.delete(endpoint)
         response.raise_for_status()
 
@@ -897,23 +1402,113 @@ class RabbitMQAPI:
 
     @overload
     def queues(
-        self, vhost: str | None = None, name: None = None
+        self,
+        vhost: str | None = None,
+        name: None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: None = None,
+        page_size: int | None = None,
     ) -> list[QueueInfo]: ...
 
+    @overload
     def queues(
-        self, vhost: str | None = None, name: str | None = None
-    ) -> list[QueueInfo] | QueueInfo:
+        self,
+        vhost: str | None = None,
+        name: None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str],
+        page_size: int | None = None,
+    ) -> list[QueueSummary]: ...
+
+    def queues(
+        self,
+        vhost: str | None = None,
+        name: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str] | None = None,
+        page_size: int | None = None,
+    ) -> list[QueueInfo] | list[QueueSummary] | QueueInfo:
         endpoint = "queues"
         if vhost is not None and name is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}/{name}"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/{name}"
             response = self.get(endpoint)
             return QueueInfo(**response.json())
-        elif vhost is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}"
         elif name is not None:
             raise ValueError("name can not be set without vhost")
-        response = self.get(endpoint)
-        return [QueueInfo(**qi) for qi in response.json()]
+        if pattern is None and columns is None and page_size is None:
+            if vhost is not None:
+                endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+            response = self.get(endpoint)
+            return [QueueInfo(**qi) for qi in response.json()]
+        return list(
+            self.iter_queues(
+                vhost,
+                pattern=pattern,
+                use_regex=use_regex,
+                columns=columns,
+                page_size=page_size or 500,
+            )
+        )
+
+    @overload
+    def iter_queues(
+        self,
+        vhost: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: None = None,
+        page_size: int = 500,
+    ) -> Iterator[QueueInfo]: ...
+
+    @overload
+    def iter_queues(
+        self,
+        vhost: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str],
+        page_size: int = 500,
+    ) -> Iterator[QueueSummary]: ...
+
+    def iter_queues(
+        self,
+        vhost: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str] | None = None,
+        page_size: int = 500,
+    ) -> Iterator[QueueInfo | QueueSummary]:
+        """Iterate over queues, requesting them from the server one page at a
+        time.
+
+        :param vhost: Only list queues in this virtual host
+        :param pattern: Only list queues whose name contains this string, or
+                        matches this regular expression if use_regex is set
+        :param use_regex: Interpret pattern as a regular expression
+        :param columns: Only request these fields for each queue, and return
+                        QueueSummary objects rather than full QueueInfo
+        :param page_size: Number of queues requested at a time
+        """
+        pages = QueuePages(
+            vhost,
+            pattern=pattern,
+            use_regex=use_regex,
+            columns=columns,
+            page_size=page_size,
+        )
+        while not pages.done:
+            response = self.get(pages.endpoint, params=pages.params())
+            response.raise_for_status()
+            yield from pages.parse(response.json())
 
     def queue_declare(self, queue: QueueSpec) -> None:
         endpoint = f"queues/{queue.vhost}/{queue.name}"
@@ -926,13 +1521,37 @@ class RabbitMQAPI:
     def queue_delete(
         self, vhost: str, name: str, if_unused: bool = False, if_empty: bool = False
     ) -> None:
-        logger.debug(f"Deleting queue {_quote(vhost)}/{name}")
-        endpoint = f"queues/{_quote(vhost)}/{name}"
+        logger.debug(f"Deleting queue {quote_vhost(vhost)}/{name}")
+        endpoint = f"queues/{quote_vhost(vhost)}/{name}"
         response = self.delete(
             endpoint, params={"if-unused": if_unused, "if-empty": if_empty}
         )
         response.raise_for_status()
 
+    def shovels(self, vhost: str | None = None) -> list[ShovelInfo]:
+        endpoint = "shovels"
+        if vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+        response = self.get(endpoint)
+        return [ShovelInfo(**shovel) for shovel in response.json()]
+
+    def shovel_declare(self, shovel: ShovelSpec) -> None:
+        endpoint = f"parameters/shovel/{quote_vhost(shovel.vhost)}/{shovel.name}"
+        value = {
+            "src-protocol": "amqp091",
+            "dest-protocol": "amqp091",
+            **shovel.model_dump(
+                exclude_none=True, exclude={"name", "vhost"}, by_alias=True
+            ),
+        }
+        response = self.put(endpoint, json={"value": value})
+        response.raise_for_status()
+
+    def shovel_delete(self, vhost: str, name: str) -> None:
+        endpoint = f"parameters/shovel/{quote_vhost(vhost)}/{name}"
+        response = self.delete(endpoint)
+        response.raise_for_status()
+
     def users(self) -> list[UserSpec]:
         endpoint = "users"
         response = self.get(endpoint)
@@ -956,7 +1575,7 @@ class RabbitMQAPI:
     ) -> list[PermissionSpec] | PermissionSpec:
         endpoint = "permissions"
         if vhost is not None and user is not None:
-            endpoint = f"{endpoint}/{_quote(vhost)}/{user}/"
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/{user}/"
             response = self.get(endpoint)
             return PermissionSpec(**response.json())
         elif vhost is not None or user is not None:
@@ -975,7 +1594,7 @@ class RabbitMQAPI:
         response.raise_for_status()
 
     def clear_permissions(self, vhost: str, user: str) -> None:
-        endpoint = f"permissions/{_quote(vhost)}/{user}/"
+        endpoint = f"permissions/{quote_vhost(vhost)}/{user}/"
         response = self.delete(endpoint)
         response.raise_for_status()
 
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import AsyncIterator
+from typing import Any, Self, overload
+
+import requests
+
+import zocalo.configuration
+from zocalo.util.rabbitmq import (
+    BindingInfo,
+    ConnectionInfo,
+    ExchangeInfo,
+    NodeInfo,
+    PolicySpec,
+    QueueInfo,
+    QueuePages,
+    QueueSummary,
+    RabbitMQAPI,
+    _session,
+    healthy_endpoint,
+    parse_binding,
+    quote_vhost,
+)
+
+logger = logging.getLogger("zocalo.util.rabbitmq_async")
+
+
+class AsyncRabbitMQAPI:
+    def __init__(
+        self,
+        url: str,
+        user: str,
+        password: str,
+        *,
+        timeout: float | None = None,
+        retries: int = 0,
+        backoff: float = 0.5,
+        max_connections: int = 10,
+    ):
+        """An asyncio client for the RabbitMQ management HTTP API.
+
+        Provides the read methods of RabbitMQAPI as coroutines, returning the
+        same models. Requests are made in worker threads using the same
+        requests session as RabbitMQAPI, so proxy and CA bundle settings from
+        the environment, connection pooling and retries all behave as for the
+        synchronous client. Up to max_connections requests are made at once,
+        so that many calls, and many brokers, can be polled concurrently from
+        a single event loop.
+
+        An instance must only be used from a single event loop. close(), or
+        using the instance as an async context manager, is accepted for
+        compatibility but leaves the shared session open.
+
+        :param url: Base URL of the API, e.g. http://rabbitmq:15672/api
+        :param timeout: Timeout for each request, in seconds
+        :param retries: Number of times to retry failed GET requests
+        :param backoff: Backoff factor between retries, in seconds
+        :param max_connections: Maximum number of concurrent requests
+        """
+        self._url = url.rstrip("/")
+        self._session = _session(user, password, retries, backoff)
+        self._timeout = timeout
+        self._slots = asyncio.Semaphore(max_connections)
+
+    @classmethod
+    def from_zocalo_configuration(cls, zc: zocalo.configuration.Configuration) -> Self:
+        """Create a client for the configured API. If the synchronous client
+        has found a healthy endpoint then that is used, otherwise the first
+        configured endpoint."""
+        base_url = zc.rabbitmqapi["base_url"]
+        options = RabbitMQAPI._configuration_options(zc)
+        # Responses are not cached by the asyncio client
+        options.pop("cache_ttl", None)
+        return cls(
+            url=healthy_endpoint(base_url) or base_url.split(",")[0],
+            user=zc.rabbitmqapi["username"],
+            password=zc.rabbitmqapi["password"],
+            **options,
+        )
+
+    async def request(
+        self,
+        method: str,
+        endpoint: str,
+        params: dict[str, Any] | None = None,
+        json: Any = None,
+        timeout: float | None = None,
+    ) -> requests.Response:
+        async with self._slots:
+            return await asyncio.to_thread(
+                self._session.request,
+                method,
+                f"{self._url}/{endpoint}",
+                params=params,
+                json=json,
+                timeout=timeout or self._timeout,
+            )
+
+    async def get(
+        self,
+        endpoint: str,
+        params: dict[str, Any] | None = None,
+        timeout: float | None = None,
+    ) -> requests.Response:
+        return await self.request("GET", endpoint, params=params, timeout=timeout)
+
+    async def _get_json(
+        self, endpoint: str, params: dict[str, Any] | None = None
+    ) -> Any:
+        response = await self.get(endpoint, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self) -> None:
+        # The session is shared with RabbitMQAPI, so is left open
+        pass
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def bindings(
+        self,
+        vhost: str | None = None,
+        source: str | None = None,
+        destination: str | None = None,
+        destination_type: str | None = None,
+    ) -> list[BindingInfo]:
+        endpoint = "bindings"
+        if vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+        _check = {source, destination, destination_type}
+        if None in _check and len(_check) > 1:
+            raise ValueError(
+                "Either all of source, destination and destination_type must be specified, or none of them"
+            )
+        if destination_type is not None:
+            endpoint = f"{endpoint}/e/{source}/{destination_type}/{destination}"
+        return [parse_binding(r) for r in await self._get_json(endpoint)]
+
+    @overload
+    async def connections(self, name: str) -> ConnectionInfo: ...
+
+    @overload
+    async def connections(self, name: None = None) -> list[ConnectionInfo]: ...
+
+    async def connections(
+        self, name: str | None = None
+    ) -> list[ConnectionInfo] | ConnectionInfo:
+        if name is not None:
+            return ConnectionInfo(**await self._get_json(f"connections/{name}/"))
+        return [ConnectionInfo(**qi) for qi in await self._get_json("connections")]
+
+    @overload
+    async def nodes(self, name: str) -> NodeInfo: ...
+
+    @overload
+    async def nodes(self, name: None = None) -> list[NodeInfo]: ...
+
+    async def nodes(self, name: str | None = None) -> list[NodeInfo] | NodeInfo:
+        if name is not None:
+            return NodeInfo(**await self._get_json(f"nodes/{name}"))
+        return [NodeInfo(**qi) for qi in await self._get_json("nodes")]
+
+    @overload
+    async def exchanges(self, vhost: str, name: str) -> ExchangeInfo: ...
+
+    @overload
+    async def exchanges(
+        self, vhost: str | None = None, name: None = None
+    ) -> list[ExchangeInfo]: ...
+
+    async def exchanges(
+        self, vhost: str | None = None, name: str | None = None
+    ) -> list[ExchangeInfo] | ExchangeInfo:
+        endpoint = "exchanges"
+        if vhost is not None and name is not None:
+            return ExchangeInfo(
+                **await self._get_json(f"{endpoint}/{quote_vhost(vhost)}/{name}/")
+            )
+        elif vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/"
+        elif name is not None:
+            raise ValueError("name can not be set without vhost")
+        return [ExchangeInfo(**qi) for qi in await self._get_json(endpoint)]
+
+    async def policies(self, vhost: str | None = None) -> list[PolicySpec]:
+        endpoint = "policies"
+        if vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}/"
+        return [PolicySpec(**p) for p in await self._get_json(endpoint)]
+
+    @overload
+    async def queues(self, vhost: str, name: str) -> QueueInfo: ...
+
+    @overload
+    async def queues(
+        self, vhost: str | None = None, name: None = None
+    ) -> list[QueueInfo]: ...
+
+    async def queues(
+        self, vhost: str | None = None, name: str | None = None
+    ) -> list[QueueInfo] | QueueInfo:
+        endpoint = "queues"
+        if vhost is not None and name is not None:
+            return QueueInfo(
+                **await self._get_json(f"{endpoint}/{quote_vhost(vhost)}/{name}")
+            )
+        elif vhost is not None:
+            endpoint = f"{endpoint}/{quote_vhost(vhost)}"
+        elif name is not None:
+            raise ValueError("name can not be set without vhost")
+        return [QueueInfo(**qi) for qi in await self._get_json(endpoint)]
+
+    async def iter_queues(
+        self,
+        vhost: str | None = None,
+        *,
+        pattern: str | None = None,
+        use_regex: bool = False,
+        columns: list[str] | None = None,
+        page_size: int = 500,
+    ) -> AsyncIterator[QueueInfo | QueueSummary]:
+        """Iterate over queues, requesting them from the server one page at a
+        time. See RabbitMQAPI.iter_queues for a description of the parameters."""
+        pages = QueuePages(
+            vhost,
+            pattern=pattern,
+            use_regex=use_regex,
+            columns=columns,
+            page_size=page_size,
+        )
+        while not pages.done:
+            result = await self._get_json(pages.endpoint, params=pages.params())
+            for queue in pages.parse(result):
+                yield queue
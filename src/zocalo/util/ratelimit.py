@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float | None = None):
+        """A thread-safe token bucket rate limiter.
+
+        Tokens are added to the bucket at a constant rate, up to a maximum of
+        burst tokens. Each call to acquire() removes tokens from the bucket,
+        waiting for enough tokens to become available if necessary. The bucket
+        starts full, so that up to burst operations can proceed immediately.
+
+        Args:
+            rate: Number of tokens added per second.
+            burst: Maximum number of tokens in the bucket. Defaults to one
+                second's worth of tokens, but at least 1.
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, not {rate}")
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate, 1)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Remove tokens from the bucket, blocking until they are available.
+
+        Returns the number of seconds spent waiting."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Allow the balance to become negative, so that concurrent callers
+            # queue up behind each other rather than all waking up at once
+            self._tokens -= tokens
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Remove tokens from the bucket if they are available right now."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < tokens:
+                return False
+            self._tokens -= tokens
+            return True
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, NamedTuple
+
+logger = logging.getLogger("zocalo.util.resources")
+
+_PROC = Path("/proc")
+
+# ru_maxrss is given in bytes on macOS, and in kilobytes elsewhere
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class ProcessStats(NamedTuple):
+    pid: int
+    ppid: int
+    starttime: int
+    cpu_time: float
+    """User and system time of the process and of its reaped children, in seconds"""
+    rss: int
+    """Resident set size in bytes"""
+    io_read_bytes: int | None
+    io_write_bytes: int | None
+
+
+def read_process_stats(pid: int) -> ProcessStats | None:
+    """Read resource usage of a single process from /proc.
+
+    Returns None if the process does not exist (any more), or if /proc is not
+    available. I/O counters are None if they can not be read, which is usually
+    the case for processes owned by other users."""
+    try:
+        stat = (_PROC / str(pid) / "stat").read_text()
+        statm = (_PROC / str(pid) / "statm").read_text()
+    except OSError:
+        return None
+    # The process name is enclosed in parentheses and may itself contain
+    # spaces and parentheses, so split the remaining fields after the last ')'
+    fields = stat[stat.rindex(")") + 2 :].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_time = sum(int(f) for f in fields[11:15]) / ticks
+    io_read_bytes = io_write_bytes = None
+    try:
+        for line in (_PROC / str(pid) / "io").read_text().splitlines():
+            key, _, value = line.partition(":")
+            if key == "rchar":
+                io_read_bytes = int(value)
+            elif key == "wchar":
+                io_write_bytes = int(value)
+    except OSError:
+        pass
+    return ProcessStats(
+        pid=pid,
+        ppid=int(fields[1]),
+        starttime=int(fields[19]),
+        cpu_time=cpu_time,
+        rss=int(statm.split()[1]) * os.sysconf("SC_PAGE_SIZE"),
+        io_read_bytes=io_read_bytes,
+        io_write_bytes=io_write_bytes,
+    )
+
+
+def process_tree(pid: int | None = None) -> list[ProcessStats]:
+    """Return resource usage for a process and all of its live descendants.
+
+    The first entry in the list is the process itself. Returns an empty list
+    if /proc is not available."""
+    if pid is None:
+        pid = os.getpid()
+    root = read_process_stats(pid)
+    if not root:
+        return []
+    # Only read the parent PID of every process on the system, and only
+    # collect the full statistics for the processes in the tree
+    children: dict[int, list[int]] = {}
+    for entry in _PROC.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rindex(")") + 2 :].split(maxsplit=2)[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    tree = [root]
+    for process in tree:
+        for child in children.get(process.pid, []):
+            stats = read_process_stats(child)
+            if stats:
+                tree.append(stats)
+    return tree
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(
+        self,
+        interval: float = 10,
+        callback: Callable[[dict[str, Any]], None] | None = None,
+    ):
+        """Construct and start a thread that periodically records the resource
+        usage of this process and all of its child processes.
+
+        Resource usage is read from /proc where available. On other systems
+        only the counters provided by the resource module are reported.
+
+        Args:
+            interval: Number of seconds between samples.
+            callback: A function that is called with each new sample.
+        """
+        super().__init__(name="zocalo resource sampler")
+        self.daemon = True
+        self._interval = interval
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._stop_sampling = threading.Event()
+        self._start_time = time.monotonic()
+        self._io: dict[tuple[int, int], tuple[int, int]] = {}
+        self._samples = 0
+        self._rss_total = 0
+        self._latest: dict[str, Any] = {}
+        self._peak: dict[str, int] = {"rss": 0, "processes": 0}
+        self.start()
+
+    def sample(self) -> dict[str, Any]:
+        """Take a resource usage sample and update the running summary."""
+        usage_self = resource.getrusage(resource.RUSAGE_SELF)
+        usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # Includes all reaped descendants, plus any that were reaped by them
+        cpu_time = (
+            usage_self.ru_utime
+            + usage_self.ru_stime
+            + usage_children.ru_utime
+            + usage_children.ru_stime
+        )
+        tree = process_tree()
+        if tree:
+            cpu_time += sum(p.cpu_time for p in tree[1:])
+            rss: int | None = sum(p.rss for p in tree)
+        else:
+            rss = None
+
+        with self._lock:
+            # I/O counters disappear with their process, so remember the last
+            # value seen for every process to keep a running total.
+            for p in tree:
+                if p.io_read_bytes is not None and p.io_write_bytes is not None:
+                    self._io[p.pid, p.starttime] = (p.io_read_bytes, p.io_write_bytes)
+            self._samples += 1
+            # Samples miss any peaks between them, so also take the peak of
+            # this process and of its largest reaped child into account
+            self._peak["rss"] = max(
+                self._peak["rss"],
+                usage_self.ru_maxrss * _MAXRSS_UNIT,
+                usage_children.ru_maxrss * _MAXRSS_UNIT,
+            )
+            if rss is not None:
+                self._rss_total += rss
+                self._peak["rss"] = max(self._peak["rss"], rss)
+            self._peak["processes"] = max(self._peak["processes"], len(tree) - 1)
+            self._latest = {
+                "cpu_time": round(cpu_time, 2),
+                "rss": rss,
+                "peak_rss": self._peak["rss"],
+                "io_read_bytes": sum(r for r, _ in self._io.values()),
+                "io_write_bytes": sum(w for _, w in self._io.values()),
+                "processes": max(len(tree) - 1, 0),
+            }
+            sample = dict(self._latest)
+        if self._callback:
+            self._callback(sample)
+        return sample
+
+    @property
+    def latest(self) -> dict[str, Any]:
+        """The most recent sample."""
+        with self._lock:
+            return dict(self._latest)
+
+    def summary(self) -> dict[str, Any]:
+        """Summarise resource usage over the lifetime of the sampler."""
+        with self._lock:
+            if not self._samples:
+                return {}
+            duration = time.monotonic() - self._start_time
+            return {
+                "samples": self._samples,
+                "duration": round(duration, 2),
+                "cpu_time": self._latest["cpu_time"],
+                "cpu_average": round(self._latest["cpu_time"] / duration, 2),
+                "mean_rss": (
+                    self._rss_total // self._samples
+                    if self._latest["rss"] is not None
+                    else None
+                ),
+                "peak_rss": self._peak["rss"],
+                "io_read_bytes": self._latest["io_read_bytes"],
+                "io_write_bytes": self._latest["io_write_bytes"],
+                "peak_processes": self._peak["processes"],
+            }
+
+    def shutdown(self) -> None:
+        """Take a final sample and stop the sampler thread."""
+        self._stop_sampling.set()
+
+    def run(self) -> None:
+        """Sampler thread main loop."""
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.debug(f"Could not sample resource usage: {e}", exc_info=True)
+            if self._stop_sampling.wait(self._interval):
+                break
+        try:
+            self.sample()
+        except Exception:
+            pass
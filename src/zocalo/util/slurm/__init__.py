@@ -2,16 +2,26 @@ from __future__ import annotations
 
 import base64
 import binascii
+import importlib
 import json
 import os
 import pathlib
-from typing import Any, Self
+from typing import TYPE_CHECKING, Any, Self
 
 import requests
 
 from zocalo.configuration import Configuration
 
-from . import models
+if TYPE_CHECKING:
+    from . import models
+
+
+def __getattr__(name: str) -> Any:
+    # The generated API models are large and slow to import,
+    # so only load them once they are actually used.
+    if name == "models":
+        return importlib.import_module(".models", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def validate_is_jwt(token: str) -> bool:
@@ -140,11 +150,15 @@ class SlurmRestApi:
         return response
 
     def get_jobs(self) -> models.OpenapiJobInfoResp:
+        from . import models
+
         endpoint = f"slurm/{self.version}/jobs"
         response = self.get(endpoint)
         return models.OpenapiJobInfoResp(**response.json())
 
     def get_job_info(self, job_id: int) -> models.JobInfo:
+        from . import models
+
         endpoint = f"slurm/{self.version}/job/{job_id}"
         response = self.get(endpoint)
         job_info_resp = models.OpenapiJobInfoResp(**response.json())
@@ -154,6 +168,8 @@ class SlurmRestApi:
     def submit_job(
         self, job_submission: models.JobSubmitReq
     ) -> models.OpenapiJobSubmitResponse:
+        from . import models
+
         endpoint = f"slurm/{self.version}/job/submit"
         response = self.post(
             endpoint, json=job_submission.model_dump(exclude_defaults=True)
@@ -1,9 +1,20 @@
 from __future__ import annotations
 
+import json
 import logging
+import random
 import threading
+import time
 from collections.abc import Callable
-from typing import TYPE_CHECKING, Any, Mapping, NotRequired, TypedDict, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Mapping,
+    NamedTuple,
+    NotRequired,
+    TypedDict,
+    cast,
+)
 
 import workflows.services.common_service
 import workflows.util
@@ -16,9 +27,37 @@ if TYPE_CHECKING:
     import zocalo.configuration
 
 
+class ResultBatching(NamedTuple):
+    count: int | None = 100
+    size: int | None = None
+    interval: float | None = None
+
+
 class BaseWrapper:
+    """
+    Base class for zocalo wrappers.
+
+    Results recorded with record_result_individual_file() are normally sent
+    downstream one message per result. If result batching is enabled, either
+    by calling set_result_batching() or by setting 'result_batching' in the
+    'wrapper' section of the recipe step to true or to a dictionary of
+    arguments of set_result_batching(), then results are collected and sent
+    as a single message once the batch reaches a number of results, an
+    approximate serialized size in bytes, or an age in seconds. Any pending
+    results are sent before the success, failure, and completed messages.
+
+    A batched message uses the envelope
+
+        {"batch": [payload, payload, ...]}
+
+    on the 'result-individual-file' output, so batching must only be enabled
+    for recipes where the downstream consumer understands this envelope.
+    """
+
     _logger_name = "zocalo.wrapper"  # The logger can be accessed via self.log
 
+    _result_batching: ResultBatching | None = None
+
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         self._environment = kwargs.get("environment", {})
         self.__log_extra: dict[str, Any] = {}
@@ -30,37 +69,123 @@ class BaseWrapper:
     ) -> None:
         self.recwrap = recwrap
         self.__log_extra["recipe_ID"] = recwrap.environment["ID"]
+        batching = (recwrap.recipe_step or {}).get("wrapper", {}).get("result_batching")
+        if batching is True:
+            self.set_result_batching()
+        elif isinstance(batching, dict):
+            self.set_result_batching(
+                **{
+                    field: batching[field]
+                    for field in ResultBatching._fields
+                    if field in batching
+                }
+            )
+        elif batching:
+            raise ValueError(
+                f"Invalid result_batching setting {batching!r}: expected true or a"
+                f" dictionary with any of the keys {', '.join(ResultBatching._fields)}"
+            )
+
+    def set_result_batching(
+        self,
+        count: int | None = 100,
+        size: int | None = None,
+        interval: float | None = None,
+    ) -> None:
+        """Send results recorded with record_result_individual_file() in batches.
+
+        Args:
+            count: Send a batch once it contains this many results.
+            size: Send a batch once its approximate serialized size exceeds this
+                many bytes.
+            interval: Send a batch at the latest this many seconds after its
+                first result was recorded.
+        """
+        self.flush_results()
+        self._result_batch: list[Any] = []
+        self._result_batch_size = 0
+        self._result_batch_lock = threading.RLock()
+        self._result_batch_timer: threading.Timer | None = None
+        self._result_batching = ResultBatching(count, size, interval)
+
+    def flush_results(self) -> None:
+        """Send any batched results downstream."""
+        if not self._result_batching:
+            return
+        with self._result_batch_lock:
+            if self._result_batch_timer:
+                self._result_batch_timer.cancel()
+                self._result_batch_timer = None
+            if not self._result_batch:
+                return
+            batch, self._result_batch = self._result_batch, []
+            self._result_batch_size = 0
+            self.log.debug(f"Sending batch of {len(batch)} results")
+            self.recwrap.send_to("result-individual-file", {"batch": batch})
+
+    def send_to(self, channel: str, payload: Any) -> None:
+        """Send a message downstream on a recipe output.
+
+        With result batching, batches may be sent from a timer thread, so
+        messages are sent while holding the batching lock. Wrappers that send
+        messages themselves while results are batched by interval should use
+        this method rather than self.recwrap.send_to().
+        """
+        if not self._result_batching:
+            self.recwrap.send_to(channel, payload)
+            return
+        with self._result_batch_lock:
+            self.recwrap.send_to(channel, payload)
 
     def prepare(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("starting", payload)
+            self.send_to("starting", payload)
 
     def update(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("updates", payload)
+            self.send_to("updates", payload)
 
     def done(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("completed", payload)
+            self.flush_results()
+            self.send_to("completed", payload)
 
     def success(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("success", payload)
+            self.flush_results()
+            self.send_to("success", payload)
 
     def failure(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("failure", str(payload))
+            self.flush_results()
+            self.send_to("failure", str(payload))
 
     def run(self) -> bool:
         raise NotImplementedError()
 
     def record_result_individual_file(self, payload: Any = "") -> None:
-        if getattr(self, "recwrap", None):
+        if not getattr(self, "recwrap", None):
+            return
+        if not self._result_batching:
             self.recwrap.send_to("result-individual-file", payload)
+            return
+        count, size, interval = self._result_batching
+        with self._result_batch_lock:
+            self._result_batch.append(payload)
+            if size:
+                self._result_batch_size += len(json.dumps(payload, default=str))
+            if (count and len(self._result_batch) >= count) or (
+                size and self._result_batch_size >= size
+            ):
+                self.flush_results()
+            elif interval and not self._result_batch_timer:
+                self._result_batch_timer = threading.Timer(interval, self.flush_results)
+                self._result_batch_timer.daemon = True
+                self._result_batch_timer.start()
 
     def record_result_all_files(self, payload: Any = "") -> None:
         if getattr(self, "recwrap", None):
-            self.recwrap.send_to("result-all-files", payload)
+            self.send_to("result-all-files", payload)
 
     @property
     def config(self) -> zocalo.configuration.Configuration | None:
@@ -92,26 +217,51 @@ class StatusDict(TypedDict):
 
 
 class StatusNotifications(threading.Thread):
-    def __init__(self, send_function: Callable[[Mapping], None], taskname: str):
+    def __init__(
+        self,
+        send_function: Callable[[Mapping], None],
+        taskname: str,
+        *,
+        interval: float = 3,
+        min_interval: float = 0,
+        jitter: float = 0,
+        delta: bool = False,
+    ):
         """Construct and start a StatusNotifications thread object.
 
-        Once started, this will repeatedly re-broadcast the cached
-        current status, every few seconds.
+        Once started, this will broadcast the current status whenever it
+        changes, and repeatedly re-broadcast the cached current status as a
+        heartbeat while nothing changes.
 
         Args:
             send_function: The transport function that broadcasts the actual message.
             taskname: The name of this task, which will be appended to the message.
+            interval: Number of seconds between heartbeat messages.
+            min_interval: Minimum number of seconds between two messages. Status
+                changes within this period are coalesced into a single message.
+            jitter: Randomly vary each heartbeat interval by up to this fraction,
+                so that many tasks started together do not report in lockstep.
+            delta: Only send fields that changed since the last message, along
+                with the host ID and a 'delta' marker. Heartbeats always contain
+                the full status, and are sent even while the status changes.
         """
         super().__init__(name="zocalo status notification")
         self.daemon = True
         self._send_status = send_function
         self._lock = threading.Condition(threading.Lock())
+        self._interval = interval
+        self._min_interval = min_interval
+        self._jitter = jitter
+        self._delta = delta
         self._status_dict: StatusDict = {
             "host": workflows.util.generate_unique_host_id(),
             "task": taskname,
             "workflows": workflows.version(),
             "zocalo": zocalo.__version__,
         }
+        self._last_sent: dict[str, Any] = {}
+        self._last_sent_time = 0.0
+        self._next_heartbeat = 0.0
         self.set_status(workflows.services.common_service.Status.STARTING)
         self._keep_running = True
         self.start()
@@ -145,7 +295,9 @@ class StatusNotifications(threading.Thread):
 
     def shutdown(self) -> None:
         """Stop the status notification thread."""
-        self._keep_running = False
+        with self._lock:
+            self._keep_running = False
+            self._lock.notify()
 
     def send_status(self, dictionary: Mapping) -> None:
         try:
@@ -153,10 +305,42 @@ class StatusNotifications(threading.Thread):
         except workflows.Disconnected:
             pass
 
+    def _broadcast(self, full: bool) -> None:
+        """Send the current status. Must be called with the lock held."""
+        status = cast(dict[str, Any], self._status_dict)
+        if full or not self._last_sent:
+            self.send_status(status)
+        else:
+            changes = {
+                key: value
+                for key, value in status.items()
+                if self._last_sent.get(key) != value
+            }
+            self.send_status({"host": status["host"], "delta": True, **changes})
+        self._last_sent = dict(status)
+        self._last_sent_time = time.monotonic()
+        self._next_heartbeat = self._last_sent_time + self._interval * (
+            1 + random.uniform(-self._jitter, self._jitter)
+        )
+
     def run(self) -> None:
         """Status notification thread main loop."""
         with self._lock:
-            self.send_status(self._status_dict)
+            self._broadcast(full=True)
             while self._keep_running:
-                self._lock.wait(3)
-                self.send_status(self._status_dict)
+                next_message = self._next_heartbeat
+                if self._status_dict != self._last_sent:
+                    next_message = min(
+                        next_message, self._last_sent_time + self._min_interval
+                    )
+                timeout = next_message - time.monotonic()
+                if timeout > 0:
+                    self._lock.wait(timeout)
+                    continue
+                # Send the full status whenever a heartbeat is due, even if
+                # the status keeps changing
+                self._broadcast(
+                    full=not self._delta or time.monotonic() >= self._next_heartbeat
+                )
+            if self._status_dict != self._last_sent:
+                self._broadcast(full=not self._delta)
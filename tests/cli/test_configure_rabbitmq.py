@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import stat
+from unittest import mock
+
+import pytest
+
+from zocalo.cli import configure_rabbitmq
+from zocalo.cli.configure_rabbitmq import Action, Change, plan_changes
+from zocalo.util.rabbitmq import (
+    BindingSpec,
+    Definitions,
+    ExchangeInfo,
+    ExchangeSpec,
+    QueueInfo,
+    QueueSpec,
+    UserSpec,
+    VHostSpec,
+    hash_password,
+)
+
+
+def _queue(name, **kwargs):
+    return QueueSpec(
+        name=name,
+        vhost="zocalo",
+        durable=True,
+        auto_delete=False,
+        arguments=kwargs.pop("arguments", {"x-queue-type": "quorum"}),
+        **kwargs,
+    )
+
+
+def _queue_info(name, **kwargs):
+    return QueueInfo(
+        exclusive=kwargs.pop("exclusive", False),
+        **_queue(name, **kwargs).model_dump(),
+    )
+
+
+def test_plan_changes_for_queues():
+    incoming = [
+        _queue("unchanged"),
+        _queue("changed", arguments={"x-queue-type": "classic"}),
+        _queue("new"),
+    ]
+    current = [
+        _queue_info("unchanged"),
+        _queue_info("changed"),
+        _queue_info("undefined"),
+        _queue_info("amq.gen-1234"),
+        _queue_info("temporary", exclusive=True),
+    ]
+    changes = plan_changes(QueueSpec, incoming, current, unique=True)
+    assert changes == [
+        Change(Action.DELETE, _queue("undefined")),
+        Change(Action.UPDATE, incoming[1], _queue("changed")),
+        Change(Action.CREATE, incoming[2]),
+    ]
+    assert str(changes[1]) == (
+        "~ queue zocalo/changed (arguments: {'x-queue-type': 'quorum'}"
+        " -> {'x-queue-type': 'classic'})"
+    )
+
+
+def test_plan_changes_rejects_duplicates():
+    with pytest.raises(ValueError, match="duplicate queue"):
+        plan_changes(QueueSpec, [_queue("a"), _queue("a")], [], unique=True)
+    assert plan_changes(VHostSpec, [VHostSpec(name="a")] * 2, []) == [
+        Change(Action.CREATE, VHostSpec(name="a"))
+    ]
+
+
+def test_plan_changes_replaces_exchanges():
+    incoming = ExchangeSpec(name="foo", type="fanout", vhost="zocalo")
+    current = ExchangeInfo(name="foo", type="direct", vhost="zocalo")
+    default = ExchangeInfo(name="", type="direct", vhost="zocalo")
+    assert plan_changes(ExchangeSpec, [incoming], [current, default], replace=True) == [
+        Change(Action.DELETE, ExchangeSpec(name="foo", type="direct", vhost="zocalo")),
+        Change(Action.CREATE, incoming),
+    ]
+
+
+def test_plan_configuration_recreates_bindings_of_replaced_exchanges():
+    api = mock.Mock()
+    api.policies.return_value = []
+    api.exchanges.return_value = [
+        ExchangeInfo(name="ex", type="direct", vhost="zocalo"),
+        ExchangeInfo(name="other", type="direct", vhost="zocalo"),
+    ]
+    api.queues.return_value = [
+        _queue_info(
+            "foo",
+            arguments={"x-queue-type": "classic", "x-single-active-consumer": False},
+        )
+    ]
+    api.bindings.return_value = [
+        BindingSpec(
+            source=source,
+            destination="foo",
+            destination_type="q",
+            vhost="zocalo",
+            routing_key="foo",
+        )
+        for source in ("ex", "other")
+    ]
+    binding = {"destination": "foo", "vhost": "zocalo", "routing_key": "foo"}
+    changes = configure_rabbitmq.plan_configuration(
+        api,
+        {
+            "policies": [],
+            "exchanges": [
+                {"name": "ex", "type": "fanout", "vhost": "zocalo"},
+                {"name": "other", "type": "direct", "vhost": "zocalo"},
+            ],
+            "bindings": [
+                {"source": "ex", **binding},
+                {"source": "other", **binding},
+            ],
+            "groups": [{"names": ["foo"], "vhost": "zocalo", "bindings": []}],
+        },
+    )
+    assert [str(change) for change in changes] == [
+        "- exchange zocalo/ex",
+        "+ exchange zocalo/ex",
+        "+ binding zocalo/ex->foo (foo)",
+    ]
+
+
+def test_apply_changes_in_dependency_order():
+    binding = BindingSpec(
+        source="foo", destination="bar", destination_type="q", vhost="zocalo"
+    )
+    changes = [
+        Change(Action.CREATE, binding),
+        Change(Action.CREATE, _queue("bar")),
+        Change(Action.DELETE, _queue("baz")),
+        Change(Action.CREATE, VHostSpec(name="zocalo")),
+        Change(
+            Action.DELETE,
+            BindingSpec(
+                source="foo", destination="baz", destination_type="q", vhost="zocalo"
+            ),
+        ),
+    ]
+    api = mock.Mock()
+    configure_rabbitmq.apply_changes(api, changes, jobs=4)
+    assert api.apply_change.call_args_list == [
+        mock.call(changes[4]),
+        mock.call(changes[2]),
+        mock.call(changes[3]),
+        mock.call(changes[1]),
+        mock.call(changes[0]),
+    ]
+
+
+def test_apply_changes_dry_run(caplog):
+    api = mock.Mock()
+    with caplog.at_level("INFO"):
+        configure_rabbitmq.apply_changes(
+            api, [Change(Action.CREATE, _queue("bar"))], dry_run=True
+        )
+    api.apply_change.assert_not_called()
+    assert "+ queue zocalo/bar" in caplog.text
+
+
+def test_plan_configuration_ignores_bindings_to_temporary_queues():
+    api = mock.Mock()
+    api.policies.return_value = []
+    api.exchanges.return_value = []
+    api.queues.return_value = [
+        _queue_info("foo"),
+        _queue_info("amq.gen-1234", exclusive=True),
+    ]
+    api.bindings.return_value = [
+        BindingSpec(
+            source="bar",
+            destination="amq.gen-1234",
+            destination_type="q",
+            vhost="zocalo",
+            routing_key="amq.gen-1234",
+        ),
+        BindingSpec(
+            source="bar",
+            destination="foo",
+            destination_type="q",
+            vhost="zocalo",
+            routing_key="foo",
+        ),
+    ]
+    changes = configure_rabbitmq.plan_configuration(
+        api,
+        {
+            "policies": [],
+            "exchanges": [],
+            "groups": [{"names": ["foo"], "vhost": "zocalo", "bindings": []}],
+        },
+        jobs=2,
+    )
+    assert [str(change) for change in changes] == [
+        "~ queue zocalo/foo (arguments: {'x-queue-type': 'quorum'} -> {'x-queue-type': 'classic', 'x-single-active-consumer': False})",
+        "- binding zocalo/bar->foo (foo)",
+    ]
+
+
+def _write_user(path, username, password, tags="monitoring"):
+    path.write_text(
+        f"[rabbitmq]\nusername = {username}\npassword = {password}\ntags = {tags}\n"
+    )
+
+
+def _user(name, password, tags=("monitoring",)):
+    return UserSpec(
+        name=name,
+        password_hash=hash_password(password),
+        hashing_algorithm="rabbit_password_hashing_sha256",
+        tags=list(tags),
+    )
+
+
+def test_plan_users(tmp_path):
+    _write_user(tmp_path / "alice.ini", "alice", "secret")
+    _write_user(tmp_path / "bob.ini", "bob", "new-password")
+    (tmp_path / "team").mkdir()
+    _write_user(tmp_path / "team" / "carol.ini", "carol", "secret")
+    existing = [_user("alice", "secret"), _user("bob", "old"), _user("dave", "x")]
+
+    state = {}
+    changes = configure_rabbitmq._plan_users(existing, tmp_path, jobs=2, state=state)
+    assert [str(change) for change in changes] == [
+        "~ user bob (password_hash: changed)",
+        "+ user carol",
+        "- user dave",
+    ]
+    assert set(state) == {
+        str(tmp_path / name) for name in ("alice.ini", "bob.ini", "team/carol.ini")
+    }
+    assert state[str(tmp_path / "bob.ini")]["password_hash"] == (
+        changes[0].component.password_hash
+    )
+
+
+def test_plan_users_skips_unchanged_files(tmp_path, mocker):
+    _write_user(tmp_path / "alice.ini", "alice", "secret")
+    existing = [_user("alice", "secret")]
+    state = {}
+    assert configure_rabbitmq._plan_users(existing, tmp_path, state=state) == []
+
+    hash_password = mocker.patch.object(configure_rabbitmq, "hash_password")
+    assert configure_rabbitmq._plan_users(existing, tmp_path, state=state) == []
+    hash_password.assert_not_called()
+    assert list(state) == [str(tmp_path / "alice.ini")]
+
+    # Changing the file, or the user on the server, causes a full comparison
+    _write_user(tmp_path / "alice.ini", "alice", "secret", tags="management")
+    hash_password.return_value = existing[0].password_hash
+    changes = configure_rabbitmq._plan_users(existing, tmp_path, state=state)
+    assert [str(change) for change in changes] == [
+        "~ user alice (tags: ['monitoring'] -> ['management'])"
+    ]
+    hash_password.reset_mock()
+    existing = [_user("alice", "changed", tags=["management"])]
+    configure_rabbitmq._plan_users(existing, tmp_path, state=state)
+    hash_password.assert_called_once()
+
+
+def test_user_state_round_trip(tmp_path):
+    state_file = tmp_path / "users.state"
+    assert configure_rabbitmq.load_user_state(state_file) == {}
+    configure_rabbitmq.save_user_state(state_file, {"a.ini": {"sha256": "x"}})
+    assert configure_rabbitmq.load_user_state(state_file) == {"a.ini": {"sha256": "x"}}
+    assert stat.S_IMODE(state_file.stat().st_mode) == 0o600
+    state_file.write_text("garbage")
+    assert configure_rabbitmq.load_user_state(state_file) == {}
+
+
+def test_apply_changes_imports_users_in_bulk():
+    changes = [
+        Change(Action.CREATE, _user("alice", "secret")),
+        Change(Action.UPDATE, _user("bob", "secret")),
+        Change(Action.DELETE, _user("carol", "secret")),
+    ]
+    api = mock.Mock()
+    configure_rabbitmq.apply_changes(api, changes)
+    api.apply_change.assert_called_once_with(changes[2])
+    api.import_components.assert_called_once_with(
+        [changes[0].component, changes[1].component]
+    )
+
+
+def test_apply_changes_in_bulk():
+    queue = _queue("bar")
+    changes = [
+        Change(Action.CREATE, _user("alice", "secret")),
+        Change(Action.CREATE, queue),
+        Change(Action.DELETE, _queue("baz")),
+        Change(Action.UPDATE, VHostSpec(name="zocalo")),
+    ]
+    api = mock.Mock()
+    configure_rabbitmq.apply_changes(api, changes, jobs=4, bulk=True)
+    api.apply_change.assert_called_once_with(changes[2])
+    api.import_components.assert_called_once_with(
+        [changes[0].component, changes[3].component, queue]
+    )
+
+
+def test_import_components(requests_mock):
+    api = configure_rabbitmq.RabbitMQAPI("http://fake-uri/api", "guest", "guest")
+    requests_mock.post("/api/definitions", status_code=204)
+    api.import_components([_user("alice", "secret", tags=["a", "b"]), _queue("foo")])
+    definitions = requests_mock.last_request.json()
+    (user,) = definitions["users"]
+    assert user["name"] == "alice"
+    assert user["tags"] == "a,b"
+    assert [q["name"] for q in definitions["queues"]] == ["foo"]
+    assert definitions["bindings"] == []
+
+
+def test_plan_configuration_from_definitions():
+    api = mock.Mock()
+    api.definitions.return_value = Definitions(
+        queues=[_queue("foo"), _queue("bar")],
+        exchanges=[ExchangeSpec(name="", type="direct", vhost="zocalo")],
+    )
+    changes = configure_rabbitmq.plan_configuration(
+        api,
+        {
+            "policies": [],
+            "exchanges": [],
+            "groups": [{"names": ["foo"], "vhost": "zocalo", "bindings": []}],
+        },
+        bulk=True,
+    )
+    api.definitions.assert_called_once_with()
+    api.queues.assert_not_called()
+    assert [str(change) for change in changes] == [
+        "- queue zocalo/bar",
+        "~ queue zocalo/foo (arguments: {'x-queue-type': 'quorum'} -> {'x-queue-type': 'classic', 'x-single-active-consumer': False})",
+    ]
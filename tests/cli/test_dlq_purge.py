@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import sys
 from datetime import datetime
 from unittest import mock
@@ -8,6 +9,12 @@ import workflows.transport
 from workflows.transport.common_transport import CommonTransport
 
 import zocalo.cli.dlq_purge as dlq_purge
+from zocalo.util.dlq import (
+    ARCHIVE_INDEX,
+    DLQIndex,
+    is_dlq_archive,
+    read_dlq_archive,
+)
 
 
 def gen_header_activemq(i):
@@ -101,3 +108,69 @@ def test_dlq_purge_rabbitmq(mocker, tmp_path):
     dlq_dirs = list(tmp_path.iterdir())
     assert len(dlq_dirs) == 1
     assert len(list(dlq_dirs[0].glob("**/*"))) == 10
+
+
+def test_dlq_purge_rabbitmq_archive(mocker, tmp_path):
+    def mock_subscribe(source, receive_message, acknowledgement, prefetch_count):
+        assert prefetch_count == 4
+        for i in range(10):
+            header = gen_header_rabbitmq(i)
+            message = {
+                "foo": f"{i}",
+            }
+            receive_message(header, message)
+
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_transport().subscribe = mock_subscribe
+
+    testargs = [
+        "prog",
+        "--location",
+        str(tmp_path),
+        "--transport",
+        "PikaTransport",
+        "--archive",
+        "--compress",
+        "--archive-size",
+        "6",
+        "--prefetch",
+        "4",
+        "--wait",
+        "0.1",
+        "--index",
+        str(tmp_path / "index.sqlite"),
+        "garbage.per_image_analysis",
+    ]
+    with mock.patch.object(sys, "argv", testargs):
+        dlq_purge.run()
+
+    # Messages are acknowledged in bulk, up to the last message written
+    mocked_transport().ack.assert_has_calls(
+        [
+            mock.call(gen_header_rabbitmq(i, use_datetime=False), multiple=True)
+            for i in (3, 7, 9)
+        ]
+    )
+    assert mocked_transport().ack.call_count == 3
+
+    archives = sorted(f for f in tmp_path.iterdir() if is_dlq_archive(f))
+    assert len(archives) == 2
+    messages = [m for archive in archives for m in read_dlq_archive(archive)]
+    assert [m["message"] for m in messages] == [{"foo": f"{i}"} for i in range(10)]
+
+    index = [
+        json.loads(line) for line in (tmp_path / ARCHIVE_INDEX).read_text().splitlines()
+    ]
+    assert len(index) == 10
+    assert index[7]["archive"] == archives[1].name
+    assert index[7]["line"] == 1
+    assert index[7]["queue"] == "dlq.garbage.per_image_analysis"
+    assert index[7]["message-id"] == "ID:foo.bar.com-7"
+    assert index[7]["timestamp"] == (1633962302 + 30 * 7) * 1000
+
+    with DLQIndex(tmp_path / "index.sqlite") as dlqindex:
+        assert dlqindex.select() == {
+            str(archives[0]): list(range(6)),
+            str(archives[1]): list(range(4)),
+        }
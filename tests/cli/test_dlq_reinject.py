@@ -10,6 +10,8 @@ import workflows.transport
 from workflows.transport.common_transport import CommonTransport
 
 from zocalo.cli.dlq_reinject import run
+from zocalo.util.dlq import DLQArchiveWriter, DLQIndex
+from zocalo.util.rabbitmq import RabbitMQAPI
 
 
 def gen_header_activemq(i):
@@ -110,3 +112,113 @@ def test_dlq_reinject_rabbitmq(mocker, tmp_path):
             for i in range(10)
         ]
     )
+
+
+def test_dlq_reinject_rabbitmq_archive(mocker, tmp_path):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_api = mocker.patch.object(RabbitMQAPI, "from_zocalo_configuration")
+    mocked_api.return_value.get.return_value.json.return_value = [
+        {"name": "garbage.fanout", "type": "fanout"},
+        {"name": "garbage.direct", "type": "direct"},
+    ]
+
+    with DLQArchiveWriter(tmp_path, max_messages=4) as writer:
+        for i in range(10):
+            header = gen_header_rabbitmq(i, use_datetime=False)
+            header["x-death"][0]["exchange"] = (
+                "garbage.fanout" if i % 2 else "garbage.direct"
+            )
+            writer.write(
+                {"header": header, "message": {"foo": f"{i}"}},
+                queue="dlq.garbage.per_image_analysis",
+                message_id=header["message-id"],
+                timestamp=0,
+            )
+        archives = writer.archives
+    assert len(archives) == 3
+
+    testargs = [
+        "prog",
+        "--transport",
+        "PikaTransport",
+        "--threads",
+        "4",
+        "--rate",
+        "1000",
+        "--remove",
+    ] + [str(archive) for archive in archives]
+    with mock.patch.object(sys, "argv", testargs):
+        run()
+
+    mocked_transport().send.assert_has_calls(
+        [
+            mock.call("garbage.per_image_analysis", {"foo": f"{i}"}, headers=mock.ANY)
+            for i in range(0, 10, 2)
+        ],
+        any_order=True,
+    )
+    mocked_transport().broadcast.assert_has_calls(
+        [
+            mock.call("garbage.per_image_analysis", {"foo": f"{i}"}, headers=mock.ANY)
+            for i in range(1, 10, 2)
+        ],
+        any_order=True,
+    )
+    assert mocked_transport().send.call_count == 5
+    assert mocked_transport().broadcast.call_count == 5
+    # Exchange information is only requested once per run
+    mocked_api().get.assert_called_once_with("exchanges")
+    assert not any(archive.exists() for archive in archives)
+
+
+def test_dlq_reinject_selected_messages_from_index(mocker, tmp_path):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+
+    index = tmp_path / "index.sqlite"
+    with DLQIndex(index) as dlqindex:
+        with DLQArchiveWriter(tmp_path) as writer:
+            for i in range(10):
+                header = gen_header_rabbitmq(i, use_datetime=False)
+                message = {"foo": f"{i}", "parameters": {"ispyb_dcid": i % 3}}
+                path, line = writer.write(
+                    {"header": header, "message": message},
+                    queue="dlq.garbage.per_image_analysis",
+                    message_id=header["message-id"],
+                    timestamp=0,
+                )
+                dlqindex.add(
+                    {"header": header, "message": message}, path=path, line=line
+                )
+        archive = writer.archives[0]
+
+    testargs = [
+        "prog",
+        "--transport",
+        "PikaTransport",
+        "--index",
+        str(index),
+        "--dcid",
+        "1",
+        "--remove",
+    ]
+    with mock.patch.object(sys, "argv", testargs):
+        run()
+
+    mocked_transport().send.assert_has_calls(
+        [
+            mock.call(
+                "garbage.per_image_analysis",
+                {"foo": f"{i}", "parameters": {"ispyb_dcid": 1}},
+                headers=mock.ANY,
+            )
+            for i in (1, 4, 7)
+        ]
+    )
+    assert mocked_transport().send.call_count == 3
+    # The archive still contains other messages, so it is kept
+    assert archive.exists()
+    with DLQIndex(index) as dlqindex:
+        assert dlqindex.select(dcid=1) == {}
+        assert len(dlqindex.select()[str(archive)]) == 7
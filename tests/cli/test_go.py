@@ -1,7 +1,169 @@
 from __future__ import annotations
 
+import json
 import subprocess
+import sys
+from unittest import mock
+
+import pytest
+import workflows.transport
+from workflows.transport.common_transport import CommonTransport
+
+import zocalo.configuration
+from zocalo.cli import go
+from zocalo.util.outbox import Outbox
 
 
 def test_zocalo_go_help():
     subprocess.run("zocalo.go --help", check=True, shell=True)
+
+
+@pytest.fixture
+def zocalo_configuration(mocker, tmp_path):
+    zc = mocker.MagicMock(zocalo.configuration.Configuration)
+    zc.storage = {"zocalo.go.outbox": str(tmp_path / "outbox.sqlite")}
+    mocker.patch.object(zocalo.configuration, "from_file", return_value=zc)
+    return zc
+
+
+def test_zocalo_go_batch(mocker, capsys, tmp_path, zocalo_configuration):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    batchfile = tmp_path / "batch"
+    batchfile.write_text(
+        '# reprocessing\n3\n\n{"dcid": 4, "parameters": {"foo": "bar"}}\n'
+    )
+
+    argv = ["zocalo.go", "-r", "example", "--batch", str(batchfile), "1", "2"]
+    argv += ["--batch-size", "3"]
+    with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit) as e:
+        go.run()
+    assert e.value.code == 0
+
+    mocked_transport().send.assert_has_calls(
+        [
+            mock.call(
+                "processing_recipe",
+                {"recipes": ["example"], "parameters": {"ispyb_dcid": dcid}},
+                headers=mock.ANY,
+                transaction=mock.ANY,
+            )
+            for dcid in (1, 2, 3)
+        ]
+        + [
+            mock.call(
+                "processing_recipe",
+                {"recipes": ["example"], "parameters": {"foo": "bar", "ispyb_dcid": 4}},
+                headers=mock.ANY,
+                transaction=mock.ANY,
+            )
+        ]
+    )
+    assert mocked_transport().connect.call_count == 1
+    assert mocked_transport().transaction_commit.call_count == 2
+    output = capsys.readouterr().out
+    for dcid in (1, 2, 3, 4):
+        assert f"{dcid}: submitted" in output
+    assert not len(Outbox(tmp_path / "outbox.sqlite"))
+
+
+def test_zocalo_go_batch_defers_to_outbox(
+    mocker, capsys, tmp_path, zocalo_configuration
+):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_transport().transaction_commit.side_effect = [None, ConnectionError()]
+
+    argv = ["zocalo.go", "-r", "example", "--batch-size", "2", "1", "2", "3", "4"]
+    with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit) as e:
+        go.run()
+    assert e.value.code == 1
+
+    output = capsys.readouterr().out
+    assert "2: submitted" in output
+    assert "3: deferred, stored in local outbox" in output
+    outbox = Outbox(tmp_path / "outbox.sqlite")
+    assert [
+        item.message["parameters"]["ispyb_dcid"] for item in outbox.claim(force=True)
+    ] == [3, 4]
+
+
+def test_zocalo_go_retries_outbox_on_next_invocation(
+    mocker, capsys, tmp_path, zocalo_configuration
+):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_transport().connect.side_effect = [ConnectionError(), None]
+
+    with mock.patch.object(sys, "argv", ["zocalo.go", "-r", "example", "1"]):
+        go.run()
+    assert "Message stored in local outbox" in capsys.readouterr().out
+    assert len(Outbox(tmp_path / "outbox.sqlite")) == 1
+
+    with mock.patch.object(sys, "argv", ["zocalo.go", "--flush"]):
+        with pytest.raises(SystemExit):
+            go.run()
+    mocked_transport().send.assert_called_once_with(
+        "processing_recipe",
+        {"recipes": ["example"], "parameters": {"ispyb_dcid": 1}},
+        headers=mock.ANY,
+    )
+    assert not len(Outbox(tmp_path / "outbox.sqlite"))
+
+
+def test_zocalo_go_moves_undeliverable_messages_to_fallback_location(
+    mocker, capsys, tmp_path, zocalo_configuration
+):
+    fallback = tmp_path / "dropfiles"
+    fallback.mkdir()
+    zocalo_configuration.storage["zocalo.go.fallback_location"] = str(fallback)
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_transport().connect.side_effect = ConnectionError()
+
+    with mock.patch.object(sys, "argv", ["zocalo.go", "-r", "example", "1"]):
+        go.run()
+    argv = ["zocalo.go", "-r", "example", "2", "3"]
+    with mock.patch.object(sys, "argv", argv), pytest.raises(SystemExit):
+        go.run()
+
+    assert "3: deferred" in capsys.readouterr().out
+    assert not len(Outbox(tmp_path / "outbox.sqlite"))
+    dropfiles = [json.loads(f.read_text()) for f in fallback.iterdir()]
+    assert sorted(d["message"]["parameters"]["ispyb_dcid"] for d in dropfiles) == [
+        1,
+        2,
+        3,
+    ]
+
+
+def test_zocalo_go_defers_to_new_empty_outbox_and_flushes_it(
+    mocker, capsys, tmp_path, zocalo_configuration
+):
+    outbox_path = tmp_path / "outbox.sqlite"
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+
+    # An empty outbox is still an available outbox
+    with mock.patch.object(sys, "argv", ["zocalo.go", "--flush"]):
+        with pytest.raises(SystemExit) as e:
+            go.run()
+    assert e.value.code == 0
+    assert "Local outbox is empty" in capsys.readouterr().out
+    outbox_path.unlink()
+
+    mocked_transport().connect.side_effect = [ConnectionError(), None]
+    with mock.patch.object(sys, "argv", ["zocalo.go", "-r", "example", "1"]):
+        go.run()
+    assert f"Message stored in local outbox {outbox_path}" in capsys.readouterr().out
+    mocked_transport().send.assert_not_called()
+
+    with mock.patch.object(sys, "argv", ["zocalo.go", "--flush"]):
+        with pytest.raises(SystemExit) as e:
+            go.run()
+    assert e.value.code == 0
+    output = capsys.readouterr().out
+    assert "No local outbox available" not in output
+    assert "Sent 1 message(s) deferred by previous invocations" in output
+    assert "0 message(s) remaining in local outbox" in output
+    mocked_transport().send.assert_called_once()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import json
+import os
 import sys
 import time
 import uuid
@@ -59,7 +60,71 @@ def test_pickup_sends_to_processing_recipe(mocker, mock_zocalo_configuration, tm
                     "parameters": {"foo": i},
                 },
                 headers=mock.ANY,
+                transaction=mock.ANY,
             )
             for i in range(10)
         ]
     )
+    assert mocked_transport().transaction_commit.call_count == 10
+    assert not list(tmp_path.glob("[!.]*"))
+
+
+def test_pickup_sends_batches_and_resumes(mocker, mock_zocalo_configuration, tmp_path):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocker.patch.object(
+        zocalo.configuration, "from_file", return_value=mock_zocalo_configuration
+    )
+    for i in range(10):
+        msg = {
+            "headers": {"zocalo.go.user": "foobar", "zocalo.go.host": "example.com"},
+            "message": {"recipes": [f"thing{i}"], "parameters": {"foo": i}},
+        }
+        (tmp_path / f"msg{i}").write_text(json.dumps(msg))
+        os.utime(tmp_path / f"msg{i}", (1000 + i, 1000 + i))
+    (tmp_path / "broken").write_text("{")
+    os.utime(tmp_path / "broken", (2000, 2000))
+    # A previous run was interrupted after sending the first two messages
+    (tmp_path / pickup.JOURNAL).write_text("msg0\nmsg1\n")
+
+    with mock.patch.object(
+        sys,
+        "argv",
+        [
+            "prog",
+            "--wait",
+            "0",
+            "--rate",
+            "1000",
+            "--batch",
+            "3",
+            "--scan-threads",
+            "2",
+        ],
+    ):
+        pickup.run()
+    mocked_transport().send.assert_has_calls(
+        [
+            mock.call(
+                "processing_recipe",
+                {"recipes": [f"thing{i}"], "parameters": {"foo": i}},
+                headers=mock.ANY,
+                transaction=mock.ANY,
+            )
+            for i in range(2, 10)
+        ]
+    )
+    assert mocked_transport().send.call_count == 8
+    assert mocked_transport().transaction_commit.call_count == 3
+    assert [f.name for f in tmp_path.glob("[!.]*")] == ["broken"]
+    assert not (tmp_path / pickup.JOURNAL).exists()
+
+
+def test_scan_dropdir_in_parallel(tmp_path):
+    for i in range(25):
+        (tmp_path / f"msg{i}").touch()
+        os.utime(tmp_path / f"msg{i}", (1000 - i, 1000 - i))
+    (tmp_path / ".hidden").touch()
+    (tmp_path / "directory").mkdir()
+    files = pickup.scan_dropdir(tmp_path, threads=4, chunk_size=3)
+    assert [name for _, name in files] == [f"msg{i}" for i in reversed(range(25))]
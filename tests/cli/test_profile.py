@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from unittest import mock
+
+import pytest
+import workflows.transport
+from workflows.transport.common_transport import CommonTransport
+from workflows.util import generate_unique_host_id
+
+from zocalo.cli.profile import run
+
+
+def test_profile_hosts_and_services(mocker):
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocked_lookup = mocker.patch.object(
+        workflows.transport, "lookup", return_value=mocked_transport
+    )
+    host_prefix = ".".join(generate_unique_host_id().split(".")[:-2])
+    run(["ws987.6543", "-s", "Dispatcher", "--memory", "-d", "10"])
+    mocked_lookup.assert_called_with("PikaTransport")
+    request = {"command": "profile", "mode": "memory", "duration": 10}
+    mocked_transport().broadcast.assert_has_calls(
+        [
+            mock.call("command", {**request, "host": f"{host_prefix}.ws987.6543"}),
+            mock.call("command", {**request, "service": "Dispatcher"}),
+        ]
+    )
+
+
+def test_profile_requires_a_target(mocker):
+    mocker.patch.object(workflows.transport, "lookup")
+    with pytest.raises(SystemExit):
+        run([])
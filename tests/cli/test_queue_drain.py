@@ -2,10 +2,16 @@ from __future__ import annotations
 
 from unittest import mock
 
+import pytest
+import requests
+import workflows.recipe.wrapper
 import workflows.transport
 from workflows.transport.common_transport import CommonTransport
+from workflows.transport.pika_transport import PikaTransport
 
+import zocalo.cli.queue_drain as queue_drain
 from zocalo.cli.queue_drain import run
+from zocalo.util.rabbitmq import QueueInfo, RabbitMQAPI, ShovelInfo
 
 
 def test_queue_drain(mocker, capsys):
@@ -51,3 +57,136 @@ def test_queue_drain(mocker, capsys):
             for i in range(10)
         ]
     )
+
+
+def test_queue_drain_throughput_mode(mocker, capsys):
+    def mock_subscribe(source, receive_message, acknowledgement, prefetch_count):
+        assert prefetch_count == 8
+        for i in range(10):
+            header = {
+                "message-id": f"ID:foo.bar.com-{i}",
+                "timestamp": "1633102156582",
+            }
+            message = {
+                "recipe": {"1": {"queue": f"queue{i % 2}"}},
+                "recipe-pointer": 1,
+                "environment": {"ID": f"{i}"},
+                "payload": {},
+            }
+            receive_message(header, message)
+
+    mocked_transport = mocker.MagicMock(CommonTransport)
+    mocker.patch.object(workflows.transport, "lookup", return_value=mocked_transport)
+    mocked_transport().subscribe = mock_subscribe
+    recipe_wrapper = mocker.spy(workflows.recipe.wrapper, "RecipeWrapper")
+
+    run([".", ".", "--batch", "4", "--rate", "1000", "--stop", "0.5"])
+
+    captured = capsys.readouterr()
+    assert "10 message(s) drained, no message seen for" in captured.out
+    assert "Recipe ID" not in captured.out
+    assert recipe_wrapper.call_count == 10
+
+    mocked_transport().send.assert_has_calls(
+        [
+            mock.call(f"queue{i % 2}", mock.ANY, headers={}, transaction=mock.ANY)
+            for i in range(10)
+        ]
+    )
+    # Messages are moved in batches of up to 4 per transaction
+    assert mocked_transport().transaction_begin.call_count == 3
+    assert mocked_transport().transaction_commit.call_count == 3
+
+
+def test_queue_drain_shovel(mocker, capsys):
+    mocker.patch.object(queue_drain.time, "sleep")
+    mocked_api = mocker.patch.object(RabbitMQAPI, "from_zocalo_configuration")
+    rmq = mocked_api.return_value
+    rmq.queues.side_effect = [
+        QueueInfo(name="source", vhost="/", exclusive=False, messages=messages)
+        for messages in (100, 60, 0)
+    ]
+    rmq.shovel_delete.side_effect = requests.HTTPError(
+        response=mocker.Mock(status_code=404)
+    )
+    mocked_transport = mocker.patch.object(workflows.transport, "lookup")
+
+    run(["source", "destination", "--shovel", "--transport", "PikaTransport"])
+
+    shovel = rmq.shovel_declare.call_args.args[0]
+    assert shovel.src_queue == "source"
+    assert shovel.dest_queue == "destination"
+    assert shovel.src_delete_after == "queue-length"
+    rmq.shovel_delete.assert_called_once_with("/", shovel.name)
+    mocked_transport.assert_not_called()
+    assert "100 message(s) drained, 0 message(s) remaining" in capsys.readouterr().out
+
+
+def test_queue_drain_shovel_uses_selected_vhost(mocker):
+    mocker.patch.object(queue_drain.time, "sleep")
+    mocker.patch.dict(PikaTransport.config)
+    rmq = mocker.patch.object(RabbitMQAPI, "from_zocalo_configuration").return_value
+    rmq.queues.return_value = QueueInfo(
+        name="source", vhost="zocalo", exclusive=False, messages=0
+    )
+
+    run(
+        [
+            "source",
+            "destination",
+            "--shovel",
+            "--transport",
+            "PikaTransport",
+            "--rabbit-vhost",
+            "zocalo",
+        ]
+    )
+
+    assert rmq.shovel_declare.call_args.args[0].vhost == "zocalo"
+    rmq.queues.assert_called_with(vhost="zocalo", name="source")
+    rmq.shovel_delete.assert_called_once_with("zocalo", mocker.ANY)
+
+
+def test_queue_drain_shovel_requires_pika_transport(mocker):
+    mocked_api = mocker.patch.object(RabbitMQAPI, "from_zocalo_configuration")
+    with pytest.raises(SystemExit, match="PikaTransport"):
+        run(["source", "destination", "--shovel", "--transport", "StompTransport"])
+    mocked_api.assert_not_called()
+
+
+def _drain_while_publishing(mocker, depths, shovel_states):
+    mocker.patch.object(queue_drain.time, "sleep")
+    mocker.patch.object(
+        queue_drain.time, "time", side_effect=[10 * n for n in range(len(depths))]
+    )
+    rmq = mocker.patch.object(RabbitMQAPI, "from_zocalo_configuration").return_value
+    rmq.queues.side_effect = [
+        QueueInfo(name="source", vhost="/", exclusive=False, messages=messages)
+        for messages in depths
+    ]
+
+    def shovels(vhost):
+        shovel = rmq.shovel_declare.call_args.args[0]
+        state = shovel_states.pop(0)
+        if state is None:
+            return []
+        return [ShovelInfo(vhost=vhost, name=shovel.name, type="dynamic", state=state)]
+
+    rmq.shovels.side_effect = shovels
+    queue_drain.shovel_drain(mocker.Mock(), "source", "destination", stop=25)
+    return rmq
+
+
+def test_queue_drain_shovel_finishes_while_messages_are_published(mocker, capsys):
+    _drain_while_publishing(mocker, [100, 60, 70, 80], ["running", "running", None])
+    output = capsys.readouterr().out
+    assert "Shovel finished" in output
+    assert "20 message(s) drained, 80 message(s) remaining" in output
+
+
+def test_queue_drain_shovel_stops_when_queue_stops_shrinking(mocker, capsys):
+    rmq = _drain_while_publishing(
+        mocker, [100, 50, 60, 40, 45, 50, 55, 60], ["running"] * 7
+    )
+    assert rmq.queues.call_count == 7
+    assert "No progress for 25.0 seconds" in capsys.readouterr().out
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import logging
+import threading
+import time
 from unittest import mock
 
 import pytest
@@ -255,3 +257,182 @@ def test_downgrade_filter_leaves_high_level_messages_alone():
 
     assert record.levelname == "CRITICAL"
     assert record.levelno == logging.CRITICAL
+
+
+queued_configuration = """
+version: 1
+
+logsetup:
+  plugin: logging
+
+  handlers:
+    graylog:
+      (): zocalo.configuration.plugin_logging.GraylogTCPHandler
+      host: example.com
+      port: 1234
+    console:
+      class: logging.StreamHandler
+
+  root:
+    level: WARNING
+    handlers: [ graylog, console ]
+
+  queue: %s
+
+environments:
+  live:
+    - logsetup
+"""
+
+
+@pytest.mark.parametrize(
+    "queue_definition,settings",
+    [
+        ("true", {"names": ["graylog", "console"], "maxsize": 10000}),
+        (
+            "{ handlers: [ graylog ], size: 100, overflow: drop_old }",
+            {"names": ["graylog"], "maxsize": 100, "overflow": "drop_old"},
+        ),
+    ],
+)
+@mock.patch("zocalo.configuration.plugin_logging._queue_handlers")
+@mock.patch("zocalo.configuration.plugin_logging.logging")
+def test_plugin_sets_up_queued_handlers(
+    logging, _queue_handlers, queue_definition, settings
+):
+    zc = zocalo.configuration.from_string(queued_configuration % queue_definition)
+    zc.activate_environment("live")
+    (logconfig,), _ = logging.config.dictConfig.call_args
+    assert "queue" not in logconfig
+    _queue_handlers.assert_called_once_with(**{"overflow": "drop_new", **settings})
+
+
+@pytest.mark.parametrize(
+    "queue_definition",
+    [
+        "[ graylog ]",
+        "{ handlers: [ elsewhere ] }",
+        "{ size: 0 }",
+        "{ overflow: explode }",
+        "{ timeout: 5 }",
+    ],
+)
+@mock.patch("zocalo.configuration.plugin_logging.logging")
+def test_invalid_queue_definitions_are_rejected(logging, queue_definition):
+    zc = zocalo.configuration.from_string(queued_configuration % queue_definition)
+    with pytest.raises(zocalo.ConfigurationError, match="queue"):
+        zc.activate_environment("live")
+    logging.config.dictConfig.assert_not_called()
+
+
+class _GatedHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.gate.wait(5)
+        self.records.append(record)
+
+
+@pytest.mark.parametrize("overflow", ["drop_new", "drop_old"])
+def test_bounded_queue_handler_drops_records_when_full(overflow):
+    target = _GatedHandler()
+    handler = zocalo.configuration.plugin_logging.BoundedQueueHandler(
+        [target], maxsize=2, overflow=overflow
+    )
+    logger = logging.getLogger(f"zocalo.test.queue.{overflow}")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        start = time.monotonic()
+        for n in range(6):
+            try:
+                raise ValueError(n)
+            except ValueError:
+                logger.error("message %d", n, exc_info=True)
+            if n == 0:
+                # Wait for the first record to reach the blocked handler
+                while not handler.queue.empty():
+                    time.sleep(0.001)
+        # None of this waited for the blocked handler
+        assert time.monotonic() - start < 1
+        # One record is being emitted, two are queued, and three are dropped
+        assert handler.dropped == 3
+    finally:
+        target.gate.set()
+        logger.removeHandler(handler)
+        handler.close()
+
+    # Dropped records are reported before the next record is passed on
+    dropped = "Dropped 3 log records as the logging queue was full"
+    expected = {
+        "drop_new": ["message 0", dropped, "message 1", "message 2"],
+        "drop_old": ["message 0", dropped, "message 4", "message 5"],
+    }
+    assert [r.getMessage() for r in target.records] == expected[overflow]
+    assert target.records[0].exc_info[1].args == (0,)
+
+
+def test_bounded_queue_handler_blocks_when_full():
+    class SlowHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record):
+            time.sleep(0.01)
+            self.records.append(record.getMessage())
+
+    target = SlowHandler()
+    handler = zocalo.configuration.plugin_logging.BoundedQueueHandler(
+        [target], maxsize=2, overflow="block"
+    )
+    logger = logging.getLogger("zocalo.test.queue.block")
+    logger.propagate = False
+    logger.addHandler(handler)
+
+    def log_messages():
+        for n in range(20):
+            logger.warning("message %d", n)
+
+    thread = threading.Thread(target=log_messages, daemon=True)
+    try:
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+    finally:
+        logger.removeHandler(handler)
+        if not thread.is_alive():
+            # Closing waits for the queue to drain
+            handler.close()
+    assert handler.dropped == 0
+    assert target.records == [f"message {n}" for n in range(20)]
+
+
+def test_queue_handlers_replace_handlers_on_all_loggers():
+    target = _GatedHandler()
+    target.gate.set()
+    target.name = "zocalo-test-target"
+    parent = logging.getLogger("zocalo.test.replace")
+    child = logging.getLogger("zocalo.test.replace.child")
+    parent.propagate = child.propagate = False
+    parent.addHandler(target)
+    child.addHandler(target)
+    try:
+        zocalo.configuration.plugin_logging._queue_handlers(
+            ["zocalo-test-target"], maxsize=10, overflow="block"
+        )
+        (queued,) = parent.handlers
+        assert isinstance(
+            queued, zocalo.configuration.plugin_logging.BoundedQueueHandler
+        )
+        assert child.handlers == [queued]
+        parent.warning("hello")
+        child.warning("world")
+    finally:
+        parent.handlers.clear()
+        child.handlers.clear()
+        queued.close()
+    assert [r.getMessage() for r in target.records] == ["hello", "world"]
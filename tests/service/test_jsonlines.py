@@ -5,6 +5,7 @@ from unittest import mock
 from workflows.recipe.wrapper import RecipeWrapper
 from workflows.transport.offline_transport import OfflineTransport
 
+import zocalo.util.metrics
 from zocalo.service.jsonlines import JSONLines
 
 
@@ -49,3 +50,25 @@ def test_jsonlines(tmp_path):
 {"ham": 2, "spam": 3}
 """
     )
+
+
+def test_jsonlines_records_buffer_depth(tmp_path, monkeypatch):
+    monkeypatch.setattr(zocalo.util.metrics.REGISTRY, "enabled", True)
+    rw = RecipeWrapper(
+        message={
+            "recipe": {
+                "1": {"parameters": {"output_filename": str(tmp_path / "foo.json")}}
+            },
+            "recipe-pointer": 1,
+        },
+        transport=OfflineTransport(),
+    )
+    jsonlines = JSONLines()
+    jsonlines.transport = rw.transport
+    jsonlines.start()
+    depth = zocalo.util.metrics.REGISTRY.gauge("zocalo_jsonlines_buffered_messages", "")
+    for n in range(3):
+        jsonlines.receive_msg(rw, {"message-id": n + 1, "subscription": 1}, {"n": n})
+    assert depth._child()._value == 3
+    jsonlines.process_messages()
+    assert depth._child()._value == 0
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import pprint
 from unittest import mock
 
 import pytest
@@ -7,7 +8,7 @@ from workflows.recipe.wrapper import RecipeWrapper
 from workflows.transport.offline_transport import OfflineTransport
 
 import zocalo.configuration
-from zocalo.service.mailer import Mailer
+from zocalo.service.mailer import Mailer, _format_payload
 
 
 @pytest.fixture
@@ -77,3 +78,74 @@ header
 footer
 """
     )
+
+
+def test_mailer_only_renders_referenced_fields(
+    zocalo_configuration, mock_smtp_send_message, mocker
+):
+    message = {
+        "parameters": {
+            "recipients": "foo@example.com",
+            "subject": "This is a test email",
+        },
+        "content": "{payload[parameters][subject]} {unknown}",
+    }
+    mailer = Mailer()
+    mailer._environment = {"config": zocalo_configuration}
+    mailer.transport = OfflineTransport()
+    mailer.start()
+    format_payload = mocker.patch("zocalo.service.mailer._format_payload")
+    header = {
+        "message-id": mock.sentinel,
+        "subscription": mock.sentinel,
+    }
+    mailer.receive_msg(None, header, message)
+    format_payload.assert_not_called()
+    email_msg = mock_smtp_send_message.call_args[0][0]
+    assert email_msg.get_content() == "This is a test email {unknown}\n"
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"foo": "bar", "ham": ["spam"] * 100},
+        ["line one", "line two"] * 50,
+        "x" * 200,
+    ],
+)
+def test_format_payload_truncates_long_payloads(payload):
+    full = _format_payload(payload)
+    assert full == (
+        "\n".join(payload) if isinstance(payload, list) else pprint.pformat(payload)
+    )
+    assert _format_payload(payload, len(full)) == full
+
+    truncated = _format_payload(payload, 20)
+    assert truncated.startswith(full[:20])
+    assert truncated.endswith("\n[... payload truncated after 20 characters]")
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"foo": "bar", "ham": ["spam"] * 100, "eggs": {"x" * 50: list(range(30))}},
+        {"nested": [{"a": i, "b": "word " * i} for i in range(20)]},
+        ("tuple", {3, 2, 1}, frozenset({"b", "a"}), b"bytes" * 30),
+        {1: "one", "two": 2},
+    ],
+)
+def test_format_payload_truncated_output_matches_full_layout(payload):
+    full = pprint.pformat(payload)
+    for limit in range(1, len(full) + 20, 7):
+        assert _format_payload(payload, limit).startswith(full[:limit])
+
+
+def test_format_payload_only_formats_what_is_needed():
+    class Unprintable:
+        def __repr__(self):
+            raise AssertionError("payload formatted beyond the limit")
+
+    payload = {"data": list(range(100_000)) + [Unprintable()]}
+    truncated = _format_payload(payload, 100)
+    assert truncated.startswith(pprint.pformat({"data": list(range(100))})[:100])
+    assert truncated.endswith("\n[... payload truncated after 100 characters]")
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are slow to import and are not needed to start up the command
+# line tools. These must only be imported once they are actually used.
+HEAVY_MODULES = {
+    "pydantic",
+    "zocalo.util.rabbitmq",
+    "zocalo.util.slurm.models",
+}
+
+
+def import_profile(module: str) -> dict[str, int]:
+    """Import a module in a fresh interpreter and return the cumulative import
+    time in microseconds for every module that was loaded as a consequence."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            profile[name.strip()] = int(cumulative)
+    return profile
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "zocalo.cli.autoscale",
+        "zocalo.cli.dlq_check",
+        "zocalo.cli.dlq_purge",
+        "zocalo.cli.dlq_reinject",
+        "zocalo.cli.go",
+        "zocalo.cli.pickup",
+        "zocalo.cli.profile",
+        "zocalo.cli.queue_drain",
+        "zocalo.cli.queue_metrics",
+        "zocalo.cli.shutdown",
+        "zocalo.cli.wrap",
+        "zocalo.service",
+        "zocalo.util.slurm",
+    ],
+)
+def test_entry_points_do_not_import_heavy_modules(module):
+    profile = import_profile(module)
+    assert module in profile
+    slowest = sorted(profile.items(), key=lambda item: item[1], reverse=True)[:10]
+    assert not HEAVY_MODULES & set(profile), (
+        f"Slowest imports for {module} (cumulative microseconds): {slowest}"
+    )
+
+
+def test_slurm_models_are_loaded_on_demand():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, zocalo.util.slurm as slurm;"
+            "assert 'zocalo.util.slurm.models' not in sys.modules;"
+            "print(slurm.models.JobSubmitReq.__name__)",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert result.stdout.strip() == "JobSubmitReq"
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import threading
+import time
+from unittest import mock
+
+import pytest
+import workflows.services.common_service
+
+import zocalo.wrapper
+
+
+class StatusCollector:
+    def __init__(self):
+        self.messages = []
+        self._event = threading.Event()
+
+    def __call__(self, status):
+        self.messages.append(dict(status))
+        self._event.set()
+
+    def wait(self, timeout=5):
+        assert self._event.wait(timeout)
+        self._event.clear()
+
+
+def test_status_is_sent_on_start_and_on_change():
+    collector = StatusCollector()
+    st = zocalo.wrapper.StatusNotifications(collector, "task", interval=60)
+    collector.wait()
+    assert collector.messages[0]["task"] == "task"
+    assert collector.messages[0]["status"] == (
+        workflows.services.common_service.Status.STARTING.intval
+    )
+
+    st.set_status(workflows.services.common_service.Status.PROCESSING)
+    collector.wait()
+    assert len(collector.messages) == 2
+    assert collector.messages[1]["status"] == (
+        workflows.services.common_service.Status.PROCESSING.intval
+    )
+
+    # Shutting down must not wait for the next heartbeat
+    start = time.monotonic()
+    st.shutdown()
+    st.join(5)
+    assert not st.is_alive()
+    assert time.monotonic() - start < 5
+    assert len(collector.messages) == 2
+
+
+def test_status_heartbeat_is_sent_while_idle():
+    collector = StatusCollector()
+    st = zocalo.wrapper.StatusNotifications(collector, "task", interval=0.1, jitter=0.5)
+    for _ in range(3):
+        collector.wait()
+    st.shutdown()
+    st.join(5)
+    assert len({tuple(sorted(m.items())) for m in collector.messages}) == 1
+
+
+def test_status_changes_are_coalesced_and_sent_as_deltas():
+    collector = StatusCollector()
+    st = zocalo.wrapper.StatusNotifications(
+        collector, "task", interval=60, min_interval=0.2, delta=True
+    )
+    collector.wait()
+    st.taskname = "task (step 1)"
+    collector.wait()
+    st.taskname = "task (step 2)"
+    st.taskname = "task (step 3)"
+    st.set_status(workflows.services.common_service.Status.PROCESSING)
+    collector.wait()
+    st.shutdown()
+    st.join(5)
+
+    assert len(collector.messages) == 3
+    host = collector.messages[0]["host"]
+    assert collector.messages[1] == {
+        "host": host,
+        "delta": True,
+        "task": "task (step 1)",
+    }
+    assert collector.messages[2] == {
+        "host": host,
+        "delta": True,
+        "task": "task (step 3)",
+        "status": workflows.services.common_service.Status.PROCESSING.intval,
+        "statustext": workflows.services.common_service.Status.PROCESSING.description,
+    }
+
+
+def test_full_status_is_sent_while_status_keeps_changing():
+    collector = StatusCollector()
+    st = zocalo.wrapper.StatusNotifications(
+        collector, "task", interval=0.3, min_interval=0.05, delta=True
+    )
+    collector.wait()
+    deadline = time.monotonic() + 1
+    sample = 0
+    while time.monotonic() < deadline:
+        sample += 1
+        st.set_static_status_field("resources", {"sample": sample})
+        time.sleep(0.01)
+    st.shutdown()
+    st.join(5)
+
+    deltas = [m for m in collector.messages[1:] if m.get("delta")]
+    heartbeats = [m for m in collector.messages[1:] if not m.get("delta")]
+    assert deltas
+    assert len(heartbeats) >= 2
+    assert all(m["task"] == "task" and "resources" in m for m in heartbeats)
+
+
+def _mock_recipe_wrapper(result_batching=None):
+    recwrap = mock.Mock()
+    recwrap.environment = {"ID": "recipe-id"}
+    recwrap.recipe_step = {"wrapper": {}}
+    if result_batching:
+        recwrap.recipe_step["wrapper"]["result_batching"] = result_batching
+    return recwrap
+
+
+def _sent_results(recwrap):
+    return [
+        c.args[1]
+        for c in recwrap.send_to.call_args_list
+        if c.args[0] == "result-individual-file"
+    ]
+
+
+def test_results_are_sent_individually_by_default():
+    recwrap = _mock_recipe_wrapper()
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    for i in range(3):
+        wrapper.record_result_individual_file({"file": i})
+    assert _sent_results(recwrap) == [{"file": 0}, {"file": 1}, {"file": 2}]
+
+
+def test_results_are_batched_by_count_and_flushed_on_done():
+    recwrap = _mock_recipe_wrapper(result_batching={"count": 2})
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    for i in range(5):
+        wrapper.record_result_individual_file({"file": i})
+    assert _sent_results(recwrap) == [
+        {"batch": [{"file": 0}, {"file": 1}]},
+        {"batch": [{"file": 2}, {"file": 3}]},
+    ]
+    wrapper.done("Finished processing")
+    assert _sent_results(recwrap)[-1] == {"batch": [{"file": 4}]}
+    assert recwrap.send_to.call_args_list[-1] == mock.call(
+        "completed", "Finished processing"
+    )
+
+
+def test_results_are_batched_by_size():
+    recwrap = _mock_recipe_wrapper()
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    wrapper.set_result_batching(count=None, size=50)
+    for i in range(4):
+        wrapper.record_result_individual_file({"file": "x" * 20})
+    assert _sent_results(recwrap) == [{"batch": [{"file": "x" * 20}] * 2}] * 2
+
+
+def test_results_are_batched_by_time():
+    recwrap = _mock_recipe_wrapper()
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    wrapper.set_result_batching(count=None, interval=0.1)
+    wrapper.record_result_individual_file({"file": 0})
+    wrapper.record_result_individual_file({"file": 1})
+    assert _sent_results(recwrap) == []
+    time.sleep(0.5)
+    assert _sent_results(recwrap) == [{"batch": [{"file": 0}, {"file": 1}]}]
+
+
+def test_result_batching_can_be_enabled_with_defaults():
+    recwrap = _mock_recipe_wrapper(result_batching=True)
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    for i in range(101):
+        wrapper.record_result_individual_file({"file": i})
+    assert _sent_results(recwrap) == [{"batch": [{"file": i} for i in range(100)]}]
+
+    with pytest.raises(ValueError, match="result_batching"):
+        wrapper.set_recipe_wrapper(_mock_recipe_wrapper(result_batching="yes"))
+
+
+def test_batches_are_not_sent_concurrently_with_other_messages():
+    recwrap = _mock_recipe_wrapper()
+    sending = threading.Lock()
+    overlaps = []
+
+    def send_to(channel, payload):
+        if not sending.acquire(blocking=False):
+            overlaps.append((channel, payload))
+            return
+        time.sleep(0.001)
+        sending.release()
+
+    recwrap.send_to.side_effect = send_to
+    wrapper = zocalo.wrapper.BaseWrapper()
+    wrapper.set_recipe_wrapper(recwrap)
+    wrapper.set_result_batching(count=None, interval=0.001)
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        wrapper.record_result_individual_file({"file": 0})
+        wrapper.update("still running")
+    wrapper.done()
+    assert not overlaps
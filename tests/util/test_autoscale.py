@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import json
+from unittest import mock
+
+import pytest
+from workflows.services.common_service import CommonService
+
+from zocalo.util.autoscale import (
+    AutoscaleAdvisor,
+    ScalingPolicy,
+    ServiceStatusMonitor,
+)
+from zocalo.util.rabbitmq import QueueSummary
+
+
+def _queue(name, ready, consumers, publish, ack, vhost="zocalo"):
+    return QueueSummary(
+        name=name,
+        vhost=vhost,
+        messages_ready=ready,
+        consumers=consumers,
+        message_stats={"publish": publish, "ack": ack},
+    )
+
+
+def _status(service, busy):
+    return {
+        "host": f"{service}-{busy}",
+        "service": service,
+        "status": CommonService.SERVICE_STATUS_IDLE,
+        "utilization": {str(CommonService.SERVICE_STATUS_PROCESSING): busy},
+    }
+
+
+def test_advisor_scales_up_to_drain_backlog():
+    advisor = AutoscaleAdvisor(
+        {
+            "Cluster": ScalingPolicy(
+                queues=["cluster"], target_drain_time=100, max_instances=20
+            )
+        }
+    )
+    first = advisor.recommend([_queue("cluster", 1000, 2, 0, 0)], now=1000)
+    assert first[0].action == "hold"
+    assert first[0].reason == "throughput not yet known"
+
+    # Arrivals at 5/s, 2 instances processing 4/s in total, 2000 waiting
+    (recommendation,) = advisor.recommend(
+        [_queue("cluster", 2000, 2, 50, 40)], now=1010
+    )
+    assert recommendation.current == 2
+    assert recommendation.arrival_rate == 5
+    assert recommendation.processing_rate == 4
+    assert recommendation.drain_time is None
+    # (5 + 2000 / 100) / 2 per instance
+    assert recommendation.target == 13
+    assert recommendation.action == "scale_up"
+
+
+def test_advisor_respects_limits_and_steps():
+    advisor = AutoscaleAdvisor(
+        {
+            "Cluster": ScalingPolicy(
+                queues=["cluster"], target_drain_time=10, max_instances=8, max_step=3
+            )
+        }
+    )
+    advisor.recommend([_queue("cluster", 0, 2, 0, 0)], now=0)
+    (recommendation,) = advisor.recommend([_queue("cluster", 1000, 2, 0, 20)], now=10)
+    assert recommendation.target == 5
+
+    advisor = AutoscaleAdvisor(
+        {
+            "Cluster": ScalingPolicy(
+                queues=["cluster"], target_drain_time=10, max_instances=8
+            )
+        }
+    )
+    advisor.recommend([_queue("cluster", 0, 2, 0, 0)], now=0)
+    (recommendation,) = advisor.recommend([_queue("cluster", 1000, 2, 0, 20)], now=10)
+    assert recommendation.target == 8
+
+
+def test_advisor_holds_busy_services():
+    policies = {
+        "Dispatcher": ScalingPolicy(
+            queues=["processing_recipe"], min_instances=1, instance_rate=10
+        )
+    }
+    advisor = AutoscaleAdvisor(policies)
+    queues = [_queue("processing_recipe", 0, 4, 0, 0)]
+    busy = {"Dispatcher": [_status("Dispatcher", 0.9)] * 4}
+    idle = {"Dispatcher": [_status("Dispatcher", 0.1)] * 4}
+
+    (recommendation,) = advisor.recommend(queues, busy, now=0)
+    assert (recommendation.target, recommendation.action) == (4, "hold")
+    assert "busy" in recommendation.reason
+    (recommendation,) = advisor.recommend(queues, idle, now=0)
+    assert (recommendation.target, recommendation.action) == (1, "scale_down")
+
+
+def test_advisor_scales_down_idle_services():
+    advisor = AutoscaleAdvisor(
+        {"Dispatcher": ScalingPolicy(queues=["processing_recipe"], min_instances=1)}
+    )
+    idle = {"Dispatcher": [_status("Dispatcher", 0.05)] * 10}
+    advisor.recommend([_queue("processing_recipe", 0, 10, 0, 0)], idle, now=0)
+    # 10 instances, 5% busy, processing 1 msg/s as it arrives
+    (recommendation,) = advisor.recommend(
+        [_queue("processing_recipe", 0, 10, 10, 10)], idle, now=10
+    )
+    assert recommendation.processing_rate == 1
+    assert "at 2.00 msg/s per instance" in recommendation.reason
+    assert (recommendation.target, recommendation.action) == (1, "scale_down")
+
+
+def test_advisor_starts_services_with_backlog():
+    advisor = AutoscaleAdvisor({"Mailer": ScalingPolicy(queues=["mailnotification"])})
+    (recommendation,) = advisor.recommend(
+        [_queue("mailnotification", 3, 0, 10, 0)], instances={}
+    )
+    assert recommendation.target == 1
+    assert recommendation.action == "scale_up"
+    assert recommendation.backlog == 3
+    json.dumps(recommendation._asdict())
+
+
+def test_status_monitor():
+    transport = mock.Mock()
+    monitor = ServiceStatusMonitor(transport, expiry=30)
+    monitor.start()
+    transport.subscribe_broadcast.assert_called_once_with(
+        "transient.status", monitor.receive
+    )
+    monitor.receive({}, _status("Dispatcher", 0.5))
+    monitor.receive({}, json.dumps(_status("Mailer", 0.5)))
+    monitor.receive({}, {**_status("Mailer", 0.1), "status": 6})
+    monitor.receive({}, "garbage")
+    assert {
+        service: len(instances) for service, instances in monitor.instances().items()
+    } == {"Dispatcher": 1, "Mailer": 1}
+
+    with mock.patch("time.monotonic", return_value=10**9):
+        assert monitor.instances() == {}
+
+
+def test_policy_validation():
+    with pytest.raises(ValueError):
+        ScalingPolicy(queues=["a"], target_drain_time=0)
+    with pytest.raises(ValueError):
+        ScalingPolicy(queues=["a"], unknown=1)
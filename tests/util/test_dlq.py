@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import json
+
+from zocalo.util.dlq import (
+    DLQArchiveWriter,
+    DLQIndex,
+    IndexEntry,
+    is_dlq_archive,
+    read_dlq_archive,
+)
+
+
+def test_is_dlq_archive():
+    assert is_dlq_archive("dlq-20211011-120000-1-0000.jsonl")
+    assert is_dlq_archive("/some/path/dlq-20211011-120000-1-0000.jsonl.gz")
+    assert not is_dlq_archive("/some/path/index.jsonl")
+    assert not is_dlq_archive("msg-20211011-120000-000-ID_foo")
+
+
+def test_truncated_compressed_archive_is_read_up_to_last_sync(tmp_path):
+    writer = DLQArchiveWriter(tmp_path, compress=True)
+    for i in range(3):
+        writer.write(
+            {"header": {}, "message": i}, queue="q", message_id=str(i), timestamp=i
+        )
+    writer.sync()
+    writer.write({"header": {}, "message": 3}, queue="q", message_id="3", timestamp=3)
+    # Read the archive while it is still open, as if the writing process had
+    # been killed without closing it
+    archive = writer.archives[0]
+    assert [m["message"] for m in read_dlq_archive(archive)] == [0, 1, 2]
+    assert len((tmp_path / "index.jsonl").read_text().splitlines()) == 3
+
+
+def _recipe_message(i, dcid, recipes):
+    return {
+        "header": {
+            "x-death": [
+                {"time": 1633962302 + 30 * i, "queue": f"queue{i % 2}"},
+            ],
+            "message-id": f"ID:{i}",
+        },
+        "message": {
+            "recipe": {"1": {"parameters": {"ispyb_dcid": dcid}}},
+            "recipe-pointer": 1,
+            "environment": {"ID": f"guid-{i}"},
+            "recipes": recipes,
+            "payload": {},
+        },
+    }
+
+
+def test_dlq_index_selects_messages(tmp_path):
+    with DLQArchiveWriter(tmp_path) as writer:
+        for i in range(6):
+            writer.write(
+                _recipe_message(i, 100 + i // 3, ["a"] if i < 4 else ["a", "b"]),
+                queue="dlq",
+                message_id=str(i),
+                timestamp=0,
+            )
+    single = tmp_path / "msg-single"
+    single.write_text(json.dumps(_recipe_message(6, 100, ["b"])))
+
+    with DLQIndex(tmp_path / "index.sqlite") as index:
+        assert index.add_file(writer.archives[0]) == 6
+        assert index.add_file(single) == 1
+        # Re-indexing a file replaces existing entries
+        assert index.add_file(single) == 1
+
+        archive = str(writer.archives[0])
+        assert index.select(dcid=100) == {archive: [0, 1, 2], str(single): [0]}
+        assert index.select(queue="queue1", dcid=101) == {archive: [3, 5]}
+        assert index.select(guid="guid-4") == {archive: [4]}
+        assert index.select(recipe="b") == {archive: [4, 5], str(single): [0]}
+        assert index.select(
+            since=(1633962302 + 30) * 1000, until=(1633962302 + 90) * 1000
+        ) == {archive: [1, 2]}
+        assert index.select(recipe="a", paths=[single]) == {}
+
+        assert index.remove(archive, [0, 1]) == 4
+        assert index.select(dcid=100) == {archive: [2], str(single): [0]}
+        assert index.remove(single) == 0
+
+        assert (
+            index.add_many(
+                [
+                    IndexEntry(_recipe_message(7, 102, ["c"]), single, queue="other"),
+                    IndexEntry(_recipe_message(8, 102, ["c"]), archive, 2, timestamp=5),
+                ]
+            )
+            == 2
+        )
+        assert index.select(queue="other") == {str(single): [0]}
+        assert index.select(recipe="c", until=6) == {archive: [2]}
+        assert index.select(recipe="a", dcid=100) == {}
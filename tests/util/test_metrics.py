@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import pytest
+
+import zocalo.util.metrics
+from zocalo.service import ServiceFactory
+from zocalo.util.metrics import Registry, start_http_server
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry()
+    requests = registry.counter("requests", "Requests")
+    latency = registry.histogram("latency", "Latency", buckets=[1])
+    requests.inc()
+    latency.observe(0.5)
+    with latency.time():
+        pass
+    assert "requests_total 0.0" in registry.exposition()
+    assert 'latency_bucket{le="+Inf"} 0.0' in registry.exposition()
+
+
+def test_exposition():
+    registry = Registry()
+    registry.enabled = True
+    requests = registry.counter(
+        "requests_total", "Handled requests\nby outcome", ["outcome"]
+    )
+    requests.labels("ok").inc()
+    requests.labels(outcome="ok").inc(2)
+    requests.labels(outcome='bad"').inc()
+    depth = registry.gauge("depth", "Buffered messages")
+    depth.set(5)
+    depth.dec()
+    latency = registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1])
+    for value in (0.05, 0.5, 0.5, 3):
+        latency.observe(value)
+
+    assert registry.exposition() == (
+        "# TYPE depth gauge\n"
+        "# HELP depth Buffered messages\n"
+        "depth 4.0\n"
+        "# TYPE latency_seconds histogram\n"
+        "# HELP latency_seconds Latency\n"
+        'latency_seconds_bucket{le="0.1"} 1.0\n'
+        'latency_seconds_bucket{le="1.0"} 3.0\n'
+        'latency_seconds_bucket{le="+Inf"} 4.0\n'
+        "latency_seconds_count 4.0\n"
+        "latency_seconds_sum 4.05\n"
+        "# TYPE requests counter\n"
+        "# HELP requests Handled requests\\nby outcome\n"
+        'requests_total{outcome="bad\\""} 1.0\n'
+        'requests_total{outcome="ok"} 3.0\n'
+        "# EOF\n"
+    )
+
+
+def test_metric_validation():
+    registry = Registry()
+    registry.enabled = True
+    requests = registry.counter("requests", "Requests", ["outcome"])
+    assert registry.counter("requests_total", "Requests", ["outcome"]) is requests
+    with pytest.raises(ValueError):
+        registry.gauge("requests", "Requests")
+    with pytest.raises(ValueError):
+        requests.inc()
+    with pytest.raises(ValueError):
+        requests.labels("ok", "bad")
+    with pytest.raises(ValueError):
+        requests.labels(result="ok")
+    with pytest.raises(ValueError):
+        requests.labels("ok").inc(-1)
+    with pytest.raises(ValueError):
+        registry.histogram("latency", "Latency", ["le"])
+
+
+def test_http_endpoint():
+    registry = Registry()
+    registry.counter("requests", "Requests").inc()
+    server = start_http_server(0, registry=registry)
+    try:
+        assert registry.enabled
+        registry.counter("requests", "Requests").inc()
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers["Content-Type"] == zocalo.util.metrics.CONTENT_TYPE
+            assert "requests_total 1.0" in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/elsewhere")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_start_from_environment():
+    assert zocalo.util.metrics.start_from_environment({}) is None
+    assert zocalo.util.metrics.start_from_environment(None) is None
+    with mock.patch.object(zocalo.util.metrics, "start_http_server") as start:
+        environment = {"zocalo_metrics": {"port": 9100, "host": "0.0.0.0"}}
+        server = zocalo.util.metrics.start_from_environment(environment)
+        assert zocalo.util.metrics.start_from_environment(environment) is server
+        start.assert_called_once_with(9100, "0.0.0.0")
+    zocalo.util.metrics._server = None
+
+
+class _Service:
+    def __init__(self, environment):
+        self._environment = environment
+
+    def start(self, **kwargs):
+        self.started = kwargs
+
+
+def test_metrics_endpoint_is_started_for_every_service():
+    environment = {"zocalo_metrics": {"port": 9100}}
+    service = ServiceFactory(_Service)(environment=environment)
+    with mock.patch.object(zocalo.util.metrics, "start_from_environment") as start:
+        service.start(verbose_log=True)
+    start.assert_called_once_with(environment)
+    assert service.started == {"verbose_log": True}
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+from unittest import mock
+
+import pytest
+
+from zocalo.util import outbox as outbox_module
+from zocalo.util.outbox import Outbox
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(outbox_module.time, "time", lambda: now[0])
+    return now
+
+
+def test_outbox_sends_messages_in_order(tmp_path):
+    with Outbox(tmp_path / "outbox.sqlite") as outbox:
+        ids = outbox.put_many(({"n": i}, {"header": str(i)}) for i in range(5))
+        assert len(outbox) == 5
+        send = mock.Mock()
+        assert outbox.flush(send, batch_size=2) == ids
+        send.assert_has_calls(
+            [mock.call({"n": i}, {"header": str(i)}) for i in range(5)]
+        )
+        assert not len(outbox)
+
+
+def test_outbox_retries_failed_messages_with_backoff(tmp_path, clock):
+    outbox = Outbox(tmp_path / "outbox.sqlite", backoff=10)
+    first, second, third = outbox.put_many(({"n": i}, {}) for i in range(3))
+
+    send = mock.Mock(side_effect=[None, ConnectionError("broker down")])
+    with pytest.raises(ConnectionError):
+        outbox.flush(send)
+    assert len(outbox) == 2
+
+    # Failed messages are not due again until the backoff has passed,
+    # unless they are explicitly requested
+    send = mock.Mock()
+    new = outbox.put({"n": 3}, {})
+    assert outbox.flush(send, ids=[new]) == [new]
+    clock[0] += 10
+    with pytest.raises(ConnectionError):
+        outbox.flush(mock.Mock(side_effect=ConnectionError()))
+    clock[0] += 10
+    assert outbox.flush(send) == []
+    clock[0] += 10
+    assert outbox.flush(send) == [second, third]
+    assert not len(outbox)
+
+
+def test_outbox_messages_are_only_claimed_once(tmp_path):
+    Outbox(tmp_path / "outbox.sqlite").put({"n": 1}, {})
+    first = Outbox(tmp_path / "outbox.sqlite")
+    second = Outbox(tmp_path / "outbox.sqlite")
+    assert len(first.claim()) == 1
+    assert second.claim() == []
+    assert second.claim(force=True) == []
+
+
+def test_outbox_only_uses_write_ahead_logging_on_request(tmp_path):
+    with Outbox(tmp_path / "outbox.sqlite") as outbox:
+        assert outbox._db.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    with Outbox(tmp_path / "local.sqlite", wal=True) as outbox:
+        assert outbox._db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import pickle
+import signal
+import threading
+import time
+import tracemalloc
+from unittest import mock
+
+from zocalo.service import ServiceFactory
+from zocalo.util import profiler
+from zocalo.util.profiler import SIGNALS, ServiceProfiler, sample_stacks
+
+
+def _spin(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def test_sample_stacks():
+    stop = threading.Event()
+    thread = threading.Thread(target=_spin, args=(stop,), name="spinner")
+    thread.start()
+    try:
+        stacks = sample_stacks(0.1, interval=0.01)
+    finally:
+        stop.set()
+        thread.join()
+    spinning = [s for s in stacks if s.startswith("spinner;")]
+    assert spinning
+    assert all("_spin (test_profiler.py:" in s for s in spinning)
+    assert not any("sample_stacks" in s for s in stacks)
+
+
+def test_cpu_profile(tmp_path):
+    path = ServiceProfiler(tmp_path / "profiles").profile("cpu", 0.05)
+    assert path.parent == tmp_path / "profiles"
+    assert path.suffix == ".folded"
+    for line in path.read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+
+def test_memory_profile(tmp_path):
+    path = ServiceProfiler(tmp_path).profile("memory", 0.01)
+    assert path.read_text().startswith("Traced memory after 0.01 seconds")
+    snapshot = tracemalloc.Snapshot.load(str(path.with_suffix(".tracemalloc")))
+    assert snapshot.traceback_limit == 10
+    assert not tracemalloc.is_tracing()
+
+
+def test_only_one_profile_at_a_time(tmp_path):
+    service_profiler = ServiceProfiler(tmp_path)
+    thread = service_profiler.start("cpu", 0.1)
+    assert thread
+    assert service_profiler.start("memory", 0.1) is None
+    thread.join()
+    assert len(list(tmp_path.glob("*.folded"))) == 1
+    thread = service_profiler.start("memory", 0.01)
+    assert thread
+    thread.join()
+
+
+def test_requests_are_passed_to_the_service(tmp_path):
+    service_profiler = ServiceProfiler(tmp_path, default_duration=5)
+    frontend = mock.Mock()
+    with mock.patch.object(signal, "signal") as install_handler:
+        service_profiler.attach(frontend)
+    install_handler.assert_has_calls(
+        [mock.call(s, service_profiler._request_on_signal) for s in SIGNALS.values()]
+    )
+    service_profiler._request_on_signal(SIGNALS["memory"], None)
+    frontend.send_command.assert_called_once_with(
+        {"band": "profile", "payload": {"mode": "memory", "duration": 5}}
+    )
+
+
+class _Service:
+    def __init__(self, environment):
+        self._environment = environment
+        self.bands = {}
+
+    def _register(self, band, callback):
+        self.bands[band] = callback
+
+    def start(self, **kwargs):
+        self.started = kwargs
+
+
+def test_profiles_are_recorded_in_the_service_process(tmp_path):
+    service = ServiceFactory(_Service)(
+        environment={"zocalo_profiler": {"location": str(tmp_path)}}
+    )
+    # The process target must survive being sent to a spawned process
+    service = pickle.loads(pickle.dumps(service))
+    with mock.patch.object(signal, "signal") as install_handler:
+        service.start(verbose_log=True)
+    assert service.started == {"verbose_log": True}
+    assert install_handler.call_count == len(SIGNALS)
+    signal_handler = install_handler.call_args[0][1]
+    service_profiler = signal_handler.__self__
+
+    with mock.patch.object(service_profiler, "start") as start:
+        service.bands["profile"]({"mode": "memory", "duration": 10})
+        start.assert_called_once_with("memory", 10)
+        signal_handler(SIGNALS["cpu"], None)
+        start.assert_called_with("cpu", 30)
+        with mock.patch.object(profiler.logger, "warning") as warning:
+            service.bands["profile"]({"mode": "disk"})
+        warning.assert_called_once()
+        assert start.call_count == 2
+
+
+def test_profile_commands(tmp_path):
+    service_profiler = ServiceProfiler(tmp_path)
+    frontend = mock.Mock()
+    frontend.get_host_id.return_value = "uk.ac.diamond.ws123.4567"
+    frontend._service_class_name = "Dispatcher"
+    service_profiler.attach(frontend, "command")
+    frontend._transport.subscribe_broadcast.assert_called_once_with(
+        "command", service_profiler.process_command
+    )
+
+    with mock.patch.object(service_profiler, "request") as request:
+        for message in (
+            {"command": "shutdown", "service": "Dispatcher"},
+            {"command": "profile"},
+            {"command": "profile", "service": "Mailer"},
+            {"command": "profile", "host": "uk.ac.diamond.ws123.4567", "service": "X"},
+            "profile",
+        ):
+            service_profiler.process_command({}, message)
+        request.assert_not_called()
+
+        service_profiler.process_command(
+            {}, {"command": "profile", "service": "Dispatcher"}
+        )
+        request.assert_called_once_with("cpu", 30)
+        service_profiler.process_command(
+            {},
+            {
+                "command": "profile",
+                "host": "uk.ac.diamond.ws123.4567",
+                "mode": "memory",
+                "duration": 10,
+            },
+        )
+        request.assert_called_with("memory", 10)
+
+    with mock.patch.object(profiler.logger, "warning") as warning:
+        service_profiler.process_command(
+            {}, {"command": "profile", "service": "Dispatcher", "mode": "disk"}
+        )
+    warning.assert_called_once()
+
+
+def test_request_without_service(tmp_path):
+    service_profiler = ServiceProfiler(tmp_path)
+    assert service_profiler.request("cpu") is False
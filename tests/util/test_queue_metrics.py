@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import math
+import threading
+from unittest import mock
+
+import pytest
+import requests
+
+from zocalo.util import queue_metrics
+from zocalo.util.queue_metrics import (
+    FIELDS,
+    QueueMetricsStore,
+    SeriesFile,
+    Tier,
+)
+from zocalo.util.rabbitmq import QueueSummary
+
+
+def _values(messages=0, publish=None, consumers=1):
+    values = dict.fromkeys(FIELDS)
+    values.update(messages=messages, publish=publish, consumers=consumers)
+    return [values[field] for field in FIELDS]
+
+
+def test_series_file_ring_buffer(tmp_path):
+    series = SeriesFile(tmp_path / "q.zqm", tiers=[Tier(0, 4), Tier(10, 3)], nfields=2)
+    for t in range(8):
+        series.append(100 + 3 * t, [t, None])
+
+    assert [s.timestamp for s in series.samples(0)] == [112, 115, 118, 121]
+    # Only the latest sample in every 10 second interval is kept
+    assert [s.timestamp for s in series.samples(1)] == [109, 118, 121]
+    assert series.samples(0)[-1].values[0] == 7
+    assert math.isnan(series.samples(0)[-1].values[1])
+    series.close()
+
+    # The file keeps its tiers and samples when reopened
+    series = SeriesFile(tmp_path / "q.zqm")
+    assert series.tiers == (Tier(0, 4), Tier(10, 3))
+    assert [s.timestamp for s in series.samples(1)] == [109, 118, 121]
+    with pytest.raises(ValueError):
+        series.append(200, [1, 2, 3])
+    series.close()
+
+    (tmp_path / "garbage.zqm").write_bytes(b"garbage" * 10)
+    with pytest.raises(ValueError):
+        SeriesFile(tmp_path / "garbage.zqm")
+
+
+def test_queue_metrics_queries(tmp_path):
+    store = QueueMetricsStore(tmp_path, tiers=[Tier(0, 100), Tier(60, 10)])
+    for t in range(50):
+        # A steady publish rate of 2 messages per second, with a counter reset
+        publish = 20 * t if t < 30 else 20 * (t - 30)
+        depth = 1000 if t == 40 else 10
+        store.append("zocalo", "foo", 1000 + 10 * t, _values(depth, publish))
+
+    assert store.queues() == [("zocalo", "foo")]
+    metrics = store.metrics("zocalo", "foo")
+    assert metrics.rate("publish") == pytest.approx(2 * 48 / 49)
+    assert {v for _, v in metrics.series("publish")} == {2.0}
+    assert metrics.percentile("messages", 50) == 10
+    assert metrics.percentile("messages", 100) == 1000
+    assert metrics.anomalies("messages") == [(1400, 1000, mock.ANY)]
+    assert metrics.series("messages", since=1450, until=1470) == [
+        (1450, 10),
+        (1460, 10),
+        (1470, 10),
+    ]
+    with pytest.raises(ValueError):
+        metrics.rate("messages")
+
+    summary = metrics.summary()
+    assert summary["samples"] == 50
+    assert summary["messages"] == 10
+    assert summary["consumers"] == 1
+    assert summary["anomalies"] == 1
+    assert summary["ack_rate"] is None
+    store.close()
+
+
+def test_queue_metrics_use_coarser_tiers_for_longer_periods(tmp_path):
+    store = QueueMetricsStore(tmp_path, tiers=[Tier(0, 10), Tier(60, 100)])
+    for t in range(100):
+        store.append("/", "foo", 6000 + 30 * t, _values(t))
+    metrics = store.metrics("/", "foo")
+    assert len(metrics.series("messages", since=8700)) == 10
+    assert len(metrics.series("messages", since=6000)) == 50
+    with pytest.raises(KeyError):
+        store.metrics("/", "bar")
+    store.close()
+
+
+def test_store_limits_open_files(tmp_path):
+    store = QueueMetricsStore(tmp_path, tiers=[Tier(0, 10)], max_open=2)
+    store.append("/", "q0", 1000, _values(5))
+    metrics = store.metrics("/", "q0")
+    for n in range(1, 5):
+        store.append("/", f"q{n}", 1000, _values(n))
+    assert list(store._files) == [("/", "q3"), ("/", "q4")]
+    assert metrics._series._mmap is None
+
+    # Evicted files are opened again when used
+    assert metrics.series("messages") == [(1000, 5)]
+    store.append("/", "q1", 1010, _values(10))
+    assert list(store._files) == [("/", "q4"), ("/", "q1")]
+    assert store.metrics("/", "q1").series("messages") == [(1000, 1), (1010, 10)]
+    metrics._series.close()
+    store.close()
+
+
+def test_collect(tmp_path):
+    api = mock.Mock()
+    api.iter_queues.return_value = [
+        QueueSummary(
+            name="foo/bar",
+            vhost="/",
+            messages=5,
+            consumers=2,
+            message_stats={"publish": 100, "ack": 90},
+        ),
+        QueueSummary(name="baz", vhost="zocalo", messages=0),
+    ]
+    store = QueueMetricsStore(tmp_path)
+    assert queue_metrics.collect(api, store, pattern="^foo", timestamp=1000) == 2
+    api.iter_queues.assert_called_once_with(
+        None, pattern="^foo", use_regex=False, columns=queue_metrics.COLUMNS
+    )
+    assert store.queues() == [("/", "foo/bar"), ("zocalo", "baz")]
+    (sample,) = store.metrics("/", "foo/bar")._series.samples()
+    values = dict(zip(FIELDS, sample.values))
+    assert values["messages"] == 5
+    assert values["publish"] == 100
+    assert values["ack"] == 90
+    assert math.isnan(values["deliver_get"])
+    store.close()
+
+
+def test_run_collector_continues_after_api_errors(tmp_path, caplog):
+    stop = threading.Event()
+    polls = iter(
+        [
+            requests.ConnectionError("Connection refused"),
+            [QueueSummary(name="foo", vhost="/", messages=5)],
+        ]
+    )
+
+    def iter_queues(*args, **kwargs):
+        result = next(polls)
+        if isinstance(result, Exception):
+            raise result
+        stop.set()
+        return result
+
+    api = mock.Mock()
+    api.iter_queues.side_effect = iter_queues
+    store = QueueMetricsStore(tmp_path)
+    queue_metrics.run_collector(api, store, 0, stop=stop)
+    assert api.iter_queues.call_count == 2
+    assert "Connection refused" in caplog.text
+    assert store.queues() == [("/", "foo")]
+    store.close()
@@ -3,6 +3,7 @@ from __future__ import annotations
 import re
 
 import pytest
+import requests
 
 import zocalo.configuration
 import zocalo.util.rabbitmq as rabbitmq
@@ -68,6 +69,68 @@ def test_api_health_checks_failures(requests_mock, rmqapi):
         assert v == expected_json
 
 
+def test_api_run_health_checks(requests_mock, rmqapi):
+    requests_mock.get(re.compile("/health/checks/"), json={"status": "ok"})
+    requests_mock.get(
+        re.compile("/health/checks/virtual-hosts"), exc=requests.exceptions.ReadTimeout
+    )
+    results = rmqapi.run_health_checks(timeout=1)
+    assert len(results) == 8
+    assert all(result.duration >= 0 for result in results)
+    failed = [result for result in results if not result.ok]
+    assert len(failed) == 1
+    assert failed[0].check == "health/checks/virtual-hosts"
+    assert failed[0].result["status"] == "failed"
+    assert all(request.timeout == 1 for request in requests_mock.request_history)
+
+    # Results are cached briefly
+    assert rmqapi.run_health_checks() == results
+    assert requests_mock.call_count == 8
+
+
+def test_api_cluster_health_checks(requests_mock, zocalo_configuration):
+    zocalo_configuration.rabbitmqapi = {
+        **zocalo_configuration.rabbitmqapi,
+        "base_url": "http://node1:12345/api,http://node2:12345/api",
+    }
+    requests_mock.get(re.compile("node1.*/health/checks/"), json={"status": "ok"})
+    requests_mock.get(
+        re.compile("node2.*/health/checks/"), exc=requests.ConnectionError
+    )
+    results = rabbitmq.RabbitMQAPI.cluster_health_checks(zocalo_configuration)
+    assert list(results) == ["http://node1:12345/api", "http://node2:12345/api"]
+    assert all(result.ok for result in results["http://node1:12345/api"])
+    assert not any(result.ok for result in results["http://node2:12345/api"])
+
+
+def test_api_health_checks_are_not_retried(requests_mock, zocalo_configuration, mocker):
+    mocker.patch.object(rabbitmq, "_healthy_endpoints", {})
+    zocalo_configuration.rabbitmqapi = {
+        **zocalo_configuration.rabbitmqapi,
+        "retries": 3,
+        "timeout": 7,
+    }
+    requests_mock.get(re.compile("/health/checks/"), json={"status": "ok"})
+    api = rabbitmq.RabbitMQAPI.from_zocalo_configuration(zocalo_configuration)
+    url = zocalo_configuration.rabbitmqapi["base_url"]
+    assert api._session.get_adapter(url).max_retries.total == 3
+    assert api._probe_session.get_adapter(url).max_retries.total == 0
+    assert requests_mock.last_request.timeout == 7
+
+    session_get = mocker.spy(api._session, "get")
+    probe_get = mocker.spy(api._probe_session, "get")
+    api.run_health_checks()
+    session_get.assert_not_called()
+    assert probe_get.call_count == 8
+
+    # Nodes of the cluster are checked with the configured options
+    init = mocker.spy(rabbitmq.RabbitMQAPI, "__init__")
+    rabbitmq.RabbitMQAPI.cluster_health_checks(zocalo_configuration)
+    init.assert_called_once_with(
+        mocker.ANY, url=url, user="carrots", password="carrots", retries=3, timeout=7
+    )
+
+
 def test_api_queues(requests_mock, rmqapi):
     queue = {
         "consumers": 0,
@@ -496,6 +559,158 @@ def test_api_vhosts(requests_mock, rmqapi):
     assert rmqapi.vhost("foo") == rabbitmq.VHostSpec(**vhosts[0])
 
 
+DEFINITIONS = {
+    "rabbit_version": "3.12.4",
+    "rabbitmq_version": "3.12.4",
+    "users": [
+        {
+            "name": "guest",
+            "password_hash": "G1w0oIh4YgNxkkNGKkZ+6MiqozVgEswg9tiHr/NAUxHXzoB4",
+            "hashing_algorithm": "rabbit_password_hashing_sha256",
+            "tags": ["administrator"],
+            "limits": {},
+        },
+        {
+            "name": "zocalo",
+            "password_hash": "G1w0oIh4YgNxkkNGKkZ+6MiqozVgEswg9tiHr/NAUxHXzoB4",
+            "hashing_algorithm": "rabbit_password_hashing_sha256",
+            "tags": "monitoring,management",
+        },
+    ],
+    "vhosts": [
+        {"name": "/"},
+        {
+            "name": "zocalo",
+            "metadata": {"description": "Zocalo", "tags": ["ham"]},
+            "limits": [],
+        },
+    ],
+    "permissions": [
+        {
+            "user": "zocalo",
+            "vhost": "zocalo",
+            "configure": ".*",
+            "write": ".*",
+            "read": ".*",
+        }
+    ],
+    "topic_permissions": [],
+    "parameters": [],
+    "global_parameters": [{"name": "cluster_name", "value": "rabbit@pooh"}],
+    "policies": [
+        {
+            "vhost": "zocalo",
+            "name": "bar",
+            "pattern": "^amq.",
+            "apply-to": "queues",
+            "definition": {"delivery-limit": 5},
+            "priority": 0,
+        }
+    ],
+    "queues": [
+        {
+            "name": "foo",
+            "vhost": "zocalo",
+            "durable": True,
+            "auto_delete": False,
+            "arguments": {"x-queue-type": "quorum"},
+        }
+    ],
+    "exchanges": [
+        {
+            "name": "delayed",
+            "vhost": "zocalo",
+            "type": "x-delayed-message",
+            "durable": True,
+            "auto_delete": False,
+            "internal": False,
+            "arguments": {"x-delayed-type": "direct"},
+        }
+    ],
+    "bindings": [
+        {
+            "source": "delayed",
+            "vhost": "zocalo",
+            "destination": "foo",
+            "destination_type": "queue",
+            "routing_key": "foo",
+            "arguments": {},
+        }
+    ],
+}
+
+
+def test_api_definitions(requests_mock, rmqapi):
+    requests_mock.get("/api/definitions", json=DEFINITIONS)
+    definitions = rmqapi.definitions()
+    assert [u.tags for u in definitions.users] == [
+        ["administrator"],
+        ["monitoring", "management"],
+    ]
+    assert definitions.vhosts[1] == rabbitmq.VHostSpec(
+        name="zocalo", description="Zocalo", tags=["ham"]
+    )
+    assert definitions.permissions[0].user == "zocalo"
+    assert definitions.policies[0].apply_to == "queues"
+    assert definitions.queues == [rabbitmq.QueueSpec(**DEFINITIONS["queues"][0])]
+    assert definitions.exchanges[0].type == "x-delayed-message"
+    assert definitions.bindings[0].destination_type == rabbitmq.DestinationType.QUEUE
+    assert definitions.global_parameters == DEFINITIONS["global_parameters"]
+
+    # Definitions exported for a single vhost leave out the vhost of each item
+    per_vhost = {
+        key: [
+            {k: v for k, v in item.items() if k != "vhost"}
+            for item in DEFINITIONS[key]
+            if item["vhost"] == "zocalo"
+        ]
+        for key in ("policies", "queues", "exchanges", "bindings")
+    }
+    requests_mock.get("/api/definitions/zocalo", json=per_vhost)
+    definitions = rmqapi.definitions(vhost="zocalo")
+    assert definitions.queues == [rabbitmq.QueueSpec(**DEFINITIONS["queues"][0])]
+    assert definitions.policies[0].vhost == "zocalo"
+    assert definitions.exchanges[0].vhost == "zocalo"
+    assert definitions.bindings[0].vhost == "zocalo"
+
+
+def test_api_import_definitions(requests_mock, rmqapi):
+    requests_mock.get("/api/definitions", json=DEFINITIONS)
+    requests_mock.post("/api/definitions", status_code=204)
+    rmqapi.import_definitions(rmqapi.definitions())
+    history = requests_mock.request_history[-1]
+    assert history.method == "POST"
+    exported = history.json()
+    assert exported["users"][1]["tags"] == "monitoring,management"
+    assert exported["vhosts"][1] == {
+        "name": "zocalo",
+        "tracing": False,
+        "limits": [],
+        "metadata": {"description": "Zocalo", "tags": ["ham"]},
+    }
+    assert exported["policies"] == DEFINITIONS["policies"]
+    assert exported["queues"] == DEFINITIONS["queues"]
+    assert exported["exchanges"] == DEFINITIONS["exchanges"]
+    assert exported["bindings"] == DEFINITIONS["bindings"]
+    assert exported["global_parameters"] == DEFINITIONS["global_parameters"]
+
+    definitions = rabbitmq.Definitions(
+        vhosts=[rabbitmq.VHostSpec(name="traced", tracing=True)]
+    )
+    rmqapi.import_definitions(definitions)
+    assert requests_mock.last_request.json()["vhosts"] == [
+        {
+            "name": "traced",
+            "tracing": True,
+            "metadata": {"description": "", "tags": []},
+        }
+    ]
+
+    requests_mock.post("/api/definitions/zocalo", status_code=204)
+    rmqapi.import_definitions(rabbitmq.Definitions(), vhost="zocalo")
+    assert requests_mock.last_request.url.endswith("/api/definitions/zocalo")
+
+
 @pytest.fixture
 def vhost_spec():
     return rabbitmq.VHostSpec(
@@ -579,3 +794,198 @@ def test_api_clear_policy(requests_mock, rmqapi, policy_spec):
     history = requests_mock.request_history[0]
     assert history.method == "DELETE"
     assert history.url.endswith("/api/policies/foo/bar/")
+
+
+@pytest.fixture
+def shovel_spec():
+    return rabbitmq.ShovelSpec(
+        vhost="zocalo",
+        name="move",
+        src_queue="source",
+        dest_queue="destination",
+        src_delete_after="queue-length",
+    )
+
+
+def test_api_shovels(requests_mock, rmqapi):
+    requests_mock.get(
+        "/api/shovels/zocalo",
+        json=[
+            {
+                "node": "rabbit@node",
+                "timestamp": "2021-10-11 14:25:02",
+                "name": "move",
+                "vhost": "zocalo",
+                "type": "dynamic",
+                "state": "running",
+            }
+        ],
+    )
+    assert rmqapi.shovels(vhost="zocalo") == [
+        rabbitmq.ShovelInfo(
+            vhost="zocalo", name="move", type="dynamic", state="running"
+        )
+    ]
+
+
+def test_api_shovel_declare(requests_mock, rmqapi, shovel_spec):
+    requests_mock.put("/api/parameters/shovel/zocalo/move")
+    rmqapi.shovel_declare(shovel_spec)
+    assert requests_mock.call_count == 1
+    history = requests_mock.request_history[0]
+    assert history.method == "PUT"
+    assert history.json() == {
+        "value": {
+            "src-protocol": "amqp091",
+            "src-uri": "amqp://",
+            "src-queue": "source",
+            "src-delete-after": "queue-length",
+            "dest-protocol": "amqp091",
+            "dest-uri": "amqp://",
+            "dest-queue": "destination",
+            "ack-mode": "on-confirm",
+        }
+    }
+
+
+def test_api_shovel_delete(requests_mock, rmqapi):
+    requests_mock.delete("/api/parameters/shovel/zocalo/move")
+    rmqapi.shovel_delete(vhost="zocalo", name="move")
+    assert requests_mock.call_count == 1
+    assert requests_mock.request_history[0].method == "DELETE"
+
+
+def test_api_remembers_healthy_endpoint(requests_mock, zocalo_configuration, mocker):
+    mocker.patch.object(rabbitmq, "_healthy_endpoints", {})
+    zocalo_configuration.rabbitmqapi = {
+        **zocalo_configuration.rabbitmqapi,
+        "base_url": "http://node1:12345/api,http://node2:12345/api",
+    }
+    requests_mock.get(
+        "http://node1:12345/api/health/checks/alarms",
+        exc=requests.ConnectionError,
+    )
+    requests_mock.get(
+        "http://node2:12345/api/health/checks/alarms", json={"status": "ok"}
+    )
+    api = rabbitmq.RabbitMQAPI.from_zocalo_configuration(zocalo_configuration)
+    assert api._url == "http://node2:12345/api"
+    assert requests_mock.call_count == 2
+
+    # The healthy endpoint is reused without checking all endpoints again
+    api = rabbitmq.RabbitMQAPI.from_zocalo_configuration(zocalo_configuration)
+    assert api._url == "http://node2:12345/api"
+    assert requests_mock.call_count == 2
+
+    # Once it is due to be checked again, it is checked first
+    mocker.patch.object(rabbitmq.RabbitMQAPI, "healthy_endpoint_ttl", 0)
+    api = rabbitmq.RabbitMQAPI.from_zocalo_configuration(zocalo_configuration)
+    assert api._url == "http://node2:12345/api"
+    assert requests_mock.call_count == 3
+
+
+def test_api_caches_responses(requests_mock, mocker):
+    api = rabbitmq.RabbitMQAPI(
+        "http://rabbitmq:12345/api", "user", "password", cache_ttl=60, timeout=5
+    )
+    requests_mock.get(
+        "/api/queues", json=[], headers={"ETag": '"abc"'}, status_code=200
+    )
+    assert api.get("queues").json() == []
+    assert api.get("queues").json() == []
+    assert requests_mock.call_count == 1
+    assert requests_mock.request_history[0].timeout == 5
+
+    # Other parameters are cached separately
+    api.get("queues", params={"page": 1})
+    assert requests_mock.call_count == 2
+
+    # Expired responses are revalidated
+    clock = mocker.patch.object(rabbitmq.time, "monotonic")
+    clock.return_value = 10**9
+    requests_mock.get("/api/queues", status_code=304)
+    assert api.get("queues").json() == []
+    assert requests_mock.call_count == 3
+    assert requests_mock.last_request.headers["If-None-Match"] == '"abc"'
+
+    # Modifications clear the cache
+    requests_mock.put("/api/queues/zocalo/foo")
+    requests_mock.get("/api/queues", json=[{"name": "foo"}])
+    api.put("queues/zocalo/foo")
+    assert api.get("queues").json() == [{"name": "foo"}]
+
+
+def test_api_iter_queues_paginated(requests_mock, rmqapi):
+    pages = [
+        {
+            "items": [
+                {"name": f"dlq.q{i}", "messages": i} for i in range(2 * p, 2 * p + 2)
+            ],
+            "page": p + 1,
+            "page_count": 2,
+            "page_size": 2,
+        }
+        for p in range(2)
+    ]
+    requests_mock.get("/api/queues/zocalo", [{"json": page} for page in pages])
+    queues = rmqapi.iter_queues(
+        "zocalo",
+        pattern=r"^dlq\.",
+        use_regex=True,
+        columns=["name", "messages"],
+        page_size=2,
+    )
+    assert next(queues) == rabbitmq.QueueSummary(name="dlq.q0", messages=0)
+    assert requests_mock.call_count == 1
+    assert [q.name for q in queues] == ["dlq.q1", "dlq.q2", "dlq.q3"]
+    assert requests_mock.call_count == 2
+    assert requests_mock.request_history[0].qs == {
+        "page": ["1"],
+        "page_size": ["2"],
+        "name": ["^dlq\\."],
+        "use_regex": ["true"],
+        "columns": ["name,messages"],
+    }
+    assert requests_mock.request_history[1].qs["page"] == ["2"]
+
+
+def test_api_queues_with_columns(requests_mock, rmqapi):
+    requests_mock.get(
+        "/api/queues",
+        json={
+            "items": [{"name": "foo", "messages": 3, "message_stats": {"ack": 1}}],
+            "page": 1,
+            "page_count": 1,
+        },
+    )
+    (queue,) = rmqapi.queues(columns=["name", "messages", "message_stats.ack"])
+    assert queue.name == "foo"
+    assert queue.messages == 3
+    assert queue.message_stats == {"ack": 1}
+
+
+def test_queue_pages():
+    pages = rabbitmq.QueuePages(page_size=10)
+    assert pages.endpoint == "queues"
+    assert pages.params() == {"page_size": 10, "page": 1}
+    (queue,) = pages.parse(
+        {
+            "items": [{"name": "foo", "vhost": "/", "exclusive": False}],
+            "page": 1,
+            "page_count": 2,
+        }
+    )
+    assert isinstance(queue, rabbitmq.QueueInfo)
+    assert not pages.done
+    assert pages.params()["page"] == 2
+    assert pages.parse({"items": [], "page": 2, "page_count": 2}) == []
+    assert pages.done
+
+    # Servers without pagination return all queues at once
+    pages = rabbitmq.QueuePages("zocalo/test", columns=["name"])
+    assert pages.endpoint == "queues/zocalo%2Ftest"
+    assert pages.parse([{"name": "foo"}, {"name": "bar"}]) == [
+        rabbitmq.QueueSummary(name="foo"),
+        rabbitmq.QueueSummary(name="bar"),
+    ]
+    assert pages.done
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import http.server
+import json
+import threading
+
+import pytest
+import requests
+
+from zocalo.util import rabbitmq as rmq
+from zocalo.util.rabbitmq_async import AsyncRabbitMQAPI
+
+NODES = [
+    {
+        "name": "rabbit@pooh",
+        "mem_limit": 80861855744,
+        "mem_alarm": False,
+        "mem_used": 143544320,
+        "disk_free_limit": 50000000,
+        "disk_free_alarm": False,
+        "disk_free": 875837644800,
+        "fd_total": 32768,
+        "fd_used": 56,
+        "io_file_handle_open_attempt_count": 647,
+        "sockets_total": 29401,
+        "sockets_used": 0,
+        "gc_num": 153378077,
+        "gc_bytes_reclaimed": 7998215046336,
+        "proc_total": 1048576,
+        "proc_used": 590,
+        "run_queue": 1,
+        "running": True,
+        "type": "disc",
+    }
+]
+
+QUEUES = [
+    {
+        "name": f"queue{i}",
+        "vhost": "zocalo",
+        "durable": True,
+        "auto_delete": False,
+        "exclusive": False,
+        "arguments": {},
+        "messages": i,
+    }
+    for i in range(5)
+]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        self.server.requests.append(self.path)
+        expected = base64.b64encode(b"guest:guest").decode()
+        if self.headers.get("Authorization") != f"Basic {expected}":
+            self._reply(401, {"error": "not_authorised"})
+        elif self.path == "/api/nodes":
+            self._reply(200, NODES)
+        elif self.path.startswith("/api/queues/zocalo?"):
+            page = int(self.path.split("page=")[1].split("&")[0])
+            self._reply(
+                200,
+                {"items": QUEUES[(page - 1) * 2 : page * 2], "page_count": 3},
+                chunked=True,
+            )
+        elif self.path == "/api/queues":
+            self._reply(200, QUEUES)
+        elif self.path == "/api/bindings/zocalo":
+            self._reply(
+                200,
+                [
+                    {
+                        "source": "",
+                        "vhost": "zocalo",
+                        "destination": "queue0",
+                        "destination_type": "queue",
+                        "routing_key": "queue0",
+                        "arguments": {},
+                        "properties_key": "queue0",
+                    }
+                ],
+            )
+        else:
+            self._reply(404, {"error": "Object Not Found"})
+
+    def _reply(self, status, data, chunked=False):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(0, len(body), 16):
+                chunk = body[i : i + 16]
+                self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        else:
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.clients = set()
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _api(server, **kwargs):
+    return AsyncRabbitMQAPI(
+        f"http://127.0.0.1:{server.server_address[1]}/api",
+        "guest",
+        "guest",
+        timeout=5,
+        **kwargs,
+    )
+
+
+def test_api_nodes_and_queues(server):
+    async def main():
+        async with _api(server) as api:
+            return await asyncio.gather(api.nodes(), api.queues())
+
+    nodes, queues = asyncio.run(main())
+    assert [n.name for n in nodes] == ["rabbit@pooh"]
+    assert isinstance(nodes[0], rmq.NodeInfo)
+    assert [q.name for q in queues] == [f"queue{i}" for i in range(5)]
+    assert isinstance(queues[0], rmq.QueueInfo)
+
+
+def test_api_bindings(server):
+    async def main():
+        async with _api(server) as api:
+            return await api.bindings(vhost="zocalo")
+
+    (binding,) = asyncio.run(main())
+    assert binding.destination == "queue0"
+    assert binding.destination_type == rmq.DestinationType.QUEUE
+
+
+def test_api_iter_queues_reads_chunked_pages(server):
+    async def main():
+        async with _api(server) as api:
+            return [
+                q
+                async for q in api.iter_queues(
+                    "zocalo", columns=["name", "messages"], page_size=2
+                )
+            ]
+
+    queues = asyncio.run(main())
+    assert [q.name for q in queues] == [f"queue{i}" for i in range(5)]
+    assert all(isinstance(q, rmq.QueueSummary) for q in queues)
+    assert len(server.requests) == 3
+
+
+def test_api_reuses_connections(server):
+    async def main():
+        async with _api(server, max_connections=2) as api:
+            for _ in range(3):
+                await asyncio.gather(*(api.nodes() for _ in range(4)))
+
+    asyncio.run(main())
+    assert len(server.requests) == 12
+    assert len(server.clients) <= 2
+
+
+def test_api_raises_on_error_status(server):
+    async def main():
+        async with _api(server) as api:
+            await api.nodes("rabbit@nowhere")
+
+    with pytest.raises(requests.HTTPError) as e:
+        asyncio.run(main())
+    assert e.value.response.status_code == 404
+
+
+def test_api_rejects_incorrect_credentials(server):
+    async def main():
+        async with AsyncRabbitMQAPI(
+            f"http://127.0.0.1:{server.server_address[1]}/api", "guest", "wrong"
+        ) as api:
+            await api.nodes()
+
+    with pytest.raises(requests.HTTPError) as e:
+        asyncio.run(main())
+    assert e.value.response.status_code == 401
+
+
+def test_api_shares_the_synchronous_session(server):
+    url = f"http://127.0.0.1:{server.server_address[1]}/api"
+    api = AsyncRabbitMQAPI(url, "guest", "guest", retries=3)
+    assert api._session is rmq.RabbitMQAPI(url, "guest", "guest", retries=3)._session
@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from unittest import mock
+
+import pytest
+
+from zocalo.util import ratelimit
+from zocalo.util.ratelimit import TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    monkeypatch.setattr(ratelimit.time, "sleep", mock.Mock(side_effect=sleep))
+    return now
+
+
+def test_token_bucket_allows_bursts_then_limits_rate(clock):
+    bucket = TokenBucket(10, burst=5)
+    assert [bucket.acquire() for _ in range(5)] == [0] * 5
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert bucket.acquire() == pytest.approx(0.1)
+    assert not bucket.try_acquire()
+    clock[0] += 1
+    assert bucket.try_acquire(5)
+    assert not bucket.try_acquire()
+
+
+def test_token_bucket_rejects_invalid_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from zocalo.util import resources
+
+pytestmark = pytest.mark.skipif(
+    not os.path.isdir("/proc/self"), reason="requires /proc filesystem"
+)
+
+
+def test_process_tree_includes_child_processes():
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(10)"])
+    try:
+        tree = resources.process_tree()
+        assert tree[0].pid == os.getpid()
+        assert child.pid in {p.pid for p in tree[1:]}
+        assert all(p.rss > 0 for p in tree)
+    finally:
+        child.kill()
+        child.wait()
+
+
+def test_read_process_stats_of_missing_process():
+    assert resources.read_process_stats(2**22 + 1) is None
+
+
+def test_resource_sampler_summary():
+    samples = []
+    sampler = resources.ResourceSampler(interval=0.1, callback=samples.append)
+    subprocess.run(
+        [sys.executable, "-c", "x = bytearray(20_000_000); print(len(x))"],
+        check=True,
+        capture_output=True,
+    )
+    time.sleep(0.2)
+    sampler.shutdown()
+    sampler.join(5)
+    assert not sampler.is_alive()
+
+    assert samples
+    assert samples[-1] == sampler.latest
+    assert set(samples[-1]) == {
+        "cpu_time",
+        "rss",
+        "peak_rss",
+        "io_read_bytes",
+        "io_write_bytes",
+        "processes",
+    }
+    summary = sampler.summary()
+    assert summary["samples"] == len(samples)
+    assert summary["cpu_time"] > 0
+    assert summary["peak_rss"] >= summary["mean_rss"] > 0
+    assert summary["io_read_bytes"] > 0
+
+
+def test_resource_sampler_reports_peaks_between_samples():
+    sampler = resources.ResourceSampler(interval=60)
+    subprocess.run(
+        [sys.executable, "-c", "x = b'x' * 200_000_000"],
+        check=True,
+    )
+    sample = sampler.sample()
+    sampler.shutdown()
+    sampler.join(5)
+    # The child process was never sampled, but its peak is still reported
+    assert sample["peak_rss"] >= 200_000_000 > sample["rss"]
+    assert sampler.summary()["peak_rss"] >= 200_000_000